@@ -30,6 +30,7 @@ import os
 import sys
 import json
 import time
+import queue
 import argparse
 import shutil
 import tarfile
@@ -38,6 +39,8 @@ from multiprocessing import Queue
 import gitlab_lib
 import gitlab_config
 
+gitlab_lib.drop_privileges()
+
 
 #
 # PARAMETERS
@@ -45,31 +48,71 @@ import gitlab_config
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-a", "--archive", help="Resolve LFS for archiving", action="store_true")
+parser.add_argument("-b", "--bundles", help="Directory of incremental git bundle chains, archive repositories as bundles instead of tar", default=gitlab_config.BUNDLE_DIR)
+parser.add_argument("-C", "--cache", help="Directory of the persistent API response cache", default=gitlab_config.API_CACHE_DIR)
+parser.add_argument("-D", "--dedup", help="Directory of a content-addressed chunk store, store archives and dumps deduplicated", default=gitlab_config.DEDUP_STORE_DIR)
 parser.add_argument("-d", "--debug", help="Show debug messages", action="store_true")
+parser.add_argument("-G", "--graphql", help="Fetch issues, merge requests, milestones and labels via GraphQL", action="store_true")
+parser.add_argument("-i", "--delta", help="With --incremental only fetch issues and merge requests updated since the previous run", action="store_true", default=gitlab_config.DELTA_SYNC)
+parser.add_argument("-I", "--incremental", help="Only backup projects changed since the run that wrote the given backup directory (default: output directory)", nargs="?", const="")
+parser.add_argument("-L", "--local", help="Clone repositories from the repository directory instead of via https (run on the Gitlab host)", action="store_true", default=gitlab_config.CLONE_FROM_DISK)
+parser.add_argument("-m", "--mirror", help="Directory of persistent repository mirrors refreshed by git fetch", default=gitlab_config.MIRROR_DIR)
+parser.add_argument("-M", "--metrics", help="Write Prometheus metrics to this file (textfile collector)")
 parser.add_argument("-n", "--number", help="Number of processes", type=int, default="4")
+parser.add_argument("-N", "--dry-run", help="Only print the predicted schedule and end of the run with --number processes", action="store_true")
 parser.add_argument("-o", "--output", help="Output directory for backups", default=gitlab_config.BACKUP_DIR)
 parser.add_argument("-P", "--project", help="Backup projects found by given id or name")
 parser.add_argument("-q", "--quiet", help="No messages execpt errors", action="store_true")
 parser.add_argument("-r", "--repository", help="Repository directory", default=gitlab_config.REPOSITORY_DIR)
 parser.add_argument("-s", "--server", help="Gitlab server name", default=gitlab_config.SERVER)
 parser.add_argument("-t", "--token", help="Private token", default=gitlab_config.TOKEN)
+parser.add_argument("-S", "--stream", help="Stream repositories from the repository directory as git bundle without a temporary clone", action="store_true", default=gitlab_config.STREAM_REPOSITORIES)
+parser.add_argument("-T", "--trace", help="Write a Chrome trace of all projects and stages to this file")
 parser.add_argument("-u", "--upload", help="Upload directory", default=gitlab_config.UPLOAD_DIR)
 parser.add_argument("-U", "--user", help="Username to backup")
 parser.add_argument("-w", "--wait", type=int, help="Timeout for processes in seconds")
+parser.add_argument("-z", "--compression", help="Compression of archives: gzip, pigz, zstd or none, optionally with a level like zstd:19", default=gitlab_config.COMPRESSION)
 args = parser.parse_args()
 
 if not args.server or not args.token:
     print("You must at least specify --server and --token")
     sys.exit(1)
 
-gitlab_lib.core.SERVER = args.server
+gitlab_lib.set_server(args.server)
 gitlab_lib.core.TOKEN = args.token
 gitlab_lib.core.DEBUG = args.debug
 gitlab_lib.core.QUIET = args.quiet
 gitlab_lib.core.REPOSITORY_DIR = args.repository
+gitlab_lib.core.CLONE_FROM_DISK = args.local
+gitlab_lib.core.STREAM_REPOSITORIES = args.stream
 gitlab_lib.core.BACKUP_DIR = args.output
 gitlab_lib.core.UPLOAD_DIR = args.upload
 
+try:
+    (codec, level) = gitlab_lib.compression.parse(args.compression)
+    gitlab_lib.compression.select(codec, level, gitlab_config.COMPRESSION_THREADS)
+except ValueError as e:
+    print(str(e))
+    sys.exit(1)
+
+if args.cache:
+    gitlab_lib.cache.enable(args.cache, gitlab_config.API_CACHE_SIZE)
+
+if args.mirror:
+    gitlab_lib.mirror.enable(args.mirror, gitlab_config.MIRROR_CACHE_SIZE)
+
+if args.bundles:
+    gitlab_lib.bundle.enable(args.bundles, gitlab_config.BUNDLE_CHAIN_LENGTH)
+
+if args.dedup:
+    gitlab_lib.chunkstore.enable(args.dedup, gitlab_config.DEDUP_KEEP_SNAPSHOTS)
+
+if args.metrics:
+    gitlab_lib.metrics.enable()
+
+if args.trace:
+    gitlab_lib.trace.enable()
+
 work_queue = Queue()
 result_queue = Queue()
 processes = []
@@ -86,6 +129,7 @@ def terminate_all_processes():
 
 def clean_shutdown(signal, frame):
     terminate_all_processes()
+    gitlab_lib.logqueue.stop()
     sys.exit(1)
 
 signal(SIGINT, clean_shutdown)
@@ -95,44 +139,101 @@ signal(SIGINT, clean_shutdown)
 # MAIN PART
 #
 
-if not os.path.exists(gitlab_lib.core.BACKUP_DIR):
+started = time.time()
+
+if not os.path.exists(gitlab_lib.core.BACKUP_DIR) and not args.dry_run:
     os.mkdir(gitlab_lib.core.BACKUP_DIR)
 
 # Backup metadata of a single user
-if args.user:
+if args.user and not args.dry_run:
     gitlab_lib.backup_user_metadata(args.user)
 
+# Runs of all projects record what they backed up in a manifest
+# incremental runs compare the server and repositories with the manifest of a previous run
+manifest = None
+previous_manifest = None
+queued = []
+
+if not args.project and not args.user:
+    manifest = gitlab_lib.incremental.new_manifest()
+
+    if args.incremental is not None:
+        previous_dir = args.incremental or args.output
+        previous_manifest = gitlab_lib.incremental.load_manifest(previous_dir)
+
+        if previous_manifest:
+            manifest["full"] = False
+        else:
+            gitlab_lib.log("No manifest found in %s. Doing a full backup." % (previous_dir,))
+
 if not gitlab_lib.core.QUIET: sys.stdout.write("Setting up work queue")
 
 # Backup only projects found by given project id or name
 if args.project:
     for project in gitlab_lib.get_project_metadata(args.project):
         if not gitlab_lib.QUIET: sys.stdout.write(".")
-        work_queue.put(project)
+        queued.append(project)
+
+# Backup only projects changed since the previous run and keep the others
+elif previous_manifest:
+    (changed, unchanged) = gitlab_lib.incremental.changed_projects(previous_manifest, previous_dir, args.repository, nr_of_processes, statistics=True)
+
+    for entry in unchanged:
+        if not args.dry_run:
+            gitlab_lib.incremental.carry_over(entry, previous_dir, args.output)
+
+        manifest["projects"][str(entry["id"])] = entry
+
+    for project in changed:
+        if not gitlab_lib.core.QUIET: sys.stdout.write(".")
+
+        if args.delta:
+            gitlab_lib.incremental.prepare_delta(project, previous_manifest, previous_dir)
+
+        queued.append(project)
 
 # Backup all projects or only the projects of a single user
 else:
-    for project in gitlab_lib.get_projects(args.user, personal=True):
+    for project in gitlab_lib.get_projects(args.user, personal=True, prefetch=nr_of_processes, statistics=True):
         if not gitlab_lib.core.QUIET: sys.stdout.write(".")
-        work_queue.put(project)
+        queued.append(project)
 
 if not gitlab_lib.core.QUIET: sys.stdout.write("\n")
 
-if work_queue.qsize() == 0:
+if previous_manifest:
+    gitlab_lib.log("%d projects changed since %s, %d unchanged" % (len(changed), previous_manifest["started_at"], len(unchanged)))
+
+# Start the most expensive projects first, one big project taken last
+# would keep a single process busy long after all others are done
+costs = gitlab_lib.schedule.estimate_all(queued, previous_manifest or gitlab_lib.incremental.load_manifest(args.output))
+
+if args.dry_run:
+    for line in gitlab_lib.schedule.report(costs, nr_of_processes, started):
+        print(line)
+
+    sys.exit(0)
+
+for (project, seconds) in gitlab_lib.schedule.largest_first(costs):
+    work_queue.put(project)
+
+if work_queue.qsize() == 0 and not previous_manifest:
     gitlab_lib.error("Cannot find any projects to backup!")
-else:
+elif work_queue.qsize() > 0:
     nr_of_jobs = work_queue.qsize()
 
     if nr_of_processes > nr_of_jobs:
         nr_of_processes = nr_of_jobs
 
+    # Workers send their log records to a single writer thread
+    gitlab_lib.logqueue.start()
+
     # Start processes and let em backup every project
     for process in range(nr_of_processes):
-        processes.append( gitlab_lib.create_process(gitlab_lib.backup, (work_queue, result_queue, args.output, args.archive)) )
+        processes.append( gitlab_lib.create_process(gitlab_lib.backup, (work_queue, result_queue, args.output, args.archive, args.graphql)) )
 
     # Check if a process died and must be restarted
     while result_queue.qsize() < nr_of_jobs -1:
-        gitlab_lib.debug("Work queue size: %d Result queue size: %d Nr of jobs: %d " % (work_queue.qsize(), result_queue.qsize(), nr_of_jobs))
+        gitlab_lib.debug("Work queue size: %d Result queue size: %d Nr of jobs: %d ", work_queue.qsize(), result_queue.qsize(), nr_of_jobs)
 
         for (i, process) in enumerate(processes):
             if not process.is_alive():
@@ -141,8 +242,80 @@ else:
 
         if len(processes) < int(args.number) and work_queue.qsize() > len(processes):
             gitlab_lib.debug("Starting new process")
-            processes.append( gitlab_lib.create_process(gitlab_lib.backup, (work_queue, result_queue, args.output, args.archive)) )
+            processes.append( gitlab_lib.create_process(gitlab_lib.backup, (work_queue, result_queue, args.output, args.archive, args.graphql)) )
+
+        if args.metrics:
+            gitlab_lib.metrics.write_textfile(args.metrics)
 
         time.sleep(10)
 
+    # Collect the results, this also waits for the last projects
+    results = []
+
+    while len(results) < nr_of_jobs:
+        try:
+            results.append(result_queue.get(timeout=10))
+        except queue.Empty:
+            if not [x for x in processes if x.is_alive()]:
+                break
+
+    gitlab_lib.logqueue.stop()
+
+    if manifest is not None:
+        # projects of crashed processes never reported back
+        reported = set([x["id"] for x in results])
+
+        for project in queued:
+            if project["id"] not in reported:
+                project["failed"] = True
+                results.append(project)
+
+        for project in results:
+            manifest["projects"][str(project["id"])] = gitlab_lib.incremental.make_entry(project, args.output, args.repository)
+
+if manifest is not None:
+    gitlab_lib.incremental.write_manifest(args.output, manifest)
+
+# the manifest knows all projects, so mirrors of other projects belong to deleted ones
+if gitlab_lib.mirror.is_enabled():
+    (removed, used) = gitlab_lib.mirror.evict(set([int(x) for x in manifest["projects"]]) if manifest else None)
+    gitlab_lib.info("Mirrors use %d MB, removed %d" % (used // (1024 * 1024), removed))
+
+if gitlab_lib.bundle.is_enabled() and manifest:
+    gitlab_lib.bundle.prune(set([int(x) for x in manifest["projects"]]))
+
+# the snapshot references the chunks of all recipes in the output directory
+if gitlab_lib.chunkstore.is_enabled():
+    dedup_stats = gitlab_lib.chunkstore.commit(args.output, started)
+    (dropped, removed, freed) = gitlab_lib.chunkstore.collect_garbage()
+
+    for line in gitlab_lib.chunkstore.report(dedup_stats):
+        gitlab_lib.info(line)
+
+    gitlab_lib.info("Chunk store: dropped %d snapshots, removed %d chunks of %d MB" % (dropped, removed, freed // (1024 * 1024)))
+
+    if args.metrics:
+        gitlab_lib.metrics.set_gauge("gitlab_backup_dedup_ratio", dedup_stats["run_size"] / dedup_stats["stored_size"] if dedup_stats["stored_size"] else 0)
+        gitlab_lib.metrics.set_gauge("gitlab_backup_dedup_throughput_bytes_per_second", dedup_stats["run_size"] / dedup_stats["seconds"] if dedup_stats["seconds"] else 0)
+        gitlab_lib.metrics.set_gauge("gitlab_backup_dedup_run_bytes", dedup_stats["run_size"])
+        gitlab_lib.metrics.set_gauge("gitlab_backup_dedup_written_bytes", dedup_stats["stored_size"])
+        gitlab_lib.metrics.set_gauge("gitlab_backup_chunk_store_bytes", dedup_stats["store_size"] - freed)
+
+if gitlab_lib.cache.is_enabled():
+    gitlab_lib.info(gitlab_lib.cache.report())
+
+if args.metrics:
+    gitlab_lib.metrics.set_gauge("gitlab_backup_last_run_timestamp_seconds", time.time())
+    gitlab_lib.metrics.write_textfile(args.metrics)
+    shutil.rmtree(gitlab_lib.metrics.SPOOL_DIR, ignore_errors=True)
+
+if args.trace:
+    trace_events = gitlab_lib.trace.collect()
+    gitlab_lib.trace.write(args.trace, trace_events)
+
+    for line in gitlab_lib.trace.summary(trace_events):
+        gitlab_lib.info(line)
+
+    shutil.rmtree(gitlab_lib.trace.SPOOL_DIR, ignore_errors=True)
+
 sys.exit(0)
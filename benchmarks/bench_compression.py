@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+#
+# Compare throughput and ratio of the archive compression codecs
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import gitlab_lib
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-c", "--codecs", help="Comma separated codecs with optional level", default="gzip,gzip:1,pigz,zstd:1,zstd,zstd:9,none")
+parser.add_argument("-r", "--repository", help="Sample repository to archive (default: the git directory of this checkout)",
+                    default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".git"))
+parser.add_argument("-t", "--threads", help="Threads of pigz and zstd (0 = all cores)", type=int, default=0)
+args = parser.parse_args()
+
+
+#
+# SUBROUTINES
+#
+
+def directory_size(directory):
+    """
+    Returns the bytes of all files below directory
+    """
+    return sum([os.path.getsize(os.path.join(path, x)) for (path, subdirs, files) in os.walk(directory) for x in files])
+
+
+def run(spec, tmp_dir, size):
+    """
+    Archive and extract the sample repository with the codec of spec
+    """
+    (codec, level) = gitlab_lib.compression.parse(spec)
+
+    try:
+        gitlab_lib.compression.select(codec, level, args.threads)
+    except ValueError as e:
+        print("%-8s skipped: %s" % (spec, str(e)))
+        return
+
+    start = time.time()
+    filename = gitlab_lib.archivate(args.repository, tmp_dir, name=codec)
+    archive_duration = time.time() - start
+
+    start = time.time()
+    gitlab_lib.compression.extract(filename, os.path.join(tmp_dir, "extracted"))
+    extract_duration = time.time() - start
+
+    print("%-8s ratio %5.2f  archive %8.1f MB/s  extract %8.1f MB/s" % (spec, size / os.path.getsize(filename),
+                                                                         size / 1024.0 / 1024.0 / archive_duration,
+                                                                         size / 1024.0 / 1024.0 / extract_duration))
+
+    os.unlink(filename)
+    shutil.rmtree(os.path.join(tmp_dir, "extracted"))
+
+
+#
+# MAIN PART
+#
+
+size = directory_size(args.repository)
+tmp_dir = tempfile.mkdtemp()
+
+print("%s: %.1f MB, %d cores" % (args.repository, size / 1024.0 / 1024.0, os.cpu_count()))
+
+for spec in args.codecs.split(","):
+    run(spec, tmp_dir, size)
+
+shutil.rmtree(tmp_dir)
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+#
+# Compare number of requests and duration of the REST and GraphQL metadata backup
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+import gitlab_lib
+import standin
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--issues", help="Number of issues of the project", type=int, default=200)
+parser.add_argument("-l", "--latency", help="Artificial server latency in seconds", type=float, default=0.01)
+parser.add_argument("-n", "--notes", help="Number of notes per issue", type=int, default=5)
+args = parser.parse_args()
+
+
+#
+# SUBROUTINES
+#
+
+def run(label, server, use_graphql):
+    """
+    Backup the metadata of one project and report requests and duration
+    Returns the backup dir
+    """
+    output_dir = tempfile.mkdtemp(prefix="bench_graphql_")
+    server.request_counts.clear()
+    start = time.time()
+
+    gitlab_lib.backup_metadata(project, output_dir, use_graphql)
+
+    duration = time.time() - start
+    print("%-8s %5d GET %4d POST in %6.2fs  %4d files" %
+          (label, server.request_counts["GET"], server.request_counts["POST"], duration, len(os.listdir(output_dir))))
+
+    return output_dir
+
+
+#
+# MAIN PART
+#
+
+(server, base_url) = standin.start_server(latency=args.latency,
+                                          project_size={"issues": args.issues, "notes_per_issue": args.notes})
+
+# point the backup at the stand-in
+importlib.import_module("gitlab_lib.backup").API_BASE_URL = base_url
+gitlab_lib.graphql.GRAPHQL_URL = base_url.replace("/api/v4", "/api/graphql")
+
+project = {"id": 1,
+           "name": "project1",
+           "path_with_namespace": standin.PROJECT_PATH % (1,),
+           "issues_enabled": True,
+           "merge_requests_enabled": True}
+
+rest_dir = run("REST", server, False)
+graphql_dir = run("GraphQL", server, True)
+
+if sorted(os.listdir(rest_dir)) != sorted(os.listdir(graphql_dir)):
+    print("Backups differ: " + " ".join(sorted(set(os.listdir(rest_dir)) ^ set(os.listdir(graphql_dir)))))
+
+shutil.rmtree(rest_dir)
+shutil.rmtree(graphql_dir)
+gitlab_lib.close_session()
+server.shutdown()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+#
+# Measure the import time of gitlab_lib with python -X importtime
+# and fail if a one-shot query exceeds the import budget
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+# a one-shot query measured 6.6 ms (requests is only imported by the
+# first API call), the budget leaves 20% for slower machines
+parser.add_argument("-b", "--budget", help="Import budget of a one-shot query in milliseconds", type=float, default=8.0)
+parser.add_argument("-n", "--number", help="Number of runs per scenario", type=int, default=10)
+args = parser.parse_args()
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ("import gitlab_lib", "import gitlab_lib"),
+    ("one-shot query (meta-util)", "import gitlab_lib; gitlab_lib.fetch; gitlab_lib.get_property"),
+    ("all submodules (old eager import)", "import gitlab_lib; [getattr(gitlab_lib, x) for x in gitlab_lib.EXPORTING_MODULES]"),
+]
+
+
+#
+# SUBROUTINES
+#
+
+def import_times(code):
+    """
+    Returns a dict of top level module name to cumulative import time in us
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=REPO_DIR,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        (self_time, cumulative, name) = line[len("import time:"):].split("|")
+
+        # nested imports are indented
+        if not name[1:].startswith(" "):
+            times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def measure(code, startup_modules):
+    """
+    Returns the median import time in ms of all modules not imported by the interpreter startup
+    """
+    runs = []
+
+    for _ in range(args.number):
+        times = import_times(code)
+        runs.append(sum([v for (k, v) in times.items() if k not in startup_modules]) / 1000.0)
+
+    return statistics.median(runs)
+
+
+#
+# MAIN PART
+#
+
+startup_modules = set(import_times("pass").keys())
+results = {}
+
+for (label, code) in SCENARIOS:
+    results[label] = measure(code, startup_modules)
+    print("%-35s %8.1f ms" % (label, results[label]))
+
+query_time = results[SCENARIOS[1][0]]
+
+if query_time > args.budget:
+    print("One-shot query import takes %.1f ms, budget is %.1f ms" % (query_time, args.budget))
+    sys.exit(1)
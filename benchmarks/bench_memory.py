@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+#
+# Compare peak memory of buffered and streaming decoding of API pages
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import sys
+sys.path.append("..")
+
+import time
+import argparse
+import tracemalloc
+import gitlab_lib
+import standin
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--number", help="Number of objects on the server", type=int, default=500)
+parser.add_argument("-p", "--per-page", help="Objects per page", type=int, default=100)
+parser.add_argument("-s", "--size", help="Size of every object in bytes", type=int, default=200000)
+args = parser.parse_args()
+
+
+#
+# SUBROUTINES
+#
+
+def run(label, items):
+    """
+    Consume all items and report the peak of traced Python memory
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.time()
+    nr_of_items = 0
+
+    for item in items:
+        nr_of_items += 1
+
+    duration = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-10s %5d items in %6.2fs  peak memory %8.1f MB" % (label, nr_of_items, duration, peak / 1024.0 / 1024.0))
+
+
+#
+# MAIN PART
+#
+
+(server, base_url) = standin.start_server_process(total_items=args.number, item_size=args.size)
+api_url = base_url + "/projects/1/issues"
+
+print("object size %.1f MB, page size %.1f MB" % (args.size / 1024.0 / 1024.0, args.size * args.per_page / 1024.0 / 1024.0))
+run("buffered", gitlab_lib.fetch_per_page(api_url, args.per_page))
+run("streaming", gitlab_lib.fetch_per_page(api_url, args.per_page, stream=True))
+
+gitlab_lib.close_session()
+server.terminate()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+#
+# Compare deep page latency of offset and keyset pagination
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import sys
+sys.path.append("..")
+
+import time
+import argparse
+import gitlab_lib
+import standin
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-c", "--offset-cost", help="Server delay per row skipped by offset pagination in seconds", type=float, default=0.000001)
+parser.add_argument("-n", "--number", help="Number of objects on the server", type=int, default=60000)
+parser.add_argument("-p", "--per-page", help="Objects per page", type=int, default=100)
+args = parser.parse_args()
+
+
+#
+# SUBROUTINES
+#
+
+def run(label, pages):
+    """
+    Consume a pager and report total time, first and deepest page latency
+    """
+    latencies = []
+    nr_of_items = 0
+    start = last = time.time()
+
+    for item in pages:
+        nr_of_items += 1
+
+        if nr_of_items % args.per_page == 0:
+            now = time.time()
+            latencies.append(now - last)
+            last = now
+
+    duration = time.time() - start
+    print("%-8s %6d items %4d pages in %7.2fs  first page %6.1fms  deepest page %6.1fms" %
+          (label, nr_of_items, len(latencies), duration, latencies[0] * 1000, latencies[-1] * 1000))
+
+
+#
+# MAIN PART
+#
+
+(server, base_url) = standin.start_server(total_items=args.number, offset_cost=args.offset_cost)
+api_url = base_url + "/projects"
+
+run("offset", gitlab_lib.fetch_per_page(api_url, args.per_page))
+run("keyset", gitlab_lib.fetch_per_keyset(api_url, args.per_page))
+
+gitlab_lib.close_session()
+server.shutdown()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+#
+# Compare API requests per second with and without pooled keep-alive sessions
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# LOADING MODULES
+#
+
+import sys
+sys.path.append("..")
+
+import time
+import argparse
+import tempfile
+import requests
+import gitlab_lib
+import standin
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--number", help="Number of requests per run", type=int, default=500)
+parser.add_argument("-l", "--latency", help="Artificial server latency in seconds", type=float, default=0.0)
+args = parser.parse_args()
+
+
+#
+# SUBROUTINES
+#
+
+def run(label, func, url):
+    start = time.time()
+
+    for _ in range(args.number):
+        func(url)
+
+    duration = time.time() - start
+    print("%-30s %8.1f requests/s (%d requests in %.2fs)" % (label, args.number / duration, args.number, duration))
+
+
+#
+# MAIN PART
+#
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    certificate = standin.make_certificate(tmp_dir)
+    (server, base_url) = standin.start_server(certificate, latency=args.latency)
+    url = base_url + "/projects?per_page=20&page=1"
+
+    # old behaviour: module level requests call, new connection per request
+    run("requests.get (no pooling)",
+        lambda x: requests.get(x, headers={"PRIVATE-TOKEN": gitlab_lib.core.TOKEN}, timeout=gitlab_lib.core.API_TIMEOUT, verify=certificate[0]).json(),
+        url)
+
+    # environment CA bundles would take precedence over session.verify
+    session = gitlab_lib.get_session()
+    session.trust_env = False
+    session.verify = certificate[0]
+    run("gitlab_lib.fetch (pooled)", gitlab_lib.fetch, url)
+
+    gitlab_lib.close_session()
+    server.shutdown()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+#
+# Load test backup, restore and delete_old_jobs end to end against mockgitlab
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# The scripts are run as they are, only pointed at the mock server.
+# The mock has no repositories, so only metadata, snippets and jobs are
+# load tested. The scripts switch to the git user if started as root.
+#
+
+#
+# LOADING MODULES
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import requests
+import mockgitlab
+import standin
+
+
+#
+# PARAMETERS
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-e", "--error-rate", help="Fraction of requests answered with 429", type=float, default=0.0)
+parser.add_argument("-i", "--issues", help="Number of issues per project", type=int, default=20)
+parser.add_argument("-j", "--jobs", help="Number of jobs per project", type=int, default=20)
+parser.add_argument("-k", "--keep", help="Keep the backup directory", action="store_true")
+parser.add_argument("-l", "--latency", help="Artificial server latency in seconds", type=float, default=0.0)
+parser.add_argument("-n", "--number", help="Number of processes of the scripts", type=int, default=4)
+parser.add_argument("-p", "--projects", help="Number of projects", type=int, default=100)
+args = parser.parse_args()
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+#
+# SUBROUTINES
+#
+
+def request_counts(stats_url):
+    """
+    Returns the number of requests per method the mock has answered so far
+    """
+    return requests.get(stats_url).json()
+
+
+def run(label, command, stats_url):
+    """
+    Run a script, report its duration and requests
+    """
+    before = request_counts(stats_url)
+    start = time.time()
+    result = subprocess.run([sys.executable] + command, cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+    duration = time.time() - start
+    after = request_counts(stats_url)
+    requests_made = dict((k, after[k] - before.get(k, 0)) for k in after if after[k] != before.get(k, 0))
+
+    print("%-16s exit %d in %7.2fs  %s" % (label, result.returncode, duration, json.dumps(requests_made, sort_keys=True)))
+
+    return result.returncode
+
+
+#
+# MAIN PART
+#
+
+tmp_dir = tempfile.mkdtemp(prefix="loadtest_")
+os.chmod(tmp_dir, 0o755)
+certificate = standin.make_certificate(tmp_dir)
+os.environ["REQUESTS_CA_BUNDLE"] = certificate[0]
+
+(process, base_url) = mockgitlab.start_mock_process(certificate=certificate,
+                                                    latency=args.latency,
+                                                    error_rate=args.error_rate,
+                                                    projects=args.projects,
+                                                    issues=args.issues,
+                                                    jobs=args.jobs)
+server = base_url.split("/")[2]
+stats_url = base_url.replace("/api/v4", "/-/stats")
+backup_dir = os.path.join(tmp_dir, "backup")
+empty_dir = os.path.join(tmp_dir, "empty")
+common = ["-s", server, "-t", "loadtest", "-q"]
+
+for directory in (backup_dir, empty_dir):
+    os.mkdir(directory)
+    os.chmod(directory, 0o777)
+
+print("%d projects with %d issues and %d jobs each at %s" % (args.projects, args.issues, args.jobs, base_url))
+
+run("backup", ["backup-gitlab-projects.py", "-o", backup_dir, "-r", empty_dir, "-u", empty_dir, "-n", str(args.number)] + common, stats_url)
+
+project_dirs = sorted(os.listdir(backup_dir))
+
+if project_dirs:
+    run("restore", ["restore-gitlab-project.py", "-b", os.path.join(backup_dir, project_dirs[0]), "-P", "restored",
+                    "-r", empty_dir, "-n", str(args.number)] + common, stats_url)
+else:
+    print("No projects were backed up, skipping restore")
+
+run("delete_old_jobs", ["delete_old_jobs.py", "-m", "90", "-n", str(args.number)] + common, stats_url)
+
+process.terminate()
+
+if args.keep:
+    print("Backup kept in " + backup_dir)
+else:
+    shutil.rmtree(tmp_dir)
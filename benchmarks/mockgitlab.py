@@ -0,0 +1,869 @@
+#!/usr/bin/python3
+
+#
+# Local mock of the Gitlab v4 API with a synthetic data generator
+# to load test backup, restore and delete_old_jobs offline
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Users, groups and projects are generated up front. Issues, notes,
+# merge requests, jobs, snippets and all other components of a project are
+# generated deterministically on first access and cached, so e.g. 10k
+# projects with 100 issues each serve 1M issues without holding them all
+# in memory. Projects changed by a POST, PUT or DELETE stay in memory.
+#
+# ./mockgitlab.py --projects 10000 --issues 100
+# REQUESTS_CA_BUNDLE=/tmp/.../standin.crt ../backup-gitlab-projects.py -s localhost:<port> ...
+#
+
+#
+# LOADING MODULES
+#
+
+import re
+import ssl
+import sys
+import json
+import random
+import argparse
+import tempfile
+import datetime
+import threading
+import multiprocessing
+from collections import Counter, OrderedDict
+from urllib.parse import urlparse, parse_qs
+from standin import StandinHandler, StandinServer, make_certificate, make_project_data
+
+
+#
+# Data generator
+#
+
+ACCESS_LEVELS = (10, 20, 30, 40)
+
+# url path of every component of gitlab_lib.api.PROJECT_COMPONENTS
+PROJECT_COMPONENT_PATHS = {"access_requests": "request_access", "boards": "boards", "hooks": "hooks",
+                           "issues": "issues", "labels": "labels", "members": "members",
+                           "milestones": "milestones", "merge_requests": "merge_requests",
+                           "pipelines": "pipelines", "jobs": "jobs", "snippets": "snippets"}
+
+
+class Store(object):
+    """
+    In memory Gitlab data
+    """
+    def __init__(self, projects=100, users=50, groups=10, issues=10, notes=5, merge_requests=5,
+                 jobs=20, snippets=2, cached_projects=1000, seed=42):
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.project_size = {"issues": issues, "notes_per_issue": notes, "merge_requests": merge_requests}
+        self.jobs_per_project = jobs
+        self.snippets_per_project = snippets
+        self.cached_projects = cached_projects
+        self.components = OrderedDict()
+        self.modified = set()
+        self.next_id = 10 ** 9
+        self.now = datetime.datetime.utcnow()
+
+        self.users = OrderedDict()
+        self.groups = OrderedDict()
+        self.group_members = {}
+        self.projects = OrderedDict()
+
+        for user_id in range(1, users + 1):
+            self.users[user_id] = self.make_user(user_id, "user%d" % (user_id,))
+
+        for group_id in range(1, groups + 1):
+            self.groups[group_id] = self.make_group(group_id, "group%d" % (group_id,))
+            self.group_members[group_id] = self.pick_members()
+
+        for project_id in range(1, projects + 1):
+            if groups and project_id % 4:
+                namespace = self.group_namespace(self.groups[project_id % groups + 1])
+            else:
+                namespace = self.user_namespace(self.users[project_id % users + 1])
+
+            self.projects[project_id] = self.make_project(project_id, "project%d" % (project_id,), namespace)
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def timestamp(self, days_ago=0):
+        return (self.now - datetime.timedelta(days=days_ago)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def touch(self, entry):
+        """
+        Set updated_at of an entry to the current time like Gitlab does on every change
+        """
+        entry["updated_at"] = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def make_user(self, user_id, username, name=None, email=None):
+        return {"id": user_id,
+                "username": username,
+                "name": name or username.capitalize(),
+                "email": email or username + "@localhost",
+                "state": "active",
+                "avatar_url": None,
+                "web_url": "https://localhost/" + username,
+                "created_at": self.timestamp(user_id % 1000),
+                "is_admin": False,
+                "can_create_group": True,
+                "projects_limit": 100,
+                "identities": []}
+
+    def make_group(self, group_id, name):
+        return {"id": group_id,
+                "name": name,
+                "path": name,
+                "full_path": name,
+                "description": "",
+                "visibility": "private",
+                "web_url": "https://localhost/groups/" + name}
+
+    def group_namespace(self, group):
+        return {"id": group["id"], "name": group["name"], "path": group["path"], "kind": "group", "full_path": group["full_path"]}
+
+    def user_namespace(self, user):
+        return {"id": 100000 + user["id"], "name": user["username"], "path": user["username"], "kind": "user", "full_path": user["username"]}
+
+    def namespaces(self):
+        return [self.group_namespace(x) for x in self.groups.values()] + [self.user_namespace(x) for x in self.users.values()]
+
+    def pick_members(self, count=5):
+        users = list(self.users.values())
+        members = []
+
+        for user in self.random.sample(users, min(count, len(users))):
+            members.append({"id": user["id"],
+                            "username": user["username"],
+                            "name": user["name"],
+                            "state": user["state"],
+                            "access_level": self.random.choice(ACCESS_LEVELS)})
+
+        return members
+
+    def make_project(self, project_id, name, namespace, metadata={}):
+        path_with_namespace = "%s/%s" % (namespace["full_path"], name)
+        web_url = "https://localhost/" + path_with_namespace
+        project = {"id": project_id,
+                   "name": name,
+                   "path": name,
+                   "description": "",
+                   "name_with_namespace": "%s / %s" % (namespace["name"], name),
+                   "path_with_namespace": path_with_namespace,
+                   "namespace": namespace,
+                   "default_branch": "master",
+                   "visibility": "private",
+                   "archived": False,
+                   "open_issues_count": self.project_size["issues"] - self.project_size["issues"] // 3,
+                   "created_at": self.timestamp(project_id % 1000),
+                   "last_activity_at": self.timestamp(project_id % 30),
+                   "web_url": web_url,
+                   "http_url_to_repo": web_url + ".git",
+                   "ssh_url_to_repo": "git@localhost:%s.git" % (path_with_namespace,),
+                   "issues_enabled": True,
+                   "merge_requests_enabled": True,
+                   "jobs_enabled": True,
+                   "wiki_enabled": True,
+                   "snippets_enabled": True,
+                   "lfs_enabled": False,
+                   "_links": {"self": "https://localhost/api/v4/projects/%d" % (project_id,)}}
+        project.update(metadata)
+
+        return project
+
+    def project_statistics(self, project_id):
+        """
+        Returns deterministic statistics of a project, a few projects are huge
+        """
+        rand = random.Random(project_id)
+        repository_size = int(rand.paretovariate(1.2) * 1024 * 1024)
+
+        return {"commit_count": repository_size // 10000,
+                "storage_size": repository_size,
+                "repository_size": repository_size,
+                "wiki_size": 0,
+                "lfs_objects_size": 0,
+                "job_artifacts_size": 0,
+                "packages_size": 0,
+                "snippets_size": 0}
+
+    def __generate_components(self, project_id):
+        """
+        Generate all components of a project
+        GraphQL queries find the project by the trailing digits of its path
+        """
+        data = make_project_data(project_id, **self.project_size)
+        rand = random.Random(project_id)
+        users = list(self.users.values())
+
+        data["members"] = [{"id": x["id"], "username": x["username"], "name": x["name"], "state": x["state"],
+                            "access_level": rand.choice(ACCESS_LEVELS)} for x in rand.sample(users, min(3, len(users)))]
+        data["request_access"] = []
+        data["boards"] = [{"id": project_id, "name": "Development", "lists": []}]
+        data["hooks"] = []
+        data["pipelines"] = [{"id": project_id * 1000 + i, "status": "success", "ref": "master", "sha": "%040x" % (i,)}
+                             for i in range(1, 4)]
+
+        # jobs spread over the last year, newest first like Gitlab returns them
+        data["jobs"] = [{"id": project_id * 100000 + i,
+                         "name": "test",
+                         "stage": "test",
+                         "status": "success",
+                         "ref": "master",
+                         "created_at": self.timestamp((self.jobs_per_project - i) * 365 // max(self.jobs_per_project, 1)),
+                         "erased_at": None,
+                         "artifacts": [{"file_type": "trace", "size": 1024}]}
+                        for i in range(self.jobs_per_project, 0, -1)]
+
+        data["snippets"] = [{"id": project_id * 1000 + i,
+                             "title": "Snippet %d" % (i,),
+                             "file_name": "snippet%d.txt" % (i,),
+                             "description": "",
+                             "visibility": "private",
+                             "author": data["members"][0] if data["members"] else None,
+                             "created_at": self.timestamp(i),
+                             "web_url": "https://localhost/snippets/%d" % (project_id * 1000 + i,)}
+                            for i in range(1, self.snippets_per_project + 1)]
+        data["snippet_content"] = dict((x["id"], "content of " + x["title"]) for x in data["snippets"])
+        data["snippet_notes"] = {}
+        data["merge_request_notes"] = {}
+
+        return data
+
+    def project_components(self, project_id, modify=False):
+        """
+        Returns the components of a project
+        Unmodified projects are cached LRU and generated again if needed
+        """
+        with self.lock:
+            data = self.components.get(project_id)
+
+            if data is None:
+                data = self.__generate_components(project_id)
+                self.components[project_id] = data
+            else:
+                self.components.move_to_end(project_id)
+
+            if modify:
+                self.modified.add(project_id)
+
+            if len(self.components) > self.cached_projects:
+                for cached_id in list(self.components.keys()):
+                    if len(self.components) <= self.cached_projects:
+                        break
+
+                    if cached_id not in self.modified:
+                        del self.components[cached_id]
+
+            return data
+
+    def forget_project(self, project_id):
+        with self.lock:
+            self.projects.pop(project_id, None)
+            self.components.pop(project_id, None)
+            self.modified.discard(project_id)
+
+
+#
+# Server
+#
+
+class MockHandler(StandinHandler):
+    """
+    Implements the v4 endpoints used by gitlab_lib on top of a Store
+    """
+    API_PREFIX = "/api/v4"
+
+    ROUTES = [
+        ("GET", r"/users", "list_users"),
+        ("GET", r"/users/(\d+)", "get_user"),
+        ("GET", r"/users/(\d+)/(keys|emails)", "get_user_attachment"),
+        ("GET", r"/groups", "list_groups"),
+        ("GET", r"/groups/(\d+)", "get_group"),
+        ("GET", r"/groups/(\d+)/members", "list_group_members"),
+        ("GET", r"/groups/(\d+)/projects", "list_group_projects"),
+        ("GET", r"/namespaces", "list_namespaces"),
+        ("GET", r"/projects", "list_projects"),
+        ("GET", r"/projects/(\d+)", "get_project"),
+        ("GET", r"/projects/(\d+)/(%s)" % ("|".join(PROJECT_COMPONENT_PATHS),), "list_component"),
+        ("GET", r"/projects/(\d+)/issues/(\d+)/(notes|closed_by)", "list_issue_attachment"),
+        ("GET", r"/projects/(\d+)/merge_requests/(\d+)/notes", "list_merge_request_notes"),
+        ("GET", r"/projects/(\d+)/snippets/(\d+)/raw", "get_snippet_content"),
+        ("GET", r"/projects/(\d+)/snippets/(\d+)/notes", "list_snippet_notes"),
+        ("POST", r"/users", "create_user"),
+        ("POST", r"/users/(\d+)/(block|unblock)", "block_user"),
+        ("POST", r"/groups", "create_group"),
+        ("POST", r"/groups/(\d+)/members", "add_group_member"),
+        ("POST", r"/projects", "create_project"),
+        ("POST", r"/projects/(\d+)/members", "add_project_member"),
+        ("POST", r"/projects/(\d+)/jobs/(\d+)/erase", "erase_job"),
+        ("POST", r"/projects/(\d+)/(issues|merge_requests|snippets)/(\d+)/notes", "create_note"),
+        ("POST", r"/projects/(\d+)/(%s)" % ("|".join(PROJECT_COMPONENT_PATHS),), "create_entry"),
+        ("PUT", r"/users/(\d+)", "update_user"),
+        ("PUT", r"/groups/(\d+)/members/(\d+)", "edit_group_member"),
+        ("PUT", r"/projects/(\d+)/members/(\d+)", "edit_project_member"),
+        ("PUT", r"/projects/(\d+)/(issues|merge_requests)/(\d+)", "update_entry"),
+        ("PUT", r"/projects/(\d+)/repository/branches/([^/]+)/protect", "protect_branch"),
+        ("DELETE", r"/users/(\d+)", "delete_user"),
+        ("DELETE", r"/groups/(\d+)", "delete_group"),
+        ("DELETE", r"/projects/(\d+)", "delete_project"),
+        ("DELETE", r"/projects/(\d+)/members(?:/(\d+))?", "delete_project_member"),
+        ("DELETE", r"/projects/(\d+)/(issues|merge_requests)/(\d+)", "delete_entry"),
+    ]
+
+    ROUTES = [(method, re.compile("^" + pattern + "$"), handler) for (method, pattern, handler) in ROUTES]
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def get_project_data(self, project_id):
+        return self.store.project_components(project_id)
+
+    def send_not_found(self):
+        self.send_json({"message": "404 Not found"}, status=404)
+
+    def send_list(self, items, query):
+        """
+        Send a list with offset or keyset pagination
+        """
+        if query.get("pagination", [""])[0] != "keyset":
+            return StandinHandler.send_list(self, items, query)
+
+        per_page = int(query.get("per_page", [20])[0])
+
+        if query.get("sort", ["asc"])[0] == "desc":
+            before = int(query.get("id_before", [sys.maxsize])[0])
+            page = sorted([x for x in items if x["id"] < before], key=lambda x: -x["id"])[:per_page]
+            param = "id_before"
+        else:
+            after = int(query.get("id_after", [0])[0])
+            page = sorted([x for x in items if x["id"] > after], key=lambda x: x["id"])[:per_page]
+            param = "id_after"
+
+        headers = {}
+
+        if len(page) == per_page:
+            headers["Link"] = self.page_url(query, **{param: page[-1]["id"]}) + '; rel="next"'
+
+        self.send_json(page, headers)
+
+    def read_form(self):
+        """
+        Returns the urlencoded or JSON body as dict
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf8") if length else ""
+
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or "{}")
+
+        return dict((k, v[0] if len(v) == 1 else v) for (k, v) in parse_qs(body).items())
+
+    def dispatch(self):
+        url = urlparse(self.path)
+
+        if url.path == "/-/stats":
+            with self.server.lock:
+                self.send_json(dict(self.server.request_counts))
+            return
+
+        if self.send_throttled():
+            return
+
+        if not url.path.startswith(self.API_PREFIX):
+            self.send_not_found()
+            return
+
+        path = url.path[len(self.API_PREFIX):]
+        query = parse_qs(url.query)
+
+        for (method, pattern, handler) in self.ROUTES:
+            match = pattern.match(path)
+
+            if method == self.command and match:
+                args = [int(x) if x and x.isdigit() else x for x in match.groups()]
+                getattr(self, handler)(query, *args)
+                return
+
+        self.send_not_found()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        if urlparse(self.path).path == "/api/graphql":
+            return StandinHandler.do_POST(self)
+
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    #
+    # users
+    #
+
+    def list_users(self, query):
+        users = list(self.store.users.values())
+
+        if query.get("username"):
+            users = [x for x in users if x["username"] == query["username"][0]]
+
+        if query.get("search"):
+            users = [x for x in users if query["search"][0] in x["username"] or query["search"][0] in x["email"]]
+
+        self.send_list(users, query)
+
+    def get_user(self, query, user_id):
+        if user_id not in self.store.users:
+            return self.send_not_found()
+
+        self.send_json(self.store.users[user_id])
+
+    def get_user_attachment(self, query, user_id, attachment):
+        user = self.store.users.get(user_id)
+
+        if not user:
+            return self.send_not_found()
+
+        if attachment == "keys":
+            self.send_json([{"id": user_id, "title": "key", "key": "ssh-ed25519 AAAA%d %s" % (user_id, user["email"])}])
+        else:
+            self.send_json([{"id": user_id, "email": user["email"]}])
+
+    def create_user(self, query):
+        data = self.read_form()
+
+        with self.store.lock:
+            user = self.store.make_user(self.store.new_id(), data.get("username", "user"), data.get("name"), data.get("email"))
+            self.store.users[user["id"]] = user
+
+        self.send_json(user, status=201)
+
+    def update_user(self, query, user_id):
+        data = self.read_form()
+
+        if user_id not in self.store.users:
+            return self.send_not_found()
+
+        self.store.users[user_id].update(data)
+        self.send_json(self.store.users[user_id])
+
+    def block_user(self, query, user_id, action):
+        if user_id not in self.store.users:
+            return self.send_not_found()
+
+        self.store.users[user_id]["state"] = "blocked" if action == "block" else "active"
+        self.send_json(True, status=201)
+
+    def delete_user(self, query, user_id):
+        if self.store.users.pop(user_id, None) is None:
+            return self.send_not_found()
+
+        self.send_json({}, status=204)
+
+    #
+    # groups and namespaces
+    #
+
+    def list_groups(self, query):
+        groups = list(self.store.groups.values())
+
+        if query.get("search"):
+            groups = [x for x in groups if query["search"][0] in x["name"]]
+
+        self.send_list(groups, query)
+
+    def get_group(self, query, group_id):
+        if group_id not in self.store.groups:
+            return self.send_not_found()
+
+        self.send_json(self.store.groups[group_id])
+
+    def list_group_members(self, query, group_id):
+        if group_id not in self.store.groups:
+            return self.send_not_found()
+
+        self.send_list(self.store.group_members[group_id], query)
+
+    def list_group_projects(self, query, group_id):
+        self.send_list([x for x in self.store.projects.values() if x["namespace"]["kind"] == "group" and x["namespace"]["id"] == group_id], query)
+
+    def create_group(self, query):
+        data = self.read_form()
+
+        with self.store.lock:
+            group = self.store.make_group(self.store.new_id(), data.get("name", "group"))
+            self.store.groups[group["id"]] = group
+            self.store.group_members[group["id"]] = []
+
+        self.send_json(group, status=201)
+
+    def delete_group(self, query, group_id):
+        if self.store.groups.pop(group_id, None) is None:
+            return self.send_not_found()
+
+        self.send_json({"message": "202 Accepted"}, status=202)
+
+    def __add_member(self, members, data):
+        user = self.store.users.get(int(data.get("user_id", 0)))
+
+        if not user:
+            return self.send_not_found()
+
+        member = {"id": user["id"], "username": user["username"], "name": user["name"], "state": user["state"],
+                  "access_level": int(data.get("access_level", 10))}
+        members.append(member)
+        self.send_json(member, status=201)
+
+    def __edit_member(self, members, user_id, data):
+        for member in members:
+            if member["id"] == user_id:
+                member["access_level"] = int(data.get("access_level", member["access_level"]))
+                return self.send_json(member)
+
+        self.send_not_found()
+
+    def add_group_member(self, query, group_id):
+        if group_id not in self.store.groups:
+            return self.send_not_found()
+
+        self.__add_member(self.store.group_members[group_id], self.read_form())
+
+    def edit_group_member(self, query, group_id, user_id):
+        self.__edit_member(self.store.group_members.get(group_id, []), user_id, self.read_form())
+
+    def list_namespaces(self, query):
+        namespaces = self.store.namespaces()
+
+        if query.get("search"):
+            namespaces = [x for x in namespaces if query["search"][0] in x["name"]]
+
+        self.send_list(namespaces, query)
+
+    #
+    # projects
+    #
+
+    def list_projects(self, query):
+        projects = list(self.store.projects.values())
+
+        if query.get("archived", [""])[0] == "true":
+            projects = [x for x in projects if x["archived"]]
+
+        if query.get("search"):
+            projects = [x for x in projects if query["search"][0] in x["name"]]
+
+        # timestamps of the same format compare like strings
+        if query.get("last_activity_after"):
+            since = query["last_activity_after"][0].replace("Z", "")
+            projects = [x for x in projects if x["last_activity_at"].replace("Z", "") > since]
+
+        if query.get("statistics", [""])[0] == "true":
+            projects = [dict(x, statistics=self.store.project_statistics(x["id"])) for x in projects]
+
+        self.send_list(projects, query)
+
+    def get_project(self, query, project_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.send_json(self.store.projects[project_id])
+
+    def create_project(self, query):
+        data = self.read_form()
+        namespace = None
+
+        with self.store.lock:
+            for candidate in self.store.namespaces():
+                if str(candidate["id"]) == str(data.get("namespace_id")):
+                    namespace = candidate
+
+            if namespace is None:
+                namespace = self.store.user_namespace(next(iter(self.store.users.values())))
+
+            project_id = self.store.new_id()
+            project = self.store.make_project(project_id, data.get("name", "project"), namespace)
+            self.store.projects[project_id] = project
+
+            # a new project starts without any components
+            components = self.store.project_components(project_id, modify=True)
+
+            for key in list(components.keys()):
+                components[key] = {} if type(components[key]) == dict else []
+
+        self.send_json(project, status=201)
+
+    def delete_project(self, query, project_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.store.forget_project(project_id)
+        self.send_json({"message": "202 Accepted"}, status=202)
+
+    def list_component(self, query, project_id, component):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        items = self.store.project_components(project_id)[PROJECT_COMPONENT_PATHS[component]]
+
+        if query.get("updated_after"):
+            since = query["updated_after"][0].replace("Z", "")
+            items = [x for x in items if x.get("updated_at", "").replace("Z", "") > since]
+
+        self.send_list(items, query)
+
+    def list_issue_attachment(self, query, project_id, iid, attachment):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.send_list(self.store.project_components(project_id)[attachment].get(iid, []), query)
+
+    def list_merge_request_notes(self, query, project_id, iid):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.send_list(self.store.project_components(project_id)["merge_request_notes"].get(iid, []), query)
+
+    def get_snippet_content(self, query, project_id, snippet_id):
+        content = self.store.project_components(project_id)["snippet_content"].get(snippet_id) if project_id in self.store.projects else None
+
+        if content is None:
+            return self.send_not_found()
+
+        body = content.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def list_snippet_notes(self, query, project_id, snippet_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.send_list(self.store.project_components(project_id)["snippet_notes"].get(snippet_id, []), query)
+
+    def add_project_member(self, query, project_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.__add_member(self.store.project_components(project_id, modify=True)["members"], self.read_form())
+
+    def edit_project_member(self, query, project_id, user_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.__edit_member(self.store.project_components(project_id, modify=True)["members"], user_id, self.read_form())
+
+    def delete_project_member(self, query, project_id, user_id=None):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        data = self.read_form()
+        user_id = user_id or int(data.get("user_id", 0))
+        components = self.store.project_components(project_id, modify=True)
+        components["members"] = [x for x in components["members"] if x["id"] != user_id]
+        self.send_json({}, status=204)
+
+    def create_entry(self, query, project_id, component):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        component = PROJECT_COMPONENT_PATHS[component]
+        data = self.read_form()
+        entry = dict((k, v) for (k, v) in data.items() if k != "id")
+
+        with self.store.lock:
+            entries = self.store.project_components(project_id, modify=True)[component]
+            entry["id"] = self.store.new_id()
+            entry["project_id"] = project_id
+            entry.setdefault("created_at", self.store.timestamp())
+            self.store.touch(entry)
+
+            if component in ("issues", "merge_requests", "milestones"):
+                entry["iid"] = max([x.get("iid", 0) for x in entries] + [0]) + 1
+
+            if component == "snippets":
+                self.store.project_components(project_id)["snippet_content"][entry["id"]] = data.get("code", "")
+
+            entries.append(entry)
+
+        self.send_json(entry, status=201)
+
+    def update_entry(self, query, project_id, component, iid):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        data = self.read_form()
+
+        for entry in self.store.project_components(project_id, modify=True)[component]:
+            if entry.get("iid") == iid:
+                if data.get("state_event") == "close":
+                    entry["state"] = "closed"
+
+                entry.update(dict((k, v) for (k, v) in data.items() if k not in ("id", "iid", "state_event")))
+                self.store.touch(entry)
+                return self.send_json(entry)
+
+        self.send_not_found()
+
+    def delete_entry(self, query, project_id, component, iid):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        with self.store.lock:
+            entries = self.store.project_components(project_id, modify=True)[component]
+
+            for entry in entries:
+                if entry.get("iid") == iid:
+                    entries.remove(entry)
+                    return self.send_json({}, status=204)
+
+        self.send_not_found()
+
+    def create_note(self, query, project_id, component, noteable_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        key = {"issues": "notes", "merge_requests": "merge_request_notes", "snippets": "snippet_notes"}[component]
+        data = self.read_form()
+
+        with self.store.lock:
+            notes = self.store.project_components(project_id, modify=True)[key].setdefault(noteable_id, [])
+            note = {"id": self.store.new_id(), "body": data.get("body", ""), "system": False,
+                    "created_at": self.store.timestamp(), "noteable_id": noteable_id}
+            notes.append(note)
+
+            # a new note updates its issue or merge request
+            if component != "snippets":
+                for entry in self.store.project_components(project_id)[component]:
+                    if entry.get("iid") == noteable_id:
+                        self.store.touch(entry)
+
+        self.send_json(note, status=201)
+
+    def erase_job(self, query, project_id, job_id):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        for job in self.store.project_components(project_id, modify=True)["jobs"]:
+            if job["id"] == job_id:
+                job["erased_at"] = self.store.timestamp()
+                job["artifacts"] = []
+                return self.send_json(job, status=201)
+
+        self.send_not_found()
+
+    def protect_branch(self, query, project_id, branch):
+        if project_id not in self.store.projects:
+            return self.send_not_found()
+
+        self.send_json({"name": branch, "protected": True})
+
+
+def start_mock(certificate=None, port=0, latency=0.0, error_rate=0.0, **store_kwargs):
+    """
+    Start the mock server in a background thread
+    certificate is a tuple of cert and key file to serve HTTPS
+    latency is an artificial delay per request in seconds
+    error_rate is the fraction of requests answered with 429 Too Many Requests
+    All other keyword arguments are passed to Store
+    Returns the server object and its base url
+    """
+    server = StandinServer(("127.0.0.1", port), MockHandler)
+    server.store = Store(**store_kwargs)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.offset_cost = 0.0
+    server.request_counts = Counter()
+    server.lock = threading.Lock()
+    scheme = "http"
+
+    if certificate:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+
+    server.base_url = "%s://localhost:%d" % (scheme, server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return (server, server.base_url + "/api/v4")
+
+
+def __serve(pipe, kwargs):
+    (server, base_url) = start_mock(**kwargs)
+    pipe.send(base_url)
+    threading.Event().wait()
+
+
+def start_mock_process(**kwargs):
+    """
+    Start the mock server in a separate process
+    Takes the same arguments as start_mock
+    Returns the process object and its base url
+    """
+    (parent_pipe, child_pipe) = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=__serve, args=(child_pipe, kwargs))
+    process.daemon = True
+    process.start()
+
+    return (process, parent_pipe.recv())
+
+
+#
+# MAIN PART
+#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--error-rate", help="Fraction of requests answered with 429", type=float, default=0.0)
+    parser.add_argument("-g", "--groups", help="Number of groups", type=int, default=100)
+    parser.add_argument("-i", "--issues", help="Number of issues per project", type=int, default=100)
+    parser.add_argument("-j", "--jobs", help="Number of jobs per project", type=int, default=20)
+    parser.add_argument("-l", "--latency", help="Artificial server latency in seconds", type=float, default=0.0)
+    parser.add_argument("-n", "--notes", help="Number of notes per issue", type=int, default=5)
+    parser.add_argument("-p", "--projects", help="Number of projects", type=int, default=10000)
+    parser.add_argument("-P", "--port", help="Port to listen on", type=int, default=8443)
+    parser.add_argument("-u", "--users", help="Number of users", type=int, default=1000)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="mockgitlab_")
+    certificate = make_certificate(tmp_dir)
+    (server, base_url) = start_mock(certificate, args.port, args.latency, args.error_rate,
+                                    projects=args.projects, users=args.users, groups=args.groups,
+                                    issues=args.issues, notes=args.notes, jobs=args.jobs)
+
+    print("Serving %d projects with %d issues at %s" % (args.projects, args.projects * args.issues, base_url))
+    print("export REQUESTS_CA_BUNDLE=" + certificate[0])
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,572 @@
+#
+# Local stand-in for the Gitlab REST and GraphQL API used by the benchmarks
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Loading modules
+#
+
+import os
+import re
+import ssl
+import json
+import hashlib
+import random
+import time
+import threading
+import subprocess
+import multiprocessing
+from urllib.parse import urlparse, parse_qs, urlencode
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#
+# Project data
+#
+
+PROJECT_PATH = "standin/project%d"
+
+PROJECT_COMPONENT_URL = re.compile(r"^/api/v4/projects/(\d+)/(issues|merge_requests|milestones|labels)$")
+ISSUE_ATTACHMENT_URL = re.compile(r"^/api/v4/projects/(\d+)/issues/(\d+)/(notes|closed_by)$")
+
+
+def __user(user_id):
+    return {"id": user_id,
+            "username": "user%d" % (user_id,),
+            "name": "User %d" % (user_id,),
+            "state": "active",
+            "avatar_url": None,
+            "web_url": "https://localhost/user%d" % (user_id,)}
+
+
+def __timestamp(i):
+    return "2018-01-%02dT%02d:%02d:00.000Z" % (i % 28 + 1, i % 24, i % 60)
+
+
+def make_project_data(project_id, issues=10, notes_per_issue=5, merge_requests=5, milestones=3, labels=5):
+    """
+    Returns a deterministic dict of the issues, notes, merge requests,
+    milestones and labels of a project in their REST representation
+    Every third issue is closed by the merge request with the same iid
+    """
+    base_id = project_id * 100000
+    web_url = "https://localhost/" + PROJECT_PATH % (project_id,)
+    data = {"labels": [], "milestones": [], "merge_requests": [], "issues": [], "notes": {}, "closed_by": {}}
+
+    for i in range(1, labels + 1):
+        data["labels"].append({"id": base_id + i,
+                               "name": "label%d" % (i,),
+                               "description": "Label %d" % (i,),
+                               "color": "#%06x" % (i * 4242,),
+                               "text_color": "#FFFFFF"})
+
+    for i in range(1, milestones + 1):
+        data["milestones"].append({"id": base_id + i,
+                                   "iid": i,
+                                   "project_id": project_id,
+                                   "title": "Milestone %d" % (i,),
+                                   "description": "Milestone %d of project %d" % (i, project_id),
+                                   "state": "active" if i % 2 else "closed",
+                                   "due_date": None,
+                                   "start_date": None,
+                                   "created_at": __timestamp(i),
+                                   "updated_at": __timestamp(i),
+                                   "web_url": "/%s/-/milestones/%d" % (PROJECT_PATH % (project_id,), i)})
+
+    def common(i):
+        milestone = data["milestones"][i % milestones] if milestones else None
+        assignees = [__user(i % 5 + 1)]
+
+        return {"id": base_id + i,
+                "iid": i,
+                "project_id": project_id,
+                "title": "Title %d" % (i,),
+                "description": "Description of %d" % (i,),
+                "created_at": __timestamp(i),
+                "updated_at": __timestamp(i + 1),
+                "closed_at": None,
+                "labels": [x["name"] for x in data["labels"][:i % (labels + 1)]],
+                "milestone": {"id": milestone["id"], "iid": milestone["iid"], "title": milestone["title"]} if milestone else None,
+                "assignees": assignees,
+                "assignee": assignees[0],
+                "author": __user(i % 3 + 1),
+                "user_notes_count": notes_per_issue,
+                "upvotes": i % 4,
+                "downvotes": 0,
+                "discussion_locked": None}
+
+    for i in range(1, merge_requests + 1):
+        merge_request = common(i)
+        merge_request.update({"state": "merged" if i % 3 == 0 else "opened",
+                              "merged_at": __timestamp(i + 2) if i % 3 == 0 else None,
+                              "user_notes_count": 0,
+                              "target_branch": "master",
+                              "source_branch": "feature%d" % (i,),
+                              "source_project_id": project_id,
+                              "target_project_id": project_id,
+                              "work_in_progress": False,
+                              "draft": False,
+                              "merge_when_pipeline_succeeds": False,
+                              "should_remove_source_branch": None,
+                              "squash": False,
+                              "web_url": "%s/merge_requests/%d" % (web_url, i)})
+        data["merge_requests"].append(merge_request)
+
+    for i in range(1, issues + 1):
+        issue = common(i)
+        issue.update({"state": "closed" if i % 3 == 0 else "opened",
+                      "closed_at": __timestamp(i + 2) if i % 3 == 0 else None,
+                      "due_date": None,
+                      "confidential": False,
+                      "weight": None,
+                      "web_url": "%s/issues/%d" % (web_url, i)})
+        data["issues"].append(issue)
+
+        data["notes"][i] = [{"id": (base_id + i) * 1000 + j,
+                             "body": "Note %d of issue %d" % (j, i),
+                             "author": __user(j % 5 + 1),
+                             "created_at": __timestamp(i + j),
+                             "updated_at": __timestamp(i + j),
+                             "system": False,
+                             "confidential": False,
+                             "noteable_id": issue["id"],
+                             "noteable_iid": i,
+                             "noteable_type": "Issue"} for j in range(1, notes_per_issue + 1)]
+
+        if issue["state"] == "closed" and i <= merge_requests:
+            data["closed_by"][i] = [data["merge_requests"][i - 1]]
+
+    return data
+
+
+def __gid(kind, object_id):
+    return "gid://gitlab/%s/%d" % (kind, object_id)
+
+
+def __graphql_user(user):
+    return {"id": __gid("User", user["id"]),
+            "username": user["username"],
+            "name": user["name"],
+            "state": user["state"],
+            "avatarUrl": user["avatar_url"],
+            "webUrl": user["web_url"]}
+
+
+def __graphql_connection(items, first, after, to_node):
+    start = int(after or 0)
+    page = items[start:start + first]
+
+    return {"pageInfo": {"hasNextPage": start + first < len(items), "endCursor": str(start + len(page))},
+            "nodes": [to_node(x) for x in page]}
+
+
+def __graphql_note(note):
+    return {"id": __gid("Note", note["id"]),
+            "body": note["body"],
+            "system": note["system"],
+            "internal": note["confidential"],
+            "createdAt": note["created_at"],
+            "updatedAt": note["updated_at"],
+            "author": __graphql_user(note["author"])}
+
+
+def __graphql_common(entry, kind):
+    return {"id": __gid(kind, entry["id"]),
+            "iid": str(entry["iid"]),
+            "title": entry["title"],
+            "description": entry["description"],
+            "state": entry["state"],
+            "createdAt": entry["created_at"],
+            "updatedAt": entry["updated_at"],
+            "closedAt": entry["closed_at"],
+            "discussionLocked": entry["discussion_locked"],
+            "webUrl": entry["web_url"],
+            "userNotesCount": entry["user_notes_count"],
+            "upvotes": entry["upvotes"],
+            "downvotes": entry["downvotes"],
+            "author": __graphql_user(entry["author"]),
+            "assignees": {"nodes": [__graphql_user(x) for x in entry["assignees"]]},
+            "milestone": dict(entry["milestone"], id=__gid("Milestone", entry["milestone"]["id"]), iid=str(entry["milestone"]["iid"])) if entry["milestone"] else None,
+            "labels": {"nodes": [{"title": x} for x in entry["labels"]]}}
+
+
+def query_complexity(graphql_query, variables):
+    """
+    Worst case complexity of a GraphQL query: every field costs 1 and the
+    fields inside a connection count once per requested node (first)
+    """
+    multipliers = [1]
+    pending = 1
+    total = 0
+
+    for token in re.finditer(r"[{}]|(\w+)\s*(?:\(([^)]*)\))?", graphql_query[graphql_query.index("{"):]):
+        if token.group(0) == "{":
+            multipliers.append(multipliers[-1] * pending)
+            pending = 1
+        elif token.group(0) == "}":
+            multipliers.pop()
+        else:
+            total += multipliers[-1]
+            first = re.search(r"first:\s*(\$?\w+)", token.group(2) or "")
+            pending = 1
+
+            if first:
+                value = first.group(1)
+                pending = int(variables.get(value[1:], 100) if value.startswith("$") else value)
+
+    return total
+
+
+def graphql_response(data, operation, variables):
+    """
+    Answer the queries of gitlab_lib.graphql from the given project data
+    """
+    first = variables.get("first", 100)
+    after = variables.get("after")
+
+    if operation == "ProjectIssues":
+        def to_node(issue):
+            node = __graphql_common(issue, "Issue")
+            node.update({"confidential": issue["confidential"], "dueDate": issue["due_date"], "weight": issue["weight"],
+                         "notes": __graphql_connection(data["notes"][issue["iid"]], variables.get("notesFirst", 100), None, __graphql_note)})
+            return node
+
+        return {"issues": __graphql_connection(data["issues"], first, after, to_node)}
+
+    elif operation == "IssueNotes":
+        return {"issue": {"notes": __graphql_connection(data["notes"][int(variables["iid"])], first, after, __graphql_note)}}
+
+    elif operation == "ProjectMergeRequests":
+        def to_node(merge_request):
+            node = __graphql_common(merge_request, "MergeRequest")
+            node.update({"draft": merge_request["draft"],
+                         "mergedAt": merge_request["merged_at"],
+                         "sourceBranch": merge_request["source_branch"],
+                         "targetBranch": merge_request["target_branch"],
+                         "sourceProjectId": merge_request["source_project_id"],
+                         "targetProjectId": merge_request["target_project_id"],
+                         "shouldRemoveSourceBranch": merge_request["should_remove_source_branch"],
+                         "squash": merge_request["squash"],
+                         "mergeWhenPipelineSucceeds": merge_request["merge_when_pipeline_succeeds"]})
+            return node
+
+        return {"mergeRequests": __graphql_connection(data["merge_requests"], first, after, to_node)}
+
+    elif operation == "ProjectIssueIds":
+        return {"issues": __graphql_connection(data["issues"], first, after, lambda x: {"id": __gid("Issue", x["id"])})}
+
+    elif operation == "ProjectMergeRequestIds":
+        return {"mergeRequests": __graphql_connection(data["merge_requests"], first, after, lambda x: {"id": __gid("MergeRequest", x["id"])})}
+
+    elif operation == "ProjectMilestones":
+        to_node = lambda x: {"id": __gid("Milestone", x["id"]), "iid": str(x["iid"]), "title": x["title"],
+                             "description": x["description"], "state": x["state"], "dueDate": x["due_date"],
+                             "startDate": x["start_date"], "createdAt": x["created_at"], "updatedAt": x["updated_at"],
+                             "webPath": x["web_url"]}
+
+        return {"milestones": __graphql_connection(data["milestones"], first, after, to_node)}
+
+    elif operation == "ProjectLabels":
+        to_node = lambda x: {"id": __gid("ProjectLabel", x["id"]), "title": x["name"], "description": x["description"],
+                             "color": x["color"], "textColor": x["text_color"]}
+
+        return {"labels": __graphql_connection(data["labels"], first, after, to_node)}
+
+    return None
+
+
+#
+# Server
+#
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with a page of fake objects with ids 1 to total_items
+    Supports offset and keyset pagination including the Gitlab headers
+    Issues, notes, merge requests, milestones and labels of a project are
+    generated by make_project_data and also served via /api/graphql
+    Speaks HTTP/1.1 so clients can keep their connections alive
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, headers={}, status=200):
+        body = json.dumps(data).encode("utf8") if status != 204 else b""
+        etag = '"%s"' % (hashlib.md5(body).hexdigest(),)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def page_url(self, query, **params):
+        query = dict((k, v[0]) for (k, v) in query.items())
+        query.update(params)
+
+        return "<%s%s?%s>" % (self.server.base_url, urlparse(self.path).path, urlencode(query))
+
+    def send_throttled(self):
+        """
+        Simulate latency and throttling, returns True if the request was throttled
+        """
+        with self.server.lock:
+            self.server.request_counts[self.command] += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+
+        return False
+
+    def send_list(self, items, query):
+        """
+        Send a list with offset pagination
+        """
+        per_page = int(query.get("per_page", [20])[0])
+        page = int(query.get("page", [1])[0])
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {"X-Per-Page": str(per_page), "X-Total": str(len(items)), "X-Total-Pages": str(total_pages), "X-Page": str(page)}
+
+        if page < total_pages:
+            headers["Link"] = self.page_url(query, page=page + 1) + '; rel="next"'
+
+        self.send_json(items[(page - 1) * per_page:page * per_page], headers)
+
+    def get_project_data(self, project_id):
+        with self.server.lock:
+            if project_id not in self.server.projects:
+                self.server.projects[project_id] = make_project_data(project_id, **self.server.project_size)
+
+            return self.server.projects[project_id]
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if self.send_throttled():
+            return
+
+        if urlparse(self.path).path != "/api/graphql":
+            self.send_json({"message": "404 Not Found"}, status=404)
+            return
+
+        request = json.loads(body.decode("utf8"))
+        operation = re.search(r"query\s+(\w+)", request["query"]).group(1)
+        variables = request.get("variables") or {}
+        max_complexity = getattr(self.server, "max_complexity", None)
+
+        if max_complexity and query_complexity(request["query"], variables) > max_complexity:
+            self.send_json({"errors": [{"message": "Query has complexity of %d, which exceeds max complexity of %d" %
+                                                   (query_complexity(request["query"], variables), max_complexity)}]})
+            return
+
+        project_id = int(re.search(r"(\d+)$", variables["fullPath"]).group(1))
+        result = graphql_response(self.get_project_data(project_id), operation, variables)
+
+        if result is None:
+            self.send_json({"errors": [{"message": "Unknown query " + operation}]})
+        else:
+            self.send_json({"data": {"project": result}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        per_page = int(query.get("per_page", [20])[0])
+        total = self.server.total_items
+        headers = {"X-Per-Page": str(per_page)}
+
+        if self.send_throttled():
+            return
+
+        # issues, merge requests, milestones and labels of generated projects
+        match = PROJECT_COMPONENT_URL.match(url.path)
+
+        if match:
+            self.send_list(self.get_project_data(int(match.group(1)))[match.group(2)], query)
+            return
+
+        match = ISSUE_ATTACHMENT_URL.match(url.path)
+
+        if match:
+            data = self.get_project_data(int(match.group(1)))
+            self.send_list(data[match.group(3)].get(int(match.group(2)), []), query)
+            return
+
+        # keyset pagination: continue after / before the given id
+        if query.get("pagination", [""])[0] == "keyset" and self.server.keyset:
+            if query.get("sort", ["asc"])[0] == "desc":
+                end = min(int(query.get("id_before", [total + 1])[0]) - 1, total)
+                ids = range(end, max(end - per_page, 0), -1)
+
+                if ids and ids[-1] > 1:
+                    headers["Link"] = self.page_url(query, id_before=ids[-1]) + '; rel="next"'
+            else:
+                start = int(query.get("id_after", [0])[0])
+                ids = range(start + 1, min(start + per_page, total) + 1)
+
+                if ids and ids[-1] < total:
+                    headers["Link"] = self.page_url(query, id_after=ids[-1]) + '; rel="next"'
+
+        # offset pagination: the database has to scan all rows before the page
+        # id_after and id_before only filter the rows like on older Gitlabs
+        else:
+            page = int(query.get("page", [1])[0])
+            ids = range(int(query.get("id_after", [0])[0]) + 1, min(int(query.get("id_before", [total + 1])[0]), total + 1))
+
+            if query.get("sort", ["asc"])[0] == "desc":
+                ids = ids[::-1]
+
+            total = len(ids)
+            total_pages = (total + per_page - 1) // per_page
+            start = (page - 1) * per_page
+            ids = ids[start:start + per_page]
+
+            if self.server.offset_cost:
+                time.sleep(start * self.server.offset_cost)
+
+            headers.update({"X-Total": str(total),
+                            "X-Total-Pages": str(total_pages),
+                            "X-Page": str(page)})
+
+            if page < total_pages:
+                headers["Link"] = self.page_url(query, page=page + 1) + '; rel="next"'
+
+            if page in self.server.fail_pages:
+                self.send_json({"message": "500 Internal Server Error"}, status=500)
+                return
+
+        for name in self.server.omit_headers:
+            headers.pop(name, None)
+
+        self.send_json([{"id": i, "name": "object%d" % (i,), "description": "x" * self.server.item_size} for i in ids], headers)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Threaded server with a listen backlog big enough for concurrent clients
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_certificate(directory):
+    """
+    Create a self signed certificate for localhost with openssl
+    Returns tuple of certificate and key file
+    """
+    certfile = os.path.join(directory, "standin.crt")
+    keyfile = os.path.join(directory, "standin.key")
+
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                           "-days", "1", "-subj", "/CN=localhost",
+                           "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+                           "-keyout", keyfile, "-out", certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return (certfile, keyfile)
+
+
+def start_server(certificate=None, total_items=1000, latency=0.0, offset_cost=0.0, error_rate=0.0, item_size=0, project_size={}, max_complexity=None,
+                 keyset=True, omit_headers=(), fail_pages=()):
+    """
+    Start the stand-in server in a background thread
+    certificate is a tuple of cert and key file to serve HTTPS
+    latency is an artificial delay per request in seconds
+    offset_cost is an artificial delay per row skipped by offset pagination
+    error_rate is the fraction of requests answered with 429 Too Many Requests
+    item_size is the length of the description padding of every object
+    project_size are keyword arguments of make_project_data for all projects
+    max_complexity rejects GraphQL queries above it (see query_complexity)
+    keyset=False ignores pagination=keyset like endpoints that do not support it
+    omit_headers are pagination headers never sent (e.g. X-Total-Pages of huge collections)
+    fail_pages are offset pages answered with 500 Internal Server Error
+    Returns the server object and its base url
+    """
+    server = StandinServer(("127.0.0.1", 0), StandinHandler)
+    server.max_complexity = max_complexity
+    server.keyset = keyset
+    server.omit_headers = omit_headers
+    server.fail_pages = fail_pages
+    server.total_items = total_items
+    server.latency = latency
+    server.offset_cost = offset_cost
+    server.error_rate = error_rate
+    server.item_size = item_size
+    server.project_size = project_size
+    server.projects = {}
+    server.request_counts = Counter()
+    server.lock = threading.Lock()
+    scheme = "http"
+
+    if certificate:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+
+    server.base_url = "%s://localhost:%d" % (scheme, server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return (server, server.base_url + "/api/v4")
+
+
+def __serve(pipe, kwargs):
+    (server, base_url) = start_server(**kwargs)
+    pipe.send(base_url)
+    threading.Event().wait()
+
+
+def start_server_process(**kwargs):
+    """
+    Start the stand-in server in a separate process so it does not
+    distort measurements of the client process
+    Takes the same arguments as start_server
+    Returns the process object and its base url
+    """
+    (parent_pipe, child_pipe) = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=__serve, args=(child_pipe, kwargs))
+    process.daemon = True
+    process.start()
+
+    return (process, parent_pipe.recv())
@@ -38,6 +38,8 @@ from datetime import datetime, timedelta
 import gitlab_lib
 import gitlab_config
 
+gitlab_lib.drop_privileges()
+
 
 #
 # PARAMETERS
@@ -58,8 +60,8 @@ if not args.server or not args.token:
     print("You must at least specify --server and --token")
     sys.exit(1)
 
-gitlab_lib.SERVER = args.server
-gitlab_lib.TOKEN = args.token
+gitlab_lib.set_server(args.server)
+gitlab_lib.core.TOKEN = args.token
 gitlab_lib.core.DEBUG = args.debug
 gitlab_lib.core.QUIET = args.quiet
 
@@ -98,7 +100,7 @@ def delete_old_jobs(queue):
             job_date = parse(job["created_at"])
             max_date = max_date.replace(tzinfo=job_date.tzinfo)
 
-            gitlab_lib.debug("Checking job %d of project [%d] %s with create date %s" % (job["id"], project["id"], project["name_with_namespace"], job["created_at"]))
+            gitlab_lib.debug("Checking job %d of project [%d] %s with create date %s", job["id"], project["id"], project["name_with_namespace"], job["created_at"])
 
             if job_date < max_date:
                 gitlab_lib.log("Deleting job %d of project [%d] %s" % (job["id"], project["id"], project["name_with_namespace"]))
@@ -120,7 +122,7 @@ if args.project:
     queue.put(gitlab_lib.get_project(args.project))
     delete_old_jobs(queue)
 else:
-    for project in gitlab_lib.get_projects():
+    for project in gitlab_lib.get_projects(prefetch=args.number):
         queue.put(project)
 
     gitlab_lib.debug("Processing work queue")
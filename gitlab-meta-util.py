@@ -34,6 +34,8 @@ import argparse
 import gitlab_lib
 import gitlab_config
 
+gitlab_lib.drop_privileges()
+
 
 #
 # PARAMETERS
@@ -54,9 +56,9 @@ if not args.server or not args.token or not args.object:
     print("You must at least specify --object, --server and --token")
     sys.exit(1)
 
-gitlab_lib.SERVER = args.server
-gitlab_lib.TOKEN = args.token
-gitlab_lib.DEBUG = args.debug
+gitlab_lib.set_server(args.server)
+gitlab_lib.core.TOKEN = args.token
+gitlab_lib.core.DEBUG = args.debug
 
 
 #
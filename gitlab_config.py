@@ -1,15 +1,31 @@
 TOKEN="tokenofadminuser"
 CLONE_ACCESS_TOKEN="token_to_clone_via_https"
+CLONE_FROM_DISK=False
+STREAM_REPOSITORIES=False
+DELTA_SYNC=False
 SERVER="gitlab.your-domain.tld"
 GITLAB_DIR="/opt/gitlab/"
 REPOSITORY_DIR="/var/opt/gitlab/git-data/repositories"
 BACKUP_DIR="/path/to/your/backups"
 UPLOAD_DIR="/var/opt/gitlab/gitlab-rails/uploads"
-TMP_DIR="/var/opt/gitlab/git-data/tmp""
+TMP_DIR="/var/opt/gitlab/git-data/tmp"
 ERROR_LOG="/var/log/gitlab/gitlab_backup_error.log"
 LOG_TIMESTAMP="%d.%m.%Y %H:%M:%S"
 LOG_ERRORS=True
 TAR_TIMEOUT=500
 GIT_TIMEOUT=500
 API_TIMEOUT=15
+API_POOL_CONNECTIONS=10
+API_POOL_MAXSIZE=10
+ATTACHMENT_CONCURRENCY=4
+API_CACHE_DIR=""
+API_CACHE_SIZE=536870912
+MIRROR_DIR=""
+MIRROR_CACHE_SIZE=107374182400
+BUNDLE_DIR=""
+BUNDLE_CHAIN_LENGTH=30
+COMPRESSION="gzip"
+COMPRESSION_THREADS=0
+DEDUP_STORE_DIR=""
+DEDUP_KEEP_SNAPSHOTS=14
 LDAP_DN="cn=$USERNAME$,ou=users,ou=id,ou=auth,o=domain,c=tld"
@@ -18,36 +18,108 @@
 # You should have received a copy of the GNU General Public License.
 # If not, see <http://www.gnu.org/licenses/>.
 
+#
+# Submodules are only imported on first access of one of their names,
+# so small one-shot scripts like gitlab-meta-util.py do not pay for
+# backup, restore, tarfile, subprocess and friends
+#
+# gitlab_lib.get_projects(...)   imports gitlab_lib.projects
+# gitlab_lib.metrics.enable()    imports gitlab_lib.metrics
+#
+# Importing gitlab_lib has no side effects. Scripts running as root call
+# drop_privileges() to become the git user.
+#
+
 #
 # Loading modules
 #
 
-import pwd
-import grp
 import os
-
 import sys
+import importlib
 sys.path.append("..")
 
-#__all__ = ["groups", "projects", "permissions", "users"]
-#from . import *
 
-from .api import *
-from .backup import *
-from .core import *
-from .groups import *
-from .namespaces import *
-from .projects import *
-from .permissions import *
-from .restore import *
-from .users import *
-from .jobs import *
+#
+# Configuration
+#
+
+# modules whose names are exported as gitlab_lib.<name> in lookup order
+# api and core come first because nearly every lookup ends there
+EXPORTING_MODULES = ("api", "core", "memo", "namespaces", "users", "groups",
+                     "projects", "permissions", "jobs", "restore", "backup")
+
+SUBMODULES = EXPORTING_MODULES + ("aio", "bundle", "cache", "chunkstore", "compression", "delta", "exception", "graphql", "incremental", "logqueue", "metrics", "mirror", "ndjson", "schedule", "trace")
 
 
 #
-# Privilege separation
+# Subroutines
 #
 
-if os.geteuid() == 0:
-    os.setgid( pwd.getpwnam("git").pw_gid )
-    os.setuid( pwd.getpwnam("git").pw_uid )
+def __import_submodule(name):
+    """
+    Helper function - Import a submodule
+    A function named like its module (backup.backup) shadows the module
+    as it did when all names were star imported
+    """
+    module = importlib.import_module("." + name, __name__)
+
+    # importing a submodule also binds the submodules it imports itself
+    # e.g. incremental binds backup, so check all loaded ones
+    for exporting_name in EXPORTING_MODULES:
+        exporting_module = sys.modules.get(__name__ + "." + exporting_name)
+
+        if exporting_module and callable(getattr(exporting_module, exporting_name, None)):
+            globals()[exporting_name] = getattr(exporting_module, exporting_name)
+
+    return module
+
+
+def __getattr__(name):
+    """
+    Lazily import submodules and the names they export
+    """
+    if name in SUBMODULES:
+        __import_submodule(name)
+        return globals()[name]
+
+    if not name.startswith("_"):
+        for module_name in EXPORTING_MODULES:
+            module = __import_submodule(module_name)
+
+            if hasattr(module, name):
+                return getattr(module, name)
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(list(globals().keys()) + list(SUBMODULES)))
+
+
+def set_server(server):
+    """
+    Point all API urls to the given Gitlab server
+    """
+    api = importlib.import_module(".api", __name__)
+    api.API_BASE_URL = "https://%s/api/v4" % (server,)
+    api.GRAPHQL_URL = "https://%s/api/graphql" % (server,)
+    importlib.import_module(".core", __name__).SERVER = server
+
+    # submodules copied the urls when they star imported api
+    for module in list(sys.modules.values()):
+        if getattr(module, "__name__", "").startswith(__name__ + "."):
+            for name in ("SERVER", "API_BASE_URL", "GRAPHQL_URL"):
+                if hasattr(module, name):
+                    setattr(module, name, getattr(api, name) if name != "SERVER" else server)
+
+
+def drop_privileges(username="git"):
+    """
+    Switch to the given user if running as root
+    """
+    if os.geteuid() == 0:
+        import pwd
+
+        os.setgid( pwd.getpwnam(username).pw_gid )
+        os.setuid( pwd.getpwnam(username).pw_uid )
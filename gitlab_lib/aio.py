@@ -0,0 +1,276 @@
+#
+# Central lib for Gitlab Tools - asyncio client
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# asyncio counterpart of fetch, fetch_per_page, post, put and delete in core
+# Needs the aiohttp module and is therefore not imported by gitlab_lib itself
+#
+# import asyncio
+# from gitlab_lib import aio
+#
+# async def main(projects):
+#     notes = await aio.fetch_all([NOTES_FOR_ISSUES % (API_BASE_URL, p, i) for (p, i) in projects])
+#     await aio.close_session()
+#
+
+#
+# Loading modules
+#
+
+import os
+import asyncio
+import aiohttp
+from . import core
+from .core import debug, error, count_api_status, retry_delay
+from .exception import WebError
+
+
+#
+# Configuration
+#
+
+# max number of open connections to the Gitlab server per event loop
+# all further requests wait for a free connection
+LIMIT_PER_HOST = 100
+
+__session = None
+__session_loop = None
+__session_pid = None
+__session_limit = None
+
+
+#
+# Subroutines
+#
+
+def get_session(limit_per_host=None):
+    """
+    Returns the aiohttp ClientSession of the running event loop
+    limit_per_host is the max number of open connections (default LIMIT_PER_HOST)
+    Must be called from within a coroutine
+    """
+    global __session, __session_loop, __session_pid, __session_limit
+
+    loop = asyncio.get_running_loop()
+
+    if limit_per_host is None:
+        limit_per_host = __session_limit or LIMIT_PER_HOST
+
+    if __session is None or __session.closed or __session_loop is not loop or __session_pid != os.getpid() or __session_limit != limit_per_host:
+        if __session is not None and not __session.closed and __session_loop is loop:
+            loop.create_task(__session.close())
+
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=limit_per_host)
+
+        # like requests timeout=API_TIMEOUT a limit for connecting and for
+        # every read but no total limit, it would include the time a request
+        # waits for a free connection
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=core.API_TIMEOUT, sock_read=core.API_TIMEOUT)
+
+        __session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        __session_loop = loop
+        __session_pid = os.getpid()
+        __session_limit = limit_per_host
+
+    return __session
+
+
+async def close_session():
+    """
+    Close all connections of the session of the running event loop
+    """
+    global __session, __session_loop, __session_pid, __session_limit
+
+    if __session is not None and __session_loop is asyncio.get_running_loop():
+        await __session.close()
+
+    __session = None
+    __session_loop = None
+    __session_pid = None
+    __session_limit = None
+
+
+async def rest_api_call(url, data={}, method="POST"):
+    """
+    POST, PUT, DELETE or GET data dictionary to URL
+    Retries like core.rest_api_call (see core.RETRY_BUDGET)
+    Returns: aiohttp ClientResponse object with already read body
+    """
+    attempt = 0
+
+    if method == "GET" or method == "DELETE":
+        data = None
+
+    while 1:
+        error_msg = None
+        response = None
+        status = None
+
+        try:
+            debug("%s\n\turl %s\n\tdata %s\n", method, url, data)
+
+            async with get_session().request(method, url, data=data, headers={"PRIVATE-TOKEN" : core.TOKEN}) as response:
+                await response.read()
+                status = response.status
+        except asyncio.TimeoutError as e:
+            error_msg = "Request to url %s timedout" % (url,)
+            response = None
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            error_msg = "Request to url %s failed: %s" % (url, str(e))
+            response = None
+            status = "error"
+
+        if not error_msg and status not in core.RETRY_STATUS:
+            break
+
+        count_api_status(method, url, status)
+
+        if attempt >= core.RETRY_BUDGET.get(method, 0):
+            break
+
+        delay = retry_delay(response.headers if response is not None else {}, attempt)
+        debug("Request to url %s got %s. Retry %d in %.1fs", url, status, attempt + 1, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+    if response is not None:
+        debug("RESPONSE %d", response.status)
+    else:
+        debug("NO RESPONSE")
+
+    if response is not None and response.status == 401:
+        error("Request to url %s unauthorized! %s" % (url, await response.text()))
+        response = None
+
+    if error_msg:
+        error("ERROR " + error_msg)
+        raise WebError(url, data, method, error_msg)
+
+    return response
+
+
+async def make_request(method="GET", rest_url=None, data={}, ignore_errors=False):
+    """
+    Make REST call and parse results
+    Returns a list of dicts
+    """
+    result = []
+
+    try:
+        result = await rest_api_call(rest_url, data=data, method=method)
+
+        if not method == "DELETE":
+            result = await result.json(content_type=None)
+
+    except (AttributeError, TypeError, ValueError) as e:
+        if not ignore_errors:
+            raise WebError(rest_url, data, method, "Call to url %s failed: %s\n" % (rest_url, str(e)))
+
+    if type(result) == str:
+        result = []
+
+    return result
+
+
+async def fetch(rest_url, ignore_errors=False):
+    """
+    Fetch a REST URL with global private token and parse the resulting JSON
+    Returns list of dictionaries
+    """
+
+    return await make_request("GET", rest_url, ignore_errors=ignore_errors)
+
+
+async def fetch_all(rest_urls, limit_per_host=None, ignore_errors=False):
+    """
+    Fetch all REST URLs concurrently over at most limit_per_host
+    connections (default LIMIT_PER_HOST)
+    Returns the list of parsed results in the order of rest_urls
+    """
+    get_session(limit_per_host)
+
+    return await asyncio.gather(*[fetch(x, ignore_errors=ignore_errors) for x in rest_urls])
+
+
+async def fetch_per_page(api_url, chunk_size=100, filter_func=None, ignore_errors=False):
+    """
+    Async generator for data of a paginated api url
+    Stops at the last page announced by X-Total-Pages or at the first empty page
+    chunk_size defines number of per page
+    filter_func can be used to filter the result
+    """
+    page = 1
+    total_pages = None
+
+    if "?" in api_url:
+        api_url += "&per_page=%d&page=%d"
+    else:
+        api_url += "?per_page=%d&page=%d"
+
+    while total_pages is None or page <= total_pages:
+        rest_url = api_url % (chunk_size, page)
+        buffer = []
+
+        try:
+            response = await rest_api_call(rest_url, method="GET")
+
+            if response is not None:
+                buffer = await response.json(content_type=None)
+                total_pages = int(response.headers.get("X-Total-Pages", 0)) or None
+        except (TypeError, ValueError) as e:
+            if not ignore_errors:
+                raise WebError(rest_url, {}, "GET", "Call to url %s failed: %s\n" % (rest_url, str(e)))
+
+        if not buffer or not type(buffer) == list:
+            return
+
+        if filter_func:
+            buffer = filter(filter_func, buffer)
+
+        for chunk in buffer:
+            yield chunk
+
+        page += 1
+
+
+async def post(rest_url, post_data={}, ignore_errors=False):
+    """
+    Post a REST URL with global private token and given post data and parse the resulting JSON
+    Returns list of dictionaries
+    """
+
+    return await make_request("POST", rest_url, data=post_data, ignore_errors=ignore_errors)
+
+
+async def delete(rest_url, ignore_errors=False):
+    """
+    Delete a REST URL with global private token
+    """
+
+    return await make_request("DELETE", rest_url, ignore_errors=ignore_errors)
+
+
+async def put(rest_url, put_data={}, ignore_errors=False):
+    """
+    PUT a REST URL with global private token and given post data and parse the resulting JSON
+    """
+
+    return await make_request("PUT", rest_url, data=put_data, ignore_errors=ignore_errors)
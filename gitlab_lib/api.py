@@ -21,6 +21,7 @@
 from gitlab_config import SERVER
 
 API_BASE_URL = "https://%s/api/v4" % (SERVER,)
+GRAPHQL_URL = "https://%s/api/graphql" % (SERVER,)
 
 #
 # USER API
@@ -29,6 +30,7 @@ API_BASE_URL = "https://%s/api/v4" % (SERVER,)
 CREATE_USER = "%s/users"
 DELETE_USER = "%s/users/%s"
 GET_NO_OF_USERS = "%s/users?per_page=%d&page=%d"
+GET_USERS = "%s/users"
 USER_METADATA = "%s/users/%s"
 USER_BY_USERNAME = "%s/users?username=%s"
 USER_SSHKEYS = "%s/users/%s/keys"
@@ -80,6 +82,8 @@ DEL_PROJECT_MEMBER = "%s/projects/%d/members/%d"
 GET_NO_OF_PROJECTS = "%s/projects"
 GET_ARCHIVED_PROJECTS = "%s/projects?archived=true"
 PROTECT_BRANCH = "%s/projects/%d/repository/branches/%s/protect"
+GET_PROJECT_JOBS = "%s/projects/%d/jobs"
+DELETE_PROJECT_JOB = "%s/projects/%d/jobs/%d/erase"
 
 GET_SNIPPET_CONTENT = "%s/projects/%d/snippets/%d/raw"
 NOTES_FOR_SNIPPET = "%s/projects/%s/snippets/%s/notes"
@@ -28,14 +28,26 @@ import sys
 import json
 import shutil
 import shlex
+import time
 import tarfile
+import threading
 import traceback
 import subprocess
 from .core import *
 from .api import *
+from . import metrics
+from . import trace
+from . import logqueue
+from . import graphql
+from . import mirror
+from . import bundle
+from . import chunkstore
+from . import compression
+from . import delta
+from . import ndjson
 from .users import get_user
 from .projects import get_projects
-from .exception import ArchiveError, CloneError
+from .exception import ArchiveError, CloneError, APIError
 
 
 #
@@ -45,60 +57,148 @@ from .exception import ArchiveError, CloneError
 def dump(data, output_basedir, filename):
     """
     Write the given data as json to a file
+    or its recipe to filename.chunks if the chunk store is enabled
     """
-    out = open(os.path.join(output_basedir, filename), "w")
-    json.dump(data, out)
-    out.close()
+    if chunkstore.is_enabled():
+        chunkstore.store_data(json.dumps(data).encode("utf8"), os.path.join(output_basedir, filename + chunkstore.RECIPE_SUFFIX))
+        return
 
+    # replace the file instead of rewriting a hardlink of the previous run
+    filename = os.path.join(output_basedir, filename)
 
-def archivate(src_dir, dest_dir, prefix="", console=False):
+    with open(filename + ".tmp", "w") as out:
+        json.dump(data, out)
+
+    os.replace(filename + ".tmp", filename)
+
+
+def dump_records(records, output_basedir, name):
+    """
+    Write the records of an iterable to name.ndjson while they arrive
+    (see ndjson.py), so a whole collection is never held in memory
+    Returns the list of tuples of id and iid of all records
+    """
+    keys = []
+
+    with ndjson.Writer(output_basedir, name) as out:
+        for record in records:
+            out.write(record)
+            keys.append((record.get('id'), record.get('iid')))
+
+    return keys
+
+
+def __write_tar(src_dir, filename, codec):
+    """
+    Helper function - Stream a tar of src_dir into the compressor of codec
+    Kills the compressor and removes the partial archive if it fails
+    """
+    (out, finish) = compression.open_writer(filename, codec)
+
+    try:
+        tar = tarfile.open(fileobj=out, mode="w|")
+        tar.add(src_dir, arcname=".", recursive=True)
+        tar.close()
+    except BaseException:
+        finish(abort=True)
+        os.unlink(filename)
+        raise
+
+    try:
+        finish()
+    except ArchiveError:
+        os.unlink(filename)
+        raise
+
+
+@trace.traced("tar")
+def archivate(src_dir, dest_dir, prefix="", console=False, name=None, codec=None):
     """
     Zip src_dir to dest_dir
+    The archive is named after src_dir or the given name
+    codec overrides compression.CODEC
+    With the chunk store enabled write the recipe of a tar instead
+    Returns the filename of the archive
+    Raises ArchiveError if neither Python nor console tar could create it
     """
-    filename = os.path.join(dest_dir, "%s%s.tgz" % (prefix, os.path.basename(src_dir)))
+    if chunkstore.is_enabled():
+        filename = os.path.join(dest_dir, "%s%s.tar%s" % (prefix, name or os.path.basename(src_dir), chunkstore.RECIPE_SUFFIX))
+        debug("Storing tar stream of %s as %s", src_dir, filename)
+
+        try:
+            chunkstore.store_directory(src_dir, filename)
+        except (tarfile.TarError, OSError) as e:
+            raise ArchiveError(src_dir, dest_dir, str(e))
+
+        return filename
+
+    codec = codec or compression.CODEC
+    filename = os.path.join(dest_dir, "%s%s%s" % (prefix, name or os.path.basename(src_dir), compression.extension(codec)))
     error_msg = None
+    break_link(filename)
 
     try:
         if console:
-            tar_cmd = "tar xvfz %s %s" % (filename, src_dir)
-            debug("Running " + tar_cmd)
+            tar_cmd = compression.tar_command(filename, src_dir, codec)
+            debug("Running " + " ".join(tar_cmd))
 
             tar = subprocess.Popen(tar_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-            tar.wait(timeout=TAR_TIMEOUT)
-            tar_error = str(tar.stderr.read()).lower()
 
-            if "fatal" in tar_error or "error" in tar_error:
-                error_msg = tar_error
+            try:
+                tar.wait(timeout=TAR_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                tar.kill()
+                tar.wait()
+                raise
+
+            tar_error = tar.stderr.read().decode("utf8", "replace").lower()
+
+            if tar.returncode != 0 or "fatal" in tar_error or "error" in tar_error:
+                error_msg = tar_error or "tar exited with %d" % (tar.returncode,)
         else:
-            debug("Creating tar archive %s from %s" % (filename, src_dir))
-            tar = tarfile.open(filename, "w:gz")
-            tar.add(src_dir, arcname=".", recursive=True)
-            tar.close()
+            debug("Creating %s tar archive %s from %s", codec, filename, src_dir)
+            __write_tar(src_dir, filename, codec)
     except (FileExistsError):
         os.unlink(filename)
-        archivate(src_dir, dest_dir, prefix, console)
+        return archivate(src_dir, dest_dir, prefix, console, name, codec)
     except (FileNotFoundError) as e:
         log("Failed to tar %s with Python lib. Trying to use console tar. Error was %s" % (src_dir, str(e)))
-    except (tarfile.TarError, OSError) as e:
+        error_msg = str(e)
+    except (tarfile.TarError, OSError, ArchiveError, subprocess.TimeoutExpired) as e:
         error_msg = str(e)
 
     if error_msg and not console:
-        archivate(src_dir, dest_dir, prefix, console=True)
+        # console tar cannot use a compressor that is not installed either
+        if not compression.is_available(codec):
+            log("Compressor of %s is not installed, archiving %s with gzip" % (codec, src_dir))
+            codec = "gzip"
+
+        return archivate(src_dir, dest_dir, prefix, console=True, name=name, codec=codec)
     elif error_msg:
-        error(error_msg)
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+        raise ArchiveError(src_dir, dest_dir, error_msg)
 
+    return filename
 
-def archive_directory(project, component, directory, output_basedir):
+
+def archive_directory(project, component, directory, output_basedir, name=None):
     """
     Archivate directory to output_basedir
+    name overrides the name of the archive (see archivate)
     """
     if os.path.exists(directory):
         log("Backing up %s from project %s [ID %s]" % (component, project['name'], project['id']))
+        start = time.time()
 
         if component == "upload":
-            archivate(directory, output_basedir, "upload_")
+            filename = archivate(directory, output_basedir, "upload_", name=name)
         else:
-            archivate(directory, output_basedir)
+            filename = archivate(directory, output_basedir, name=name)
+
+        if os.path.exists(filename):
+            metrics.observe_stage("archive", time.time() - start, os.path.getsize(filename))
     else:
         log("No %s found for project %s [ID %s]" % (component, project['name'], project['id']))
 
@@ -120,9 +220,12 @@ def __check_git_error(repository_url, git_cmd, git_error):
 
 def __run_git_commands(repository_url, git_commands):
     for git_cmd in git_commands:
-        debug("Running git command %s on repository %s" % (str(git_cmd), repository_url))
-        git = subprocess.Popen(git_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        git.wait(timeout=GIT_TIMEOUT)
+        debug("Running git command %s on repository %s", git_cmd, repository_url)
+
+        # name spans like git lfs fetch, git checkout or untrack_lfs.sh
+        with trace.span(" ".join(git_cmd[:3] if git_cmd[1:2] == ["lfs"] else git_cmd[:2])):
+            git = subprocess.Popen(git_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            git.wait(timeout=GIT_TIMEOUT)
         __check_git_error(repository_url, git_cmd, git.stderr.read().decode('UTF-8'))
 
 
@@ -135,9 +238,10 @@ def __archive_repository(repository_url, clone_output_dir):
     git_clone_cmd = ["git", "lfs", "clone", repository_url, clone_output_dir]
     log("Cloning " + repository_url + " into " + clone_output_dir)
 
-    git = subprocess.Popen(git_clone_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-    git.wait(timeout=GIT_TIMEOUT)
-    git_error = str(git.stderr.read()).lower()
+    with trace.span("git lfs clone"):
+        git = subprocess.Popen(git_clone_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        git.wait(timeout=GIT_TIMEOUT)
+        git_error = str(git.stderr.read()).lower()
 
     if git_error and git_error != b'':
         debug("Git error " + git_error)
@@ -187,25 +291,197 @@ def __archive_repository(repository_url, clone_output_dir):
 
 
 
+def find_repository(project, repository_dir=REPOSITORY_DIR):
+    """
+    Returns the path of the bare repository of a project in repository_dir or None
+    """
+    for name in (project['name'], project['name'].lower()):
+        repo_dir = os.path.join(repository_dir, project['namespace']['name'], name + ".git")
+
+        if os.path.exists(repo_dir):
+            return repo_dir
+
+    return None
+
+
+def __store_repository(project, repo_dir, output_basedir):
+    """
+    Helper function - Append a bare repository to the bundle chain of the project
+    or archive it if bundle chains are disabled
+    Both are named like a fresh clone so restore finds them
+    """
+    name = shlex.quote(project['name']) + ".git"
+
+    if not bundle.is_enabled():
+        archive_directory(project, 'repository', repo_dir, output_basedir, name)
+        return
+
+    log("Bundling repository from project %s [ID %s]" % (project['name'], project['id']))
+
+    with bundle.lock(project):
+        with trace.span("bundle"):
+            chain_dir = bundle.append(project, repo_dir)
+
+        if chain_dir:
+            bundle.link_chain(chain_dir, os.path.join(output_basedir, name + ".bundles"))
+
+
+def __backup_repository_mirror(project, repository_url, output_basedir):
+    """
+    Helper function - Refresh the persistent mirror of a project and archive it
+    """
+    with mirror.lock(project):
+        start = time.time()
+
+        with trace.span("fetch"):
+            mirror_dir = mirror.update(project, repository_url)
+
+        metrics.observe_stage("clone", time.time() - start)
+
+        if mirror_dir:
+            __store_repository(project, mirror_dir, output_basedir)
+
+
+@trace.traced("git bundle")
+def stream_repository(project, repo_dir, output_basedir):
+    """
+    Write all refs of the bare repository repo_dir as git bundle straight
+    into output_basedir/<name>.git.bundle (or its recipe), no clone needed
+    The pack in a bundle is compressed already, so no codec is applied
+    Raises CloneError if git fails
+    """
+    filename = os.path.join(output_basedir, shlex.quote(project['name']) + ".git.bundle")
+    git_cmd = ["git", "-C", repo_dir, "bundle", "create", "-q", "-", "--all"]
+    start = time.time()
+    deadline = start + GIT_TIMEOUT
+
+    log("Streaming repository from project %s [ID %s]" % (project['name'], project['id']))
+    debug("Running %s > %s", " ".join(git_cmd), filename)
+
+    chunked = chunkstore.is_enabled()
+
+    if chunked:
+        filename += chunkstore.RECIPE_SUFFIX
+        out = chunkstore.Writer(filename)
+        git = subprocess.Popen(git_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        out = open(filename + ".tmp", "wb")
+        git = subprocess.Popen(git_cmd, stdout=out, stderr=subprocess.PIPE)
+
+    done = False
+
+    # a stalled git blocks the read of its output forever,
+    # so kill it when GIT_TIMEOUT is over
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        git.kill()
+
+    watchdog = threading.Timer(GIT_TIMEOUT, expire)
+    watchdog.daemon = True
+
+    try:
+        if chunked:
+            watchdog.start()
+
+            for data in iter(lambda: git.stdout.read(1024 * 1024), b""):
+                out.write(data)
+
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(git_cmd, GIT_TIMEOUT)
+
+        git_error = git.communicate(timeout=max(deadline - time.time(), 0))[1].decode("utf8", "replace")
+
+        if git.returncode != 0:
+            if "empty bundle" in git_error:
+                log("Repository is empty")
+                return None
+
+            raise CloneError(repo_dir, "Command %s failed: %s" % (" ".join(git_cmd), git_error))
+
+        out.close()
+
+        if not chunked:
+            os.rename(filename + ".tmp", filename)
+
+        done = True
+    except subprocess.TimeoutExpired:
+        raise CloneError(repo_dir, "Command %s timed out after %d seconds" % (" ".join(git_cmd), GIT_TIMEOUT))
+    finally:
+        watchdog.cancel()
+
+        if git.poll() is None:
+            git.kill()
+            git.communicate()
+
+        if not done and chunked:
+            out.abort()
+        elif not done:
+            out.close()
+            os.unlink(filename + ".tmp")
+
+    metrics.observe_stage("archive", time.time() - start, os.path.getsize(filename))
+
+    return filename
+
+
+@trace.traced("repository")
 def backup_repository(project, output_basedir, repository_dir=REPOSITORY_DIR, tmp_dir=TMP_DIR, resolve_lfs=False):
     """
     Backup repository either as bare mirror or as LFS resolved checkout
     """
-    repo_dir = os.path.join(repository_dir, project['namespace']['name'], project['name'] + ".git")
+    repo_dir = find_repository(project, repository_dir)
     git_error = None
     backup_failed = False
 
-    if not os.path.exists(repo_dir):
-        repo_dir = os.path.join(repository_dir, project['namespace']['name'], project['name'].lower() + ".git")
+    if not repo_dir:
+        log("No repository found for project %s/%s [ID %s]" % (project['namespace']['name'], project['name'], project['id']))
+        return None
+
+    repository_url = project['http_url_to_repo'].replace("https://", "https://oauth2:" + CLONE_ACCESS_TOKEN + "@")
+
+    # On the Gitlab host read the bare repository from disk instead of pulling it
+    # through workhorse and TLS. LFS objects are not part of the repository,
+    # so resolving them still needs https. https is the fallback anyway.
+    if CLONE_FROM_DISK and not resolve_lfs:
+        clone_urls = [repo_dir, repository_url]
+    else:
+        clone_urls = [repository_url]
 
-        if not os.path.exists(repo_dir):
-            log("No repository found for project %s/%s [ID %s]" % (project['namespace']['name'], project['name'], project['id']))
+    # bundles can be made from the repository on disk without any clone
+    if bundle.is_enabled() and CLONE_FROM_DISK and not mirror.is_enabled() and not resolve_lfs:
+        try:
+            __store_repository(project, repo_dir, output_basedir)
+            return None
+        except CloneError as e:
+            log("Cannot bundle %s, cloning it: %s" % (repo_dir, str(e)))
+
+    # a bundle streamed from disk needs neither a temporary clone nor a tar of it
+    if STREAM_REPOSITORIES and not bundle.is_enabled() and not mirror.is_enabled() and not resolve_lfs:
+        try:
+            stream_repository(project, repo_dir, output_basedir)
             return None
+        except CloneError as e:
+            log("Cannot stream %s, cloning it: %s" % (repo_dir, str(e)))
+
+    # LFS resolved checkouts cannot be made from a bare mirror
+    if mirror.is_enabled() and not resolve_lfs:
+        for clone_url in clone_urls:
+            try:
+                __backup_repository_mirror(project, clone_url, output_basedir)
+                break
+            except CloneError as e:
+                if clone_url == clone_urls[-1]:
+                    raise
+
+                log("Cannot mirror %s from disk, falling back to https: %s" % (repo_dir, str(e)))
+
+        return None
 
     backup_tmp_dir = os.path.join(tmp_dir, "backup")
     namespace_tmp_dir = os.path.join(backup_tmp_dir, project['namespace']['name'])
     clone_output_dir = os.path.join(backup_tmp_dir, project['namespace']['name'], shlex.quote(project['name']) + ".git")
-    repository_url = project['http_url_to_repo'].replace("https://", "https://oauth2:" + CLONE_ACCESS_TOKEN + "@")
 
     try:
         os.mkdir(backup_tmp_dir)
@@ -220,18 +496,35 @@ def backup_repository(project, output_basedir, repository_dir=REPOSITORY_DIR, tm
         except (OSError, PermissionError, FileNotFoundError) as e:
             error("Cannot remove clone output dir " + clone_output_dir)
 
-    if resolve_lfs:
-        __archive_repository(repository_url, clone_output_dir)
-    else:
-        git_clone_cmd = ["git", "clone", "--mirror", repository_url, clone_output_dir]
-        log("Cloning " + repository_url + " into " + clone_output_dir)
+    start = time.time()
 
-        git = subprocess.Popen(git_clone_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        git.wait(timeout=GIT_TIMEOUT)
-        git_error = str(git.stderr.read()).lower()
+    with trace.span("clone"):
+        if resolve_lfs:
+            __archive_repository(repository_url, clone_output_dir)
+        else:
+            for clone_url in clone_urls:
+                git_clone_cmd = ["git", "clone", "--mirror", clone_url, clone_output_dir]
+
+                # a local clone would hardlink the objects of the live repository
+                if clone_url == repo_dir:
+                    git_clone_cmd.insert(3, "--no-hardlinks")
 
-        if git_error:
-            debug("Git error: " + git_error)
+                log("Cloning " + clone_url + " into " + clone_output_dir)
+
+                git = subprocess.Popen(git_clone_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                git.wait(timeout=GIT_TIMEOUT)
+                git_error = str(git.stderr.read()).lower()
+
+                if git_error:
+                    debug("Git error: " + git_error)
+
+                if clone_url == clone_urls[-1] or not ("fatal" in git_error or "error" in git_error):
+                    break
+
+                log("Cannot clone %s from disk, falling back to https" % (repo_dir,))
+                shutil.rmtree(clone_output_dir, ignore_errors=True)
+
+    metrics.observe_stage("clone", time.time() - start)
 
     # when cloning an empty repo via https git returns 403 :(
     if git_error and ("fatal" in git_error or "error" in git_error) and not "error: 403" in git_error:
@@ -241,7 +534,11 @@ def backup_repository(project, output_basedir, repository_dir=REPOSITORY_DIR, tm
             backup_failed = True
     else:
         # zip repo
-        archive_directory(project, 'repository', clone_output_dir, output_basedir)
+        if resolve_lfs:
+            archive_directory(project, 'repository', clone_output_dir, output_basedir)
+        else:
+            __store_repository(project, clone_output_dir, output_basedir)
+
         os.chdir("/")
 
     # removed temporary cloned repository
@@ -268,48 +565,100 @@ def backup_local_data(project, output_basedir, repository_dir=REPOSITORY_DIR, up
         archive_directory(project, component, directory, output_basedir)
 
 
+def __fetch_all(api_url):
+    """
+    Helper function - Fetch all pages of api_url
+    The pagination headers of the first page save the request of an empty last page
+    """
+    return list(fetch_per_page(api_url, prefetch=1))
+
+
+def __fetch_raw(api_url):
+    """
+    Helper function - Fetch api_url as text
+    """
+    return rest_api_call(api_url, method="GET").text
+
+
+@trace.traced("snippets")
 def backup_snippets(project, output_basedir):
     """
     Backup snippets and their contents
-    snippet contents must be backuped by additional api call
+    snippet contents and notes are fetched ATTACHMENT_CONCURRENCY at a time
     """
     log(u"Backing up snippets from project %s [ID %s]" % (project['name'], project['id']))
 
-    snippets = list(fetch_per_page(PROJECT_COMPONENTS['snippets'] % (API_BASE_URL, project['id'])))
+    api_url = PROJECT_COMPONENTS['snippets'] % (API_BASE_URL, project['id'])
+    snippet_ids = [x[0] for x in dump_records(fetch_per_page(api_url), output_basedir, "snippets")]
 
-    dump(snippets, output_basedir, "snippets.json")
+    calls = []
 
-    for snippet in snippets:
-        dump(rest_api_call(GET_SNIPPET_CONTENT % (API_BASE_URL, project['id'], snippet['id']), method="GET").text,
-             output_basedir,
-             "snippet_%d_content.dump" % (snippet['id'],))
+    for snippet_id in snippet_ids:
+        calls.append((__fetch_raw, GET_SNIPPET_CONTENT % (API_BASE_URL, project['id'], snippet_id)))
+        calls.append((__fetch_all, NOTES_FOR_SNIPPET % (API_BASE_URL, project['id'], snippet_id)))
 
-        notes = list(fetch_per_page(NOTES_FOR_SNIPPET % (API_BASE_URL, project['id'], snippet['id'])))
+    results = fetch_concurrently(calls)
+
+    for snippet_id in snippet_ids:
+        dump(next(results), output_basedir, "snippet_%d_content.dump" % (snippet_id,))
+        notes = next(results)
 
         if notes:
-            dump(notes, output_basedir, "snippet_%d_notes.dump" % (snippet['id'],))
+            dump(notes, output_basedir, "snippet_%d_notes.dump" % (snippet_id,))
 
 
+@trace.traced("issues")
 def backup_issues(project, output_basedir):
     """
     Backup all issues of a project
-    issue notes must be backuped by additional api call
+    issue notes and closing merge requests are fetched ATTACHMENT_CONCURRENCY at a time
+    With project["delta"] set only the issues updated since the previous run
+    and their attachments are fetched, see delta.py
     """
     issue_attachments = { "notes": NOTES_FOR_ISSUES,
                           "merge_requests" : MERGE_REQUESTS_FOR_ISSUES }
+    api_url = PROJECT_COMPONENTS['issues'] % (API_BASE_URL, project['id'])
+    previous = project.get("delta")
+    result = None
 
     log(u"Backing up issues from project %s [ID %s]" % (project['name'], project['id']))
 
-    issues = list(fetch_per_page(PROJECT_COMPONENTS['issues'] % (API_BASE_URL, project['id'])))
+    if previous:
+        result = delta.sync(project, "issues", api_url, previous["dir"], previous["since"])
+
+    if result:
+        issue_keys = dump_records(result[0], output_basedir, "issues")
+        updated_keys = [(x['id'], x['iid']) for x in result[1]]
+        delta.carry_dumps(previous["dir"], output_basedir, "issues", set([x[0] for x in issue_keys]) - set([x[0] for x in updated_keys]))
+    else:
+        updated_keys = dump_records(fetch_per_page(api_url), output_basedir, "issues")
+
+    attachments = [(issue_id, attachment, attachment_url % (API_BASE_URL, project['id'], issue_iid))
+                   for (issue_id, issue_iid) in updated_keys for (attachment, attachment_url) in issue_attachments.items()]
+    results = fetch_concurrently([(__fetch_all, x[2]) for x in attachments])
+
+    for ((issue_id, attachment, attachment_url), data) in zip(attachments, results):
+        if data:
+            dump(data, output_basedir, "issues_%d_%s.dump" % (issue_id, attachment))
 
-    dump(issues, output_basedir, "issues.json")
 
-    for issue in issues:
-        for (attachment, api_url) in issue_attachments.items():
-            data = fetch(api_url % (API_BASE_URL, project['id'], issue['iid']))
+@trace.traced("merge_requests")
+def backup_merge_requests(project, output_basedir):
+    """
+    Backup all merge requests of a project
+    With project["delta"] set only the merge requests updated since the previous run are fetched
+    """
+    api_url = PROJECT_COMPONENTS['merge_requests'] % (API_BASE_URL, project['id'])
+    previous = project.get("delta")
+    result = None
 
-            if data:
-                dump(data, output_basedir, "issues_%d_%s.dump" % (issue['id'], attachment))
+    if previous:
+        result = delta.sync(project, "merge_requests", api_url, previous["dir"], previous["since"])
+
+    if result:
+        dump_records(result[0], output_basedir, "merge_requests")
+    else:
+        dump_records(fetch_per_page(api_url, prefetch=1), output_basedir, "merge_requests")
 
 
 def backup_user_metadata(user, backup_dir=BACKUP_DIR):
@@ -327,12 +676,12 @@ def backup_user_metadata(user, backup_dir=BACKUP_DIR):
 
         log(u"Backing up metadata of user %s [ID %s]" % (user["username"], user["id"]))
         dump(user, output_basedir, "user.json")
-        dump(list(get_projects(user["username"])), output_basedir, "projects.json")
+        dump_records(get_projects(user["username"]), output_basedir, "projects")
         dump(fetch(USER_SSHKEYS % (API_BASE_URL, user["id"])), output_basedir, "ssh.json")
         dump(fetch(USER_EMAILS % (API_BASE_URL, user["id"])), output_basedir, "email.json")
 
 
-def backup_project(project, output_basedir, archive=False):
+def backup_project(project, output_basedir, archive=False, use_graphql=False):
     """
     Backup a single project
     """
@@ -340,12 +689,72 @@ def backup_project(project, output_basedir, archive=False):
 
     if not os.path.exists(output_basedir): os.mkdir(output_basedir)
 
-    dump(project, output_basedir, "project.json")
-    backup_repository(project, output_basedir, resolve_lfs=archive)
-    backup_local_data(project, output_basedir)
+    # the location of the previous backup is no project metadata
+    dump(dict((k, v) for (k, v) in project.items() if k != "delta"), output_basedir, "project.json")
+
+    with logqueue.context(stage="repository"):
+        backup_repository(project, output_basedir, resolve_lfs=archive)
+
+    with logqueue.context(stage="uploads"):
+        backup_local_data(project, output_basedir)
+
+    with logqueue.context(stage="metadata"):
+        backup_metadata(project, output_basedir, use_graphql)
+
+
+def __backup_metadata_graphql(project, output_basedir):
+    """
+    Helper function - Backup the graphql.COMPONENTS of a project with a few GraphQL queries
+    GraphQL has no counterpart of the closed_by endpoint, so it is still
+    fetched via REST but only for closed issues
+    """
+    if project.get("issues_enabled") == True:
+        log(u"Backing up issues from project %s [ID %s] via GraphQL" % (project['name'], project['id']))
+
+        with trace.span("issues"):
+            closed = []
+
+            with ndjson.Writer(output_basedir, "issues") as out:
+                for (issue, notes) in graphql.get_issues(project):
+                    out.write(issue)
+
+                    if notes:
+                        dump(notes, output_basedir, "issues_%d_notes.dump" % (issue['id'],))
+
+                    if issue['state'] == "closed":
+                        closed.append((issue['id'], issue['iid']))
+
+            results = fetch_concurrently([(__fetch_all, MERGE_REQUESTS_FOR_ISSUES % (API_BASE_URL, project['id'], x[1])) for x in closed])
+
+            for ((issue_id, issue_iid), data) in zip(closed, results):
+                if data:
+                    dump(data, output_basedir, "issues_%d_merge_requests.dump" % (issue_id,))
+
+    if project.get("merge_requests_enabled") == True:
+        dump_records(graphql.get_merge_requests(project), output_basedir, "merge_requests")
+
+    # milestones are enabled if either issues or merge_requests are enabled
+    if project.get("issues_enabled") == True or project.get("merge_requests_enabled") == True:
+        log(u"Backing up milestones from project %s [ID %s] via GraphQL" % (project['name'], project['id']))
+        dump(graphql.get_milestones(project), output_basedir, "milestones.json")
+
+    dump(graphql.get_labels(project), output_basedir, "labels.json")
+
+
+def backup_metadata(project, output_basedir, use_graphql=False):
+    """
+    Backup metadata of each component of a project
+    use_graphql fetches issues, merge requests, milestones and labels via GraphQL
+    """
+    start = time.time()
+
+    if use_graphql:
+        __backup_metadata_graphql(project, output_basedir)
 
-    # backup metadata of each component
     for (component, api_url) in PROJECT_COMPONENTS.items():
+        if use_graphql and component in graphql.COMPONENTS:
+            continue
+
         # issues
         if component == "issues" and \
             project.get(component + "_enabled") == True:
@@ -356,6 +765,11 @@ def backup_project(project, output_basedir, archive=False):
             project.get(component + "_enabled") == True:
             backup_snippets(project, output_basedir)
 
+        # merge requests
+        elif component == "merge_requests" and \
+            project.get(component + "_enabled") == True:
+            backup_merge_requests(project, output_basedir)
+
         # milestones are enabled if either issues or merge_requests are enabled
         # labels cannot be disabled therefore no labels_enabled field exists
         # otherwise check if current component is enabled in project
@@ -374,13 +788,31 @@ def backup_project(project, output_basedir, archive=False):
         elif component != "milestones" and \
              component != "snippets" and \
              component != "issues" and \
+             component != "merge_requests" and \
              project.get(component + "_enabled", "not_disabled") == "not_disabled":
             dump(fetch(api_url % (API_BASE_URL, project['id'])),
                  output_basedir,
                  component + ".json")
 
+    if metrics.is_enabled():
+        metrics.observe_stage("metadata", time.time() - start, __metadata_size(output_basedir))
+
+
+def __metadata_size(output_basedir):
+    """
+    Helper function - Sum up the size of all metadata dumps in output_basedir
+    """
+    return sum([os.path.getsize(os.path.join(output_basedir, x)) for x in os.listdir(output_basedir) if x.endswith(".json") or x.endswith(ndjson.SUFFIX) or x.endswith(".dump")])
+
+
+def project_dir_name(project):
+    """
+    Returns the name of the backup directory of a project
+    """
+    return "%s_%s_%s" % (project['id'], project['namespace']['name'], project['name'])
+
 
-def backup(work_queue, result_queue, backup_dir, archive=False):
+def backup(work_queue, result_queue, backup_dir, archive=False, use_graphql=False):
     """
     Backup everything for the given project
     For every project create a dictionary with id_name as pattern
@@ -388,15 +820,23 @@ def backup(work_queue, result_queue, backup_dir, archive=False):
     """
     while work_queue.qsize() > 0:
         project = work_queue.get()
-        output_basedir = os.path.join(backup_dir, "%s_%s_%s" % (project['id'], project['namespace']['name'], project['name']))
+        output_basedir = os.path.join(backup_dir, project_dir_name(project))
 
         if project.get("retried") == None:
             project["retried"] = 3
 
         try:
-            backup_project(project, output_basedir, archive)
+            start = time.time()
+
+            with trace.span("project", project="%s/%s" % (project['namespace']['name'], project['name']), id=project['id']), \
+                 logqueue.context(project=project['id']):
+                backup_project(project, output_basedir, archive, use_graphql)
+
+            # the next run schedules by this duration (see schedule.py)
+            project["seconds"] = round(time.time() - start, 1)
             result_queue.put(project)
-        except (ArchiveError, CloneError, WebError) as e:
+            metrics.inc("gitlab_backup_projects_total", {"result": "success"})
+        except (ArchiveError, CloneError, WebError, APIError) as e:
             exc_type, exc_value, exc_traceback = sys.exc_info()
 
             if DEBUG:
@@ -407,8 +847,15 @@ def backup(work_queue, result_queue, backup_dir, archive=False):
             if project.get("retried") > 0:
                 info("Retrying backup of project %s/%s [%s]" % (project['namespace']['name'], project['name'], project['id']))
                 project["retried"] = project["retried"] - 1
+                metrics.inc("gitlab_backup_projects_total", {"result": "retried"})
 
                 work_queue.put(project)
             else:
                 error("Failed to backup project %s/%s [%s]. Retried 3 times. Giving up... :(" % (project['namespace']['name'], project['name'], project['id']))
+                project["failed"] = True
                 result_queue.put(project)
+                metrics.inc("gitlab_backup_projects_total", {"result": "failed"})
+
+    log_api_status_stats()
+    metrics.flush()
+    trace.flush()
@@ -0,0 +1,276 @@
+#
+# Central lib for Gitlab Tools - Incremental git bundle chains
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Instead of a tar of the whole repository every run appends a git bundle
+# to the chain of the project in BUNDLE_DIR/<project id>/
+#
+#   0000.bundle   all refs and objects of the first run
+#   0001.bundle   only objects not reachable from the refs of the run before
+#   ...
+#   chain.json    per run the bundle (or null if no new objects), all refs and HEAD
+#
+# The chain is hardlinked into the backup directory of the run, so every
+# backup directory can be restored on its own with replay(), while storage
+# and I/O per run scale with the churn of the repository. After
+# CHAIN_MAX_LENGTH runs a new chain starts with a full bundle.
+#
+# The bundle chains are disabled until enable() is called.
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+import shutil
+import subprocess
+from .core import *
+from .exception import CloneError
+
+
+#
+# Configuration
+#
+
+BUNDLE_DIR = None
+CHAIN_MAX_LENGTH = 30
+CHAIN_FILE = "chain.json"
+
+
+#
+# Subroutines
+#
+
+def enable(bundle_dir, max_length=CHAIN_MAX_LENGTH):
+    """
+    Keep the bundle chains in bundle_dir and start a new chain after max_length runs
+    """
+    global BUNDLE_DIR, CHAIN_MAX_LENGTH
+
+    os.makedirs(bundle_dir, mode=0o700, exist_ok=True)
+
+    BUNDLE_DIR = bundle_dir
+    CHAIN_MAX_LENGTH = max_length
+
+
+def is_enabled():
+    return BUNDLE_DIR is not None
+
+
+def chain_path(project):
+    """
+    Returns the directory of the bundle chain of a project
+    """
+    return os.path.join(BUNDLE_DIR, str(int(project['id'])))
+
+
+def lock(project, blocking=True):
+    """
+    Exclusively lock the bundle chain of a project (see core.file_lock)
+    """
+    return file_lock(chain_path(project) + ".lock", blocking)
+
+
+def load_chain(chain_dir):
+    """
+    Returns the list of links of the chain in chain_dir
+    Every link is a dict with the keys bundle, refs and head
+    """
+    try:
+        with open(os.path.join(chain_dir, CHAIN_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def __write_chain(chain_dir, chain):
+    chain_file = os.path.join(chain_dir, CHAIN_FILE)
+
+    with open(chain_file + ".tmp", "w") as f:
+        json.dump(chain, f, indent=1, sort_keys=True)
+
+    os.replace(chain_file + ".tmp", chain_file)
+
+
+def __git(git_cmd, repo_dir):
+    """
+    Helper function - Run a git command in repo_dir
+    Returns its output, raises CloneError if it fails
+    """
+    debug("Running %s in %s", " ".join(git_cmd), repo_dir)
+    git = subprocess.run(git_cmd, cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=GIT_TIMEOUT)
+
+    if git.returncode != 0:
+        raise CloneError(repo_dir, "Command %s failed: %s" % (" ".join(git_cmd), git.stderr.decode("utf8", "replace")))
+
+    return git.stdout.decode("utf8", "replace")
+
+
+def get_refs(repo_dir):
+    """
+    Returns a tuple of a dict ref name to object id and the ref HEAD points to
+    """
+    refs = {}
+
+    for line in __git(["git", "for-each-ref", "--format=%(objectname) %(refname)"], repo_dir).splitlines():
+        (object_id, ref) = line.split(" ", 1)
+        refs[ref] = object_id
+
+    try:
+        head = __git(["git", "symbolic-ref", "-q", "HEAD"], repo_dir).strip() or None
+    except CloneError:
+        head = None
+
+    return (refs, head)
+
+
+def __existing_objects(repo_dir, object_ids):
+    """
+    Helper function - Returns the object ids that still exist in repo_dir
+    Force pushes and gc may have removed objects of earlier runs
+    """
+    if not object_ids:
+        return []
+
+    git = subprocess.run(["git", "cat-file", "--batch-check=%(objectname)"], cwd=repo_dir,
+                         input="\n".join(object_ids).encode("utf8"),
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=GIT_TIMEOUT)
+
+    return [x for x in git.stdout.decode("utf8").split() if x in object_ids]
+
+
+def append(project, repo_dir):
+    """
+    Add a bundle with everything new in repo_dir to the chain of the project
+    Hold lock() while calling it
+    Returns the chain directory or None if the repository is empty
+    """
+    chain_dir = chain_path(project)
+    chain = load_chain(chain_dir)
+    (refs, head) = get_refs(repo_dir)
+
+    if not refs:
+        log("Repository is empty")
+        return None
+
+    if chain and chain[-1]["refs"] == refs and chain[-1]["head"] == head:
+        debug("Refs of %s unchanged, bundle chain stays as it is", repo_dir)
+        return chain_dir
+
+    # start a new chain next to the old one and swap them when it is complete
+    if len(chain) >= CHAIN_MAX_LENGTH:
+        log("Bundle chain %s has %d links, starting a new one" % (chain_dir, len(chain)))
+        new_chain_dir = chain_dir + ".new"
+        shutil.rmtree(new_chain_dir, ignore_errors=True)
+        os.mkdir(new_chain_dir)
+        __append_bundle(new_chain_dir, [], repo_dir, refs, head)
+        shutil.rmtree(chain_dir)
+        os.rename(new_chain_dir, chain_dir)
+    else:
+        os.makedirs(chain_dir, exist_ok=True)
+        __append_bundle(chain_dir, chain, repo_dir, refs, head)
+
+    return chain_dir
+
+
+def __append_bundle(chain_dir, chain, repo_dir, refs, head):
+    """
+    Helper function - Write the next bundle of the chain and record it
+    """
+    bundle = "%04d.bundle" % (len(chain),)
+    bundle_file = os.path.join(chain_dir, bundle)
+    prerequisites = __existing_objects(repo_dir, sorted(set(chain[-1]["refs"].values()))) if chain else []
+
+    try:
+        __git(["git", "bundle", "create", "-q", bundle_file + ".tmp", "--all"] + ["^" + x for x in prerequisites], repo_dir)
+        os.rename(bundle_file + ".tmp", bundle_file)
+    except CloneError as e:
+        # only refs moved or vanished, chain.json records that
+        if chain and "empty bundle" in str(e):
+            bundle = None
+        else:
+            raise
+
+    chain.append({"bundle": bundle, "refs": refs, "head": head})
+    __write_chain(chain_dir, chain)
+
+
+def link_chain(chain_dir, dest_dir):
+    """
+    Hardlink the chain in chain_dir to dest_dir
+    """
+    if os.path.exists(dest_dir):
+        shutil.rmtree(dest_dir)
+
+    link_tree(chain_dir, dest_dir)
+
+
+def replay(chain_dir, repo_dir):
+    """
+    Create the bare repository repo_dir from the bundle chain in chain_dir
+    Restores the refs and HEAD recorded by the last run of the chain
+    """
+    chain = load_chain(chain_dir)
+
+    if not chain:
+        raise CloneError(chain_dir, "No bundle chain found")
+
+    __git(["git", "init", "-q", "--bare", repo_dir], os.path.dirname(os.path.abspath(repo_dir)))
+
+    for link in chain:
+        if link["bundle"]:
+            debug("Fetching %s", link["bundle"])
+            __git(["git", "fetch", "-q", os.path.join(os.path.abspath(chain_dir), link["bundle"]), "+refs/*:refs/*"], repo_dir)
+
+    (refs, head) = get_refs(repo_dir)
+    final_refs = chain[-1]["refs"]
+    commands = ["delete %s\n" % (x,) for x in refs if x not in final_refs]
+    commands += ["update %s %s\n" % (x, y) for (x, y) in sorted(final_refs.items())]
+
+    git = subprocess.run(["git", "update-ref", "--stdin"], cwd=repo_dir, input="".join(commands).encode("utf8"),
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=GIT_TIMEOUT)
+
+    if git.returncode != 0:
+        raise CloneError(chain_dir, "Cannot restore refs: " + git.stderr.decode("utf8", "replace"))
+
+    if chain[-1]["head"]:
+        __git(["git", "symbolic-ref", "HEAD", chain[-1]["head"]], repo_dir)
+
+
+def prune(project_ids):
+    """
+    Remove the chains of all projects not in project_ids (deleted projects)
+    Their backup directories keep their hardlinks
+    Returns the number of removed chains
+    """
+    removed = 0
+
+    for entry in os.scandir(BUNDLE_DIR):
+        if entry.is_dir() and entry.name.isdigit() and int(entry.name) not in project_ids:
+            with lock({"id": int(entry.name)}, blocking=False) as locked:
+                if locked:
+                    log("Removing bundle chain of deleted project %s" % (entry.name,))
+                    shutil.rmtree(entry.path)
+                    os.unlink(entry.path + ".lock")
+                    removed += 1
+
+    return removed
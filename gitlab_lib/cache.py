@@ -0,0 +1,262 @@
+#
+# Central lib for Gitlab Tools - HTTP response cache
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Persistent cache of parsed GET responses with their ETag / Last-Modified
+# validators. Cached urls are revalidated with a conditional GET, if the
+# server answers 304 Not Modified the stored data is used without
+# downloading and parsing the body again.
+#
+# The cache is disabled until enable() is called. Call it before forking
+# worker processes so they share the hit / miss counters and size account.
+#
+
+#
+# Loading modules
+#
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+
+#
+# Configuration
+#
+
+CACHE_DIR = None
+CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+# pagination headers needed to replay a cached page
+CACHED_HEADERS = ("Link", "X-Total", "X-Total-Pages", "X-Per-Page", "X-Page", "X-Next-Page", "X-Prev-Page")
+
+# shared counters: hits (304), misses, uncacheable responses, stored bytes, evictions
+HITS = 0
+MISSES = 1
+UNCACHEABLE = 2
+SIZE = 3
+EVICTIONS = 4
+
+__stats = None
+
+
+#
+# Subroutines
+#
+
+def enable(cache_dir, max_size=CACHE_MAX_SIZE):
+    """
+    Enable the response cache in cache_dir limited to max_size bytes
+    """
+    global CACHE_DIR, CACHE_MAX_SIZE, __stats
+    import multiprocessing
+
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    CACHE_DIR = cache_dir
+    CACHE_MAX_SIZE = max_size
+    __stats = multiprocessing.Array("q", 5)
+    __stats[SIZE] = __disk_usage()
+
+
+def is_enabled():
+    return CACHE_DIR is not None and __stats is not None
+
+
+def __count(counter, value=1):
+    with __stats.get_lock():
+        __stats[counter] += value
+
+
+def __cache_file(url, token):
+    """
+    Helper function - Cache entries are keyed by url and a hash of the token
+    so different users never see each others responses
+    """
+    token_id = hashlib.sha256(token.encode("utf8")).hexdigest()
+    key = hashlib.sha256(("%s\n%s" % (token_id, url)).encode("utf8")).hexdigest()
+
+    return os.path.join(CACHE_DIR, key[:2], key + ".cache")
+
+
+def __cache_entries():
+    """
+    Helper function - Returns a list of tuples (mtime, size, path) of all cache files
+    """
+    entries = []
+
+    for subdir in os.scandir(CACHE_DIR):
+        if subdir.is_dir():
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".cache"):
+                    try:
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    except FileNotFoundError:
+                        pass
+
+    return entries
+
+
+def __disk_usage():
+    return sum([x[1] for x in __cache_entries()])
+
+
+def __evict():
+    """
+    Helper function - Delete least recently used entries until the cache
+    is below 90% of CACHE_MAX_SIZE
+    """
+    entries = sorted(__cache_entries())
+    size = sum([x[1] for x in entries])
+    evicted = 0
+
+    for (mtime, file_size, path) in entries:
+        if size <= CACHE_MAX_SIZE * 0.9:
+            break
+
+        try:
+            os.unlink(path)
+            size -= file_size
+            evicted += 1
+        except FileNotFoundError:
+            pass
+
+    __stats[SIZE] = size
+    __stats[EVICTIONS] += evicted
+
+
+def lookup(url, token):
+    """
+    Returns the cached entry of url as dict with keys etag, last_modified,
+    headers and data or None
+    """
+    entry = None
+    cache_file = __cache_file(url, token)
+
+    try:
+        with open(cache_file, "rb") as f:
+            entry = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        pass
+
+    return entry
+
+
+def conditional_headers(entry):
+    """
+    Returns the request headers to revalidate the given cache entry
+    """
+    headers = {}
+
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    return headers
+
+
+def hit(url, token):
+    """
+    The server confirmed the cached entry of url is still valid
+    Mark it as recently used
+    """
+    __count(HITS)
+
+    try:
+        os.utime(__cache_file(url, token))
+    except FileNotFoundError:
+        pass
+
+
+def store(url, token, response, data):
+    """
+    Store the parsed data of a 200 response if it carries a validator
+    """
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+
+    if not etag and not last_modified:
+        __count(UNCACHEABLE)
+        return
+
+    __count(MISSES)
+
+    entry = {"etag": etag,
+             "last_modified": last_modified,
+             "headers": dict([(x, response.headers[x]) for x in CACHED_HEADERS if x in response.headers]),
+             "data": data}
+
+    cache_file = __cache_file(url, token)
+    os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+
+    # write to a temp file and rename so no process ever reads a partial entry
+    (fd, tmp_file) = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+
+    new_size = os.path.getsize(tmp_file)
+
+    # processes storing the same url must not both count the old size away
+    with __stats.get_lock():
+        try:
+            old_size = os.path.getsize(cache_file)
+        except OSError:
+            old_size = 0
+
+        os.replace(tmp_file, cache_file)
+        __stats[SIZE] += new_size - old_size
+
+        if __stats[SIZE] > CACHE_MAX_SIZE:
+            __evict()
+
+
+def get_stats():
+    """
+    Returns a dict of the cache counters of all processes
+    """
+    if not __stats:
+        return {}
+
+    requests = __stats[HITS] + __stats[MISSES] + __stats[UNCACHEABLE]
+
+    return {"hits": __stats[HITS],
+            "misses": __stats[MISSES],
+            "uncacheable": __stats[UNCACHEABLE],
+            "hit_rate": __stats[HITS] / requests if requests else 0.0,
+            "size": __stats[SIZE],
+            "evictions": __stats[EVICTIONS]}
+
+
+def report():
+    """
+    Returns a one line report of the cache counters
+    """
+    stats = get_stats()
+
+    if not stats:
+        return "API cache disabled"
+
+    return "API cache: %(hits)d hits (304), %(misses)d misses, %(uncacheable)d uncacheable, hit rate %(hit_rate).1f%%, %(size)d bytes, %(evictions)d evicted" % \
+           dict(stats, hit_rate=stats["hit_rate"] * 100)
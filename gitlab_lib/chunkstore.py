@@ -0,0 +1,561 @@
+#
+# Central lib for Gitlab Tools - Content-addressed deduplicating store
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Instead of a .tgz per repository and a .json per dump, the data is cut
+# into chunks that are stored once in STORE_DIR/chunks/<xx>/<sha256> and the
+# backup directory only gets a recipe <file>.chunks listing the chunks.
+# Identical data of other nights, forks or projects is stored only once.
+#
+# Chunk boundaries depend on the content, not on the offset, so inserting
+# data only changes the chunks around it. Candidate cut points are the
+# ANCHOR bytes, found by bytes.find() in C. ANCHOR '{' starts every object in
+# the JSON dumps and occurs every 256 bytes on average in compressed git
+# objects. A candidate becomes a cut point if the crc32 of the WINDOW bytes
+# before it matches ANCHOR_MASK. Chunks are between CHUNK_MIN_SIZE and
+# CHUNK_MAX_SIZE bytes long.
+#
+# commit() records all recipes of a backup directory as a snapshot in
+# STORE_DIR/snapshots/<timestamp>.json and counts the references of
+# every chunk in STORE_DIR/refcounts.db. collect_garbage() drops all but
+# the newest KEEP_SNAPSHOTS snapshots and removes chunks nobody refers to.
+# A backup directory can be restored as long as its snapshot is kept.
+#
+# The store is disabled until enable() is called.
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+import time
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import tarfile
+from collections import Counter
+from .core import *
+from .exception import ArchiveError, ReadError
+
+
+#
+# Configuration
+#
+
+STORE_DIR = None
+KEEP_SNAPSHOTS = 14
+
+RECIPE_SUFFIX = ".chunks"
+RECIPE_VERSION = 1
+
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+ANCHOR = b"{"
+ANCHOR_MASK = 0xff
+WINDOW = 32
+
+# chunks are zlib compressed unless that does not make them smaller
+CHUNK_COMPRESSION = 1
+RAW_CHUNK = b"r"
+ZLIB_CHUNK = b"z"
+
+# unreferenced chunks younger than this may belong to a run still in progress
+GRACE_PERIOD = 24 * 3600
+
+
+#
+# Subroutines
+#
+
+def enable(store_dir, keep=KEEP_SNAPSHOTS):
+    """
+    Store chunks in store_dir and keep the snapshots of the last keep runs
+    """
+    global STORE_DIR, KEEP_SNAPSHOTS
+
+    os.makedirs(os.path.join(store_dir, "chunks"), mode=0o700, exist_ok=True)
+    os.makedirs(os.path.join(store_dir, "snapshots"), mode=0o700, exist_ok=True)
+
+    STORE_DIR = os.path.abspath(store_dir)
+    KEEP_SNAPSHOTS = keep
+
+
+def is_enabled():
+    return STORE_DIR is not None
+
+
+def chunk_path(chunk_id, store_dir=None):
+    """
+    Returns the file of a chunk
+    """
+    return os.path.join(store_dir or STORE_DIR, "chunks", chunk_id[:2], chunk_id)
+
+
+def cut_point(data):
+    """
+    Returns the length of the first chunk of data
+    data must hold at least CHUNK_MAX_SIZE bytes unless it is the last chunk
+    """
+    limit = min(len(data), CHUNK_MAX_SIZE)
+
+    if limit <= CHUNK_MIN_SIZE:
+        return limit
+
+    pos = data.find(ANCHOR, CHUNK_MIN_SIZE, limit)
+
+    while pos != -1:
+        if zlib.crc32(data[pos - WINDOW:pos]) & ANCHOR_MASK == 0:
+            return pos
+
+        pos = data.find(ANCHOR, pos + 1, limit)
+
+    return limit
+
+
+def put_chunk(data):
+    """
+    Store a chunk unless it exists
+    Returns a tuple of chunk id, bytes on disk and whether it is new
+    """
+    chunk_id = hashlib.sha256(data).hexdigest()
+    chunk_file = chunk_path(chunk_id)
+
+    try:
+        stored_size = os.stat(chunk_file).st_size
+
+        # tell collect_garbage() of concurrent runs and Writer.abort() of
+        # other writers that it is in use again, to the nanosecond
+        now = time.time_ns()
+        os.utime(chunk_file, ns=(now, now))
+        return (chunk_id, stored_size, False)
+    except FileNotFoundError:
+        pass
+
+    compressed = zlib.compress(data, CHUNK_COMPRESSION)
+    content = ZLIB_CHUNK + compressed if len(compressed) < len(data) else RAW_CHUNK + data
+    tmp_file = "%s.%d.tmp" % (chunk_file, os.getpid())
+
+    os.makedirs(os.path.dirname(chunk_file), exist_ok=True)
+
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+
+    os.replace(tmp_file, chunk_file)
+
+    return (chunk_id, len(content), True)
+
+
+def read_chunk(chunk_id, store_dir=None):
+    """
+    Returns the data of a chunk
+    Raises ArchiveError if it is missing or damaged
+    """
+    chunk_file = chunk_path(chunk_id, store_dir)
+
+    try:
+        with open(chunk_file, "rb") as f:
+            content = f.read()
+
+        data = zlib.decompress(content[1:]) if content[:1] == ZLIB_CHUNK else content[1:]
+    except (IOError, zlib.error) as e:
+        raise ArchiveError(chunk_file, chunk_id, str(e))
+
+    if hashlib.sha256(data).hexdigest() != chunk_id:
+        raise ArchiveError(chunk_file, chunk_id, "Checksum mismatch")
+
+    return data
+
+
+class Writer(object):
+    """
+    File object storing everything written to it as chunks
+    close() writes the recipe to recipe_file, abort() drops the new chunks
+    """
+    def __init__(self, recipe_file):
+        self.recipe_file = recipe_file
+        self.buffer = bytearray()
+        self.chunks = []
+        self.put_chunks = {}
+        self.size = 0
+        self.new_chunks = 0
+        self.new_size = 0
+        self.stored_size = 0
+        self.start = time.time()
+
+    def __flush(self, length):
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        (chunk_id, stored_size, new) = put_chunk(data)
+        self.chunks.append([chunk_id, length, stored_size])
+
+        # remember when the chunks created here were last used by us
+        if new or chunk_id in self.put_chunks:
+            self.put_chunks[chunk_id] = os.stat(chunk_path(chunk_id)).st_mtime_ns
+
+        if new:
+            self.new_chunks += 1
+            self.new_size += length
+            self.stored_size += stored_size
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+
+        while len(self.buffer) >= CHUNK_MAX_SIZE:
+            self.__flush(cut_point(self.buffer))
+
+        return len(data)
+
+    def close(self):
+        """
+        Store the rest and write the recipe
+        Returns the recipe
+        """
+        while self.buffer:
+            self.__flush(cut_point(self.buffer))
+
+        recipe = {"version": RECIPE_VERSION,
+                  "store": STORE_DIR,
+                  "created": time.time(),
+                  "seconds": time.time() - self.start,
+                  "size": self.size,
+                  "new_chunks": self.new_chunks,
+                  "new_size": self.new_size,
+                  "stored_size": self.stored_size,
+                  "chunks": self.chunks}
+
+        with open(self.recipe_file + ".tmp", "w") as f:
+            json.dump(recipe, f)
+
+        os.replace(self.recipe_file + ".tmp", self.recipe_file)
+
+        return recipe
+
+
+    def abort(self):
+        """
+        Remove the chunks this writer created, no recipe refers to them
+        Chunks used by another writer since are kept
+        """
+        self.buffer = bytearray()
+
+        for (chunk_id, mtime) in self.put_chunks.items():
+            release_chunk(chunk_id, mtime)
+
+        self.put_chunks = {}
+
+
+def release_chunk(chunk_id, mtime):
+    """
+    Remove a chunk unless it was used after mtime (nanoseconds)
+    """
+    chunk_file = chunk_path(chunk_id)
+
+    try:
+        if os.stat(chunk_file).st_mtime_ns == mtime:
+            os.unlink(chunk_file)
+    except FileNotFoundError:
+        pass
+
+
+def store_data(data, recipe_file):
+    """
+    Store data (bytes) and write its recipe to recipe_file
+    Returns the recipe
+    """
+    writer = Writer(recipe_file)
+    writer.write(data)
+
+    return writer.close()
+
+
+def store_directory(src_dir, recipe_file):
+    """
+    Store an uncompressed tar stream of src_dir, compressing it would
+    hide identical files from the chunking
+    Returns the recipe
+    """
+    writer = Writer(recipe_file)
+    tar = tarfile.open(fileobj=writer, mode="w|")
+    tar.add(src_dir, arcname=".", recursive=True)
+    tar.close()
+
+    return writer.close()
+
+
+def load_recipe(recipe_file):
+    """
+    Returns the recipe in recipe_file
+    """
+    return parse_json(recipe_file)
+
+
+def iter_data(recipe_file):
+    """
+    Generator yielding the data of recipe_file chunk by chunk
+    """
+    recipe = load_recipe(recipe_file)
+
+    # restore may run without enable(), the recipe knows its store
+    for (chunk_id, size, stored_size) in recipe["chunks"]:
+        yield read_chunk(chunk_id, recipe["store"])
+
+
+def extract(recipe_file, dest_file):
+    """
+    Write the data of recipe_file to dest_file
+    """
+    with open(dest_file + ".tmp", "wb") as f:
+        for data in iter_data(recipe_file):
+            f.write(data)
+
+    os.replace(dest_file + ".tmp", dest_file)
+
+
+def has_recipes(backup_dir):
+    """
+    Returns True if backup_dir holds recipes
+    """
+    return any([x.endswith(RECIPE_SUFFIX) for x in os.listdir(backup_dir)])
+
+
+def checkout(backup_dir, dest_dir):
+    """
+    Copy backup_dir to dest_dir replacing every recipe <file>.chunks by <file>
+    Other files are hardlinked
+    """
+    for (directory, subdirs, files) in os.walk(backup_dir):
+        output_dir = os.path.join(dest_dir, os.path.relpath(directory, backup_dir))
+        os.makedirs(output_dir, exist_ok=True)
+
+        for filename in files:
+            if filename.endswith(RECIPE_SUFFIX):
+                extract(os.path.join(directory, filename), os.path.join(output_dir, filename[:-len(RECIPE_SUFFIX)]))
+            else:
+                try:
+                    os.link(os.path.join(directory, filename), os.path.join(output_dir, filename))
+                except OSError:
+                    shutil.copy2(os.path.join(directory, filename), os.path.join(output_dir, filename))
+
+
+def lock():
+    """
+    Exclusively lock the snapshots and reference counts (see core.file_lock)
+    """
+    return file_lock(os.path.join(STORE_DIR, "store.lock"))
+
+
+def __connect():
+    """
+    Helper function - Open the reference count database
+    """
+    db = sqlite3.connect(os.path.join(STORE_DIR, "refcounts.db"))
+    db.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, refs INTEGER, size INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, created REAL, size INTEGER)")
+
+    return db
+
+
+def __snapshot_file(name):
+    return os.path.join(STORE_DIR, "snapshots", name + ".json")
+
+
+def commit(backup_dir, since=0):
+    """
+    Record all recipes below backup_dir as a new snapshot and reference their chunks
+    since is the start time of the run, only recipes written after it
+    count into the statistics of the run
+    Returns a dict of statistics
+    """
+    files = {}
+    refs = Counter()
+    sizes = {}
+    stats = {"files": 0, "size": 0, "run_files": 0, "run_size": 0, "new_chunks": 0,
+             "new_size": 0, "stored_size": 0, "seconds": 0.0}
+
+    for (directory, subdirs, filenames) in os.walk(backup_dir):
+        for filename in filenames:
+            if not filename.endswith(RECIPE_SUFFIX):
+                continue
+
+            recipe = load_recipe(os.path.join(directory, filename))
+            files[os.path.relpath(os.path.join(directory, filename), backup_dir)] = {"size": recipe["size"], "chunks": recipe["chunks"]}
+            stats["files"] += 1
+            stats["size"] += recipe["size"]
+
+            for (chunk_id, size, stored_size) in recipe["chunks"]:
+                refs[chunk_id] += 1
+                sizes[chunk_id] = stored_size
+
+            if recipe["created"] >= since:
+                stats["run_files"] += 1
+                stats["run_size"] += recipe["size"]
+
+                for key in ("new_chunks", "new_size", "stored_size", "seconds"):
+                    stats[key] += recipe[key]
+
+    with lock():
+        timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        name = timestamp
+
+        while os.path.exists(__snapshot_file(name)):
+            name = "%s.%d" % (timestamp, int(name[len(timestamp) + 1:] or 0) + 1)
+
+        snapshot = {"name": name,
+                    "backup_dir": os.path.abspath(backup_dir),
+                    "created": time.time(),
+                    "size": stats["size"],
+                    "files": files}
+
+        with open(__snapshot_file(name) + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+
+        db = __connect()
+
+        with db:
+            db.executemany("INSERT INTO chunks VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET refs = refs + excluded.refs",
+                           [(x, y, sizes[x]) for (x, y) in refs.items()])
+            db.execute("INSERT INTO snapshots VALUES (?, ?, ?)", (name, snapshot["created"], stats["size"]))
+
+        db.close()
+        os.replace(__snapshot_file(name) + ".tmp", __snapshot_file(name))
+
+    stats["snapshot"] = name
+    stats.update(store_stats())
+
+    return stats
+
+
+def store_stats():
+    """
+    Returns a dict with the number of snapshots and chunks, the bytes of
+    all snapshots and the bytes on disk of all chunks
+    """
+    db = __connect()
+    (snapshots, size) = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM snapshots").fetchone()
+    (chunks, store_size) = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chunks WHERE refs > 0").fetchone()
+    db.close()
+
+    return {"snapshots": snapshots, "snapshots_size": size, "chunks": chunks, "store_size": store_size}
+
+
+def __remove_chunk(chunk_file, grace_time):
+    """
+    Helper function - Remove a chunk unless it was used after grace_time
+    Returns the bytes freed
+    """
+    try:
+        stat = os.stat(chunk_file)
+
+        if stat.st_mtime < grace_time:
+            os.unlink(chunk_file)
+            return stat.st_size
+    except FileNotFoundError:
+        pass
+
+    return 0
+
+
+def collect_garbage(keep=None, grace_period=GRACE_PERIOD):
+    """
+    Drop all but the newest keep snapshots (default KEEP_SNAPSHOTS) and
+    remove chunks without references not used in the last grace_period seconds
+    Chunks of runs that never committed are removed the same way
+    Returns a tuple of removed snapshots, removed chunks and freed bytes
+    """
+    keep = KEEP_SNAPSHOTS if keep is None else keep
+    grace_time = time.time() - grace_period
+    removed_chunks = 0
+    freed = 0
+
+    with lock():
+        db = __connect()
+        old_snapshots = [x[0] for x in db.execute("SELECT name FROM snapshots ORDER BY created DESC, name DESC").fetchall()[keep:]]
+
+        for name in old_snapshots:
+            log("Dropping chunk store snapshot %s" % (name,))
+            refs = Counter()
+
+            try:
+                for entry in parse_json(__snapshot_file(name))["files"].values():
+                    refs.update([x[0] for x in entry["chunks"]])
+            except ReadError:
+                error("Snapshot %s is missing, its chunks are removed by the orphan sweep" % (name,))
+
+            with db:
+                db.executemany("UPDATE chunks SET refs = refs - ? WHERE id = ?", [(y, x) for (x, y) in refs.items()])
+                db.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+
+            try:
+                os.unlink(__snapshot_file(name))
+            except FileNotFoundError:
+                pass
+
+        # unreferenced chunks used by a run in progress stay until the next time
+        for (chunk_id,) in db.execute("SELECT id FROM chunks WHERE refs <= 0").fetchall():
+            size = __remove_chunk(chunk_path(chunk_id), grace_time)
+
+            if size or not os.path.exists(chunk_path(chunk_id)):
+                with db:
+                    db.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+
+                removed_chunks += 1
+                freed += size
+
+        # chunks of crashed runs were never referenced
+        for subdir in os.scandir(os.path.join(STORE_DIR, "chunks")):
+            for entry in os.scandir(subdir.path):
+                chunk_id = entry.name.split(".")[0]
+
+                if entry.name.endswith(".tmp") or not db.execute("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)).fetchone():
+                    size = __remove_chunk(entry.path, grace_time)
+
+                    if size:
+                        removed_chunks += 1
+                        freed += size
+
+        db.close()
+
+    return (len(old_snapshots), removed_chunks, freed)
+
+
+def report(stats):
+    """
+    Returns a list of lines describing the statistics of commit()
+    """
+    mb = 1024 * 1024
+    lines = ["Chunk store: %d MB in %d files this run, %d MB new in %d chunks, %d MB written" %
+             (stats["run_size"] // mb, stats["run_files"], stats["new_size"] // mb, stats["new_chunks"], stats["stored_size"] // mb)]
+
+    if stats["stored_size"]:
+        lines.append("Chunk store: dedup ratio of this run %.1f" % (stats["run_size"] / stats["stored_size"],))
+
+    if stats["seconds"]:
+        lines.append("Chunk store: %.1f MB/s per process" % (stats["run_size"] / mb / stats["seconds"],))
+
+    if stats["store_size"]:
+        lines.append("Chunk store: %d snapshots of %d MB in %d chunks of %d MB, dedup ratio %.1f" %
+                     (stats["snapshots"], stats["snapshots_size"] // mb, stats["chunks"], stats["store_size"] // mb,
+                      stats["snapshots_size"] / stats["store_size"]))
+
+    return lines
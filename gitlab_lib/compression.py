@@ -0,0 +1,231 @@
+#
+# Central lib for Gitlab Tools - Pluggable compression of tar archives
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# archivate() writes the tar stream into the compressor of the selected
+# CODEC without an intermediate file
+#
+#   gzip   Python gzip on one core (default, .tgz)
+#   pigz   multi-threaded gzip, same .tgz format
+#   zstd   multi-threaded zstd (.tar.zst)
+#   none   no compression (.tar)
+#
+# pigz and zstd run as external processes with THREADS threads (0 = all
+# cores). extract() detects the format by its magic bytes, so restore
+# does not need to know how an archive was made.
+#
+
+#
+# Loading modules
+#
+
+import os
+import gzip
+import shutil
+import tarfile
+import subprocess
+from .core import *
+from .exception import ArchiveError
+
+
+#
+# Configuration
+#
+
+CODEC = "gzip"
+LEVEL = 0
+THREADS = 0
+
+# extension, default level and the command compressing stdin to stdout
+CODECS = {"gzip": (".tgz", 9, None),
+          "pigz": (".tgz", 6, ["pigz", "-c", "-p", "{threads}", "-{level}"]),
+          "zstd": (".tar.zst", 3, ["zstd", "-c", "-q", "-T{threads}", "-{level}"]),
+          "none": (".tar", 0, None)}
+
+# highest level of the codecs having one, zstd needs --ultra above 19
+MAX_LEVELS = {"gzip": 9, "pigz": 11, "zstd": 22}
+ZSTD_ULTRA_LEVEL = 19
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+#
+# Subroutines
+#
+
+def select(codec, level=0, threads=0):
+    """
+    Compress archives with codec at level (0 = default of the codec)
+    using threads threads (0 = all cores)
+    Raises ValueError if the codec or level is unknown or its program is not installed
+    """
+    global CODEC, LEVEL, THREADS
+
+    if codec not in CODECS:
+        raise ValueError("Unknown compression %s, use one of %s" % (codec, ", ".join(sorted(CODECS))))
+
+    if codec in MAX_LEVELS and not 0 <= level <= MAX_LEVELS[codec]:
+        raise ValueError("Compression %s supports levels up to %d, not %d" % (codec, MAX_LEVELS[codec], level))
+
+    if not is_available(codec):
+        raise ValueError("Compression %s needs %s, which is not installed" % (codec, CODECS[codec][2][0]))
+
+    CODEC = codec
+    LEVEL = level
+    THREADS = threads
+
+
+def is_available(codec=None):
+    """
+    Returns False if the program of codec (default CODEC) is not installed
+    """
+    compress_cmd = CODECS[codec or CODEC][2]
+
+    return not compress_cmd or shutil.which(compress_cmd[0]) is not None
+
+
+def parse(spec):
+    """
+    Returns a tuple of codec and level of a spec like zstd or zstd:19
+    """
+    (codec, sep, level) = spec.partition(":")
+
+    return (codec, int(level) if level else 0)
+
+
+def extension(codec=None):
+    """
+    Returns the file extension of archives of codec (default CODEC)
+    """
+    return CODECS[codec or CODEC][0]
+
+
+def __level(codec):
+    return LEVEL or CODECS[codec][1]
+
+
+def command(codec=None):
+    """
+    Returns the compressor command of codec (default CODEC) or None
+    if it is compressed in Python or not at all
+    """
+    codec = codec or CODEC
+
+    if not CODECS[codec][2]:
+        return None
+
+    threads = THREADS or os.cpu_count() or 1
+    compress_cmd = [x.format(threads=threads, level=__level(codec)) for x in CODECS[codec][2]]
+
+    if codec == "zstd" and __level(codec) > ZSTD_ULTRA_LEVEL:
+        compress_cmd.insert(1, "--ultra")
+
+    return compress_cmd
+
+
+def open_writer(filename, codec=None):
+    """
+    Returns a tuple of a binary file object compressing to filename
+    and a function closing it that raises ArchiveError if the compressor failed
+    Call it with abort=True after a failed write to kill the compressor
+    """
+    codec = codec or CODEC
+    compress_cmd = command(codec)
+    break_link(filename)
+
+    if codec == "gzip":
+        out = gzip.open(filename, "wb", compresslevel=__level(codec))
+    else:
+        out = open(filename, "wb")
+
+    if not compress_cmd:
+        return (out, lambda abort=False: out.close())
+
+    debug("Compressing %s with %s", filename, " ".join(compress_cmd))
+
+    try:
+        compressor = subprocess.Popen(compress_cmd, stdin=subprocess.PIPE, stdout=out, stderr=subprocess.PIPE)
+    except OSError:
+        out.close()
+        os.unlink(filename)
+        raise
+
+    def finish(abort=False):
+        if abort:
+            compressor.kill()
+
+        try:
+            compressor.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        try:
+            compressor.wait(timeout=TAR_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            compressor.kill()
+            compressor.wait()
+        finally:
+            out.close()
+
+        if not abort and compressor.returncode != 0:
+            raise ArchiveError(filename, codec, compressor.stderr.read().decode("utf8", "replace") or "%s exited with %d" % (compress_cmd[0], compressor.returncode))
+
+    return (compressor.stdin, finish)
+
+
+def tar_command(filename, src_dir, codec=None):
+    """
+    Returns the command creating the archive filename of src_dir with console tar
+    """
+    codec = codec or CODEC
+    tar_cmd = ["tar", "-c", "-f", filename, "-C", src_dir]
+
+    if codec == "gzip":
+        tar_cmd.append("-z")
+    elif command(codec):
+        tar_cmd += ["-I", " ".join(command(codec))]
+
+    return tar_cmd + ["."]
+
+
+def extract(archive_file, dest_dir):
+    """
+    Unpack a tar archive of any codec to dest_dir
+    """
+    with open(archive_file, "rb") as f:
+        magic = f.read(len(ZSTD_MAGIC))
+
+    # tarfile knows gzip, bzip2 and xz, but not zstd
+    if magic != ZSTD_MAGIC:
+        with tarfile.open(archive_file, "r:*") as tar:
+            tar.extractall(dest_dir)
+
+        return
+
+    zstd = subprocess.Popen(["zstd", "-d", "-c", "-q", archive_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    with tarfile.open(fileobj=zstd.stdout, mode="r|") as tar:
+        tar.extractall(dest_dir)
+
+    zstd.stdout.close()
+    zstd.wait(timeout=TAR_TIMEOUT)
+
+    if zstd.returncode != 0:
+        raise ArchiveError(archive_file, dest_dir, zstd.stderr.read().decode("utf8", "replace"))
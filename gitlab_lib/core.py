@@ -23,15 +23,21 @@
 #
 
 import os
+import re
 import json
+import time
 import random
 import string
 import datetime
-import requests
-from multiprocessing import Process
+import fcntl
+import codecs
+import shutil
+import threading
+from contextlib import contextmanager
+from collections import deque, Counter
 from .api import API_BASE_URL
 from .exception import WebError, ReadError, ParseError
-from gitlab_config import SERVER, TOKEN, CLONE_ACCESS_TOKEN, REPOSITORY_DIR, BACKUP_DIR, UPLOAD_DIR, TMP_DIR, ERROR_LOG, LOG_ERRORS, LOG_TIMESTAMP, TAR_TIMEOUT, GIT_TIMEOUT, API_TIMEOUT
+from gitlab_config import SERVER, TOKEN, CLONE_ACCESS_TOKEN, CLONE_FROM_DISK, STREAM_REPOSITORIES, REPOSITORY_DIR, BACKUP_DIR, UPLOAD_DIR, TMP_DIR, ERROR_LOG, LOG_ERRORS, LOG_TIMESTAMP, TAR_TIMEOUT, GIT_TIMEOUT, API_TIMEOUT, API_POOL_CONNECTIONS, API_POOL_MAXSIZE, ATTACHMENT_CONCURRENCY
 
 #
 # Configuration
@@ -40,6 +46,30 @@ from gitlab_config import SERVER, TOKEN, CLONE_ACCESS_TOKEN, REPOSITORY_DIR, BAC
 QUIET=False
 DEBUG=False
 
+# Retry throttled (429) or temporarily failing requests with jittered
+# exponential backoff. Number of retries per HTTP method, POST is not
+# idempotent and therefore not retried by default.
+RETRY_BUDGET={"GET": 5, "PUT": 3, "DELETE": 3, "POST": 0}
+RETRY_STATUS=(429, 502, 503, 504)
+RETRY_BACKOFF=1.0
+# also the longest wait a Retry-After or RateLimit-Reset header can demand
+RETRY_BACKOFF_MAX=60.0
+
+# number of throttled / failed responses per (method, endpoint, status)
+API_STATUS_COUNTER = Counter()
+
+# keep-alive HTTP session of the current process (see get_session)
+__session = None
+__session_pid = None
+
+# attachment thread pool shared by all fetch_concurrently calls of the
+# current process (see __attachment_executor)
+__executor = None
+__executor_pid = None
+__executor_size = None
+__executor_lock = threading.Lock()
+__executor_thread = threading.local()
+
 
 #
 # Subroutines
@@ -54,71 +84,268 @@ def log_prefix():
         return ""
 
 
-def log(message):
+def log(message, *args):
     """
     Log a message to STDOUT
+    message is formatted with args only when it gets written
     """
     if not QUIET:
-        print("%s%s" % (log_prefix(), message))
+        from . import logqueue
 
+        logqueue.write(logqueue.make_record("INFO", message, args, DEBUG))
 
-def error(message):
+
+def error(message, *args):
     """
-    Log an error message
+    Log an error message to STDOUT and ERROR_LOG
     """
-    print("%s>>> ERROR: %s" % (log_prefix(), message))
+    from . import logqueue
 
-    if LOG_ERRORS:
-        with open(ERROR_LOG, "a") as err:
-            ts = datetime.datetime.now().strftime(LOG_TIMESTAMP)
-            err.write("[%s] %s\n" % (ts, message))
+    logqueue.write(logqueue.make_record("ERROR", message, args, DEBUG))
 
 
-def info(message):
+def info(message, *args):
     """
     Log an info message
     """
-    log(message)
+    log(message, *args)
 
 
-def debug(message):
+def debug(message, *args):
     """
     Log a debug message
+    Costs nothing but the call if DEBUG is off, so pass args instead of
+    formatting the message yourself
     """
-    if DEBUG:
-        log("DEBUG: " + message)
+    if DEBUG and not QUIET:
+        from . import logqueue
+
+        logqueue.write(logqueue.make_record("DEBUG", message, args, DEBUG))
+
+
+def get_session():
+    """
+    Returns the requests Session of the current process
+    All API calls share its connection pool so TCP and TLS connections
+    to the Gitlab server are reused instead of handshaking on every request
+    A forked process (see create_process) gets a fresh session of its own
+    """
+    global __session, __session_pid
+
+    if __session is None or __session_pid != os.getpid():
+        # Never close a session inherited by fork, its sockets are still
+        # in use by the parent process. Just forget about it.
+        import requests
+        import requests.adapters
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=API_POOL_CONNECTIONS,
+                                                pool_maxsize=API_POOL_MAXSIZE)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        __session = session
+        __session_pid = os.getpid()
+
+    return __session
+
+
+def close_session():
+    """
+    Close all pooled connections of the current process
+    The next API call will open a new session
+    """
+    global __session, __session_pid
+
+    if __session is not None and __session_pid == os.getpid():
+        __session.close()
+
+    __session = None
+    __session_pid = None
+
+
+def api_endpoint(url):
+    """
+    Returns the endpoint template of an api url without query string and ids
+    e.g. /api/v4/projects/:id/issues/:id/notes
+    """
+    path = url.split("?")[0].split("/", 3)[-1]
+
+    return "/" + re.sub(r"(?<=/)\d+(?=/|$)", ":id", path)
+
+
+def count_api_status(method, url, status):
+    """
+    Count a throttled or failed response of the given url
+    """
+    API_STATUS_COUNTER[(method, api_endpoint(url), status)] += 1
+
+
+def get_api_status_stats():
+    """
+    Returns a dict endpoint -> dict "METHOD status" -> number of throttled
+    or failed responses sorted by endpoint
+    """
+    stats = {}
+
+    for ((method, endpoint, status), count) in sorted(API_STATUS_COUNTER.items(), key=lambda x: (x[0][1], x[0][0], str(x[0][2]))):
+        stats.setdefault(endpoint, {})["%s %s" % (method, status)] = count
+
+    return stats
+
+
+def log_api_status_stats():
+    """
+    Log how often each endpoint was throttled or failed in this process
+    """
+    for (endpoint, counts) in get_api_status_stats().items():
+        info("[%d] API %s throttled / failed: %s" % (os.getpid(), endpoint, ", ".join(["%s %dx" % x for x in counts.items()])))
+
+
+def retry_delay(headers, attempt):
+    """
+    Seconds to wait before the next retry
+    Honours Retry-After (seconds or HTTP date) and RateLimit-Reset (epoch)
+    otherwise use exponential backoff with full jitter
+    Never waits longer than RETRY_BACKOFF_MAX
+    """
+    delay = None
+    retry_after = headers.get("Retry-After")
+    ratelimit_reset = headers.get("RateLimit-Reset")
+
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            import email.utils
+
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+
+    if delay is None and ratelimit_reset:
+        try:
+            delay = float(ratelimit_reset) - time.time()
+        except ValueError:
+            pass
+
+    if delay is None:
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
 
+    # a bogus header (e.g. a date far in the future) must not stall the worker for hours
+    return min(max(delay, 0), RETRY_BACKOFF_MAX)
 
-def rest_api_call(url, data={}, method="POST"):
+
+def __record_api_metrics(method, url, status, duration, response, stream):
+    """
+    Helper function - Count request, latency and received bytes per endpoint template
+    """
+    from . import metrics
+
+    labels = {"method": method, "endpoint": api_endpoint(url)}
+    metrics.observe("gitlab_api_request_duration_seconds", duration, labels)
+    metrics.inc("gitlab_api_requests_total", dict(labels, status=str(status)))
+
+    if response is not None:
+        if stream:
+            size = int(response.headers.get("Content-Length", 0))
+        else:
+            size = len(response.content)
+
+        metrics.inc("gitlab_api_response_bytes_total", labels, size)
+
+
+def __send_request(url, data, method, headers={}, stream=False):
+    """
+    Helper function - Send a single request with the session of this process
+    """
+    session = get_session()
+    headers = dict(headers)
+    headers["PRIVATE-TOKEN"] = TOKEN
+
+    if method == "GET":
+        response = session.get(url, headers=headers, timeout=API_TIMEOUT, stream=stream)
+    elif method == "PUT":
+        response = session.put(url, data=data, headers=headers, timeout=API_TIMEOUT)
+    elif method == "DELETE":
+        response = session.delete(url, headers=headers, timeout=API_TIMEOUT)
+    else:
+        response = session.post(url, data=data, headers=headers, timeout=API_TIMEOUT)
+
+    return response
+
+
+def rest_api_call(url, data={}, method="POST", headers={}, stream=False, retries=None):
     """
     POST or PUT data dictionary to URL
+    headers can contain additional request headers
+    stream=True defers downloading the body of a GET (see iter_json_array)
+    Throttled (see RETRY_STATUS) or failed requests are retried up to
+    retries times, default RETRY_BUDGET[method]
     Returns: request Response object
 
     >>> rest_api_call("https://" + SERVER + "/api/v3/projects/2/issues", {"id": 2, "title": "just a test"}).json()['title']
     u'just a test'
     """
-    error_msg = None
+    # requests takes longer to import than all of gitlab_lib together,
+    # so scripts only pay for it when they really send a request
+    import requests
+    from . import metrics
 
-    try:
-        debug(method + "\n\turl " + url + "\n\tdata " + str(data) + "\n")
+    attempt = 0
 
-        if method == "GET":
-            response = requests.get(url, headers={"PRIVATE-TOKEN" : TOKEN}, timeout=API_TIMEOUT)
-        elif method == "PUT":
-            response = requests.put(url, data=data, headers={"PRIVATE-TOKEN" : TOKEN}, timeout=API_TIMEOUT)
-        elif method == "DELETE":
-            response = requests.delete(url, headers={"PRIVATE-TOKEN" : TOKEN}, timeout=API_TIMEOUT)
-        else:
-            response = requests.post(url, data=data, headers={"PRIVATE-TOKEN" : TOKEN}, timeout=API_TIMEOUT)
-    except (requests.exceptions.ConnectionError, requests.exceptions.RequestException) as e:
-        error_msg = "Request to url %s failed: %s" % (url, str(e))
+    if retries is None:
+        retries = RETRY_BUDGET.get(method, 0)
+
+    while 1:
+        error_msg = None
         response = None
-    except requests.exceptions.Timeout as e:
-        error_msg = "Request to url %s timedout: %s\n%s" % (url, response.text, str(e))
+        status = None
+
+        start = time.time()
+
+        try:
+            debug("%s\n\turl %s\n\tdata %s\n", method, url, data)
+            response = __send_request(url, data, method, headers, stream)
+            status = response.status_code
+        except requests.exceptions.Timeout as e:
+            error_msg = "Request to url %s timedout: %s" % (url, str(e))
+            status = "timeout"
+        except (requests.exceptions.ConnectionError, requests.exceptions.RequestException) as e:
+            error_msg = "Request to url %s failed: %s" % (url, str(e))
+            status = "error"
 
+        if metrics.is_enabled():
+            __record_api_metrics(method, url, status, time.time() - start, response, stream)
 
-    if response:
-        debug("RESPONSE " + str(response.status_code) + " " + response.text)
+        if not error_msg and status not in RETRY_STATUS:
+            break
+
+        count_api_status(method, url, status)
+
+        if attempt >= retries:
+            break
+
+        delay = retry_delay(response.headers if response is not None else {}, attempt)
+        debug("Request to url %s got %s. Retry %d in %.1fs", url, status, attempt + 1, delay)
+        metrics.inc("gitlab_api_retries_total", {"method": method, "endpoint": api_endpoint(url), "status": str(status)})
+
+        # give a streamed connection back to the pool before waiting
+        if response is not None:
+            response.close()
+
+        time.sleep(delay)
+        attempt += 1
+
+
+    # never decode the body just to throw it away
+    if not DEBUG:
+        pass
+    elif response is not None and stream:
+        debug("RESPONSE %d (streamed)", response.status_code)
+    elif response:
+        debug("RESPONSE %d %s", response.status_code, response.text)
     else:
         debug("NO RESPONSE")
 
@@ -141,6 +368,39 @@ def rest_api_call(url, data={}, method="POST"):
     return response
 
 
+def __get_json(rest_url):
+    """
+    Helper function - GET rest_url and parse the JSON
+    If the response cache is enabled the request is conditional and a
+    304 Not Modified returns the cached data without parsing it again
+    Returns a tuple of the parsed data and the Response object
+    """
+    from . import cache
+
+    if not cache.is_enabled():
+        response = rest_api_call(rest_url, method="GET")
+        return (response.json(), response)
+
+    entry = cache.lookup(rest_url, TOKEN)
+    response = rest_api_call(rest_url, method="GET", headers=cache.conditional_headers(entry))
+
+    if entry and response is not None and response.status_code == 304:
+        cache.hit(rest_url, TOKEN)
+
+        # 304 responses may lack the pagination headers
+        for (name, value) in entry["headers"].items():
+            response.headers.setdefault(name, value)
+
+        return (entry["data"], response)
+
+    data = response.json()
+
+    if response.status_code == 200:
+        cache.store(rest_url, TOKEN, response, data)
+
+    return (data, response)
+
+
 def make_request(method="GET", rest_url=None, data={}, ignore_errors=False):
     """
     Make REST call and parse results
@@ -149,10 +409,13 @@ def make_request(method="GET", rest_url=None, data={}, ignore_errors=False):
     result = []
 
     try:
-        result = rest_api_call(rest_url, data=data, method=method)
+        if method == "GET":
+            result = __get_json(rest_url)[0]
+        else:
+            result = rest_api_call(rest_url, data=data, method=method)
 
-        if not method == "DELETE":
-            result = result.json()
+            if not method == "DELETE":
+                result = result.json()
 
     except (TypeError, ValueError) as e:
         if not ignore_errors:
@@ -182,34 +445,388 @@ def fetch(rest_url, ignore_errors=False):
     return make_request("GET", rest_url, ignore_errors=ignore_errors)
 
 
-def fetch_per_page(api_url, chunk_size=100, filter_func=None, ignore_errors=False):
+def fetch_page(rest_url, ignore_errors=False):
+    """
+    Fetch a single page of a paginated REST URL
+    Returns a tuple of the list of entries and the Response object
+    whose headers carry the pagination info
+    """
+    result = []
+    response = None
+
+    try:
+        (result, response) = __get_json(rest_url)
+    except AttributeError:
+        pass
+    except (TypeError, ValueError) as e:
+        if not ignore_errors:
+            raise WebError(rest_url, {}, "GET", "Call to url %s failed: %s\n" % (rest_url, str(e)))
+
+    if not type(result) == list:
+        result = []
+
+    return (result, response)
+
+
+def iter_json_array(response, chunk_size=65536):
+    """
+    Incrementally parse a JSON array from a streamed response
+    and yield its elements one by one, so only one element and one
+    chunk of the body have to be kept in memory at a time
+    Yields nothing if the body is no JSON array (e.g. an error message)
+    Raises ValueError on broken JSON
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = response.iter_content(chunk_size)
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+
+    while 1:
+        # skip whitespace and separators between elements
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    return
+
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            # an element is complete if something follows it in the buffer
+            # (a number at the end of the buffer could be cut)
+            try:
+                (element, end) = decoder.raw_decode(buffer, pos)
+
+                if end < len(buffer) or eof:
+                    yield element
+                    pos = end
+                    continue
+            except ValueError:
+                if eof:
+                    raise
+
+        if eof:
+            if started:
+                raise ValueError("Unexpected end of JSON array")
+            return
+
+        # need more data: drop what we already parsed and read chunks until
+        # the unparsed rest has doubled, so an element spread over many
+        # chunks is decoded a logarithmic instead of a linear number of times
+        buffer = buffer[pos:]
+        pos = 0
+        pieces = [buffer]
+        size = len(buffer)
+        wanted = max(2 * size, 1)
+
+        while size < wanted:
+            chunk = next(chunks, None)
+
+            if chunk is None:
+                pieces.append(utf8.decode(b"", final=True))
+                eof = True
+                break
+
+            pieces.append(utf8.decode(chunk))
+            size += len(pieces[-1])
+
+        buffer = "".join(pieces)
+
+
+def __fetch_items_streaming(api_url, chunk_size, ignore_errors):
+    """
+    Helper function - Fetch page after page and decode the entries of each
+    page while they arrive (see iter_json_array)
+    """
+    page = 1
+
+    while 1:
+        rest_url = api_url % (chunk_size, page)
+        response = rest_api_call(rest_url, method="GET", stream=True)
+        nr_of_items = 0
+
+        if response is None:
+            return
+
+        try:
+            for item in iter_json_array(response):
+                nr_of_items += 1
+                yield item
+        except ValueError as e:
+            if not ignore_errors:
+                raise WebError(rest_url, {}, "GET", "Call to url %s failed: %s\n" % (rest_url, str(e)))
+        finally:
+            response.close()
+
+        total_pages = __total_pages(response)
+
+        if nr_of_items == 0 or \
+           (total_pages is not None and page >= total_pages) or \
+           (response.links and not response.links.get("next")):
+            return
+
+        page += 1
+
+
+def __total_pages(response):
+    """
+    Helper function - Read number of pages from the X-Total-Pages header
+    Returns None if Gitlab didnt send it (it omits it for huge collections)
+    """
+    try:
+        return int(response.headers.get("X-Total-Pages"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def __fetch_pages_sequential(api_url, chunk_size, ignore_errors, page=1):
+    """
+    Helper function - Fetch page after page until an empty one is returned
+    """
+    while 1:
+        buffer = fetch(api_url % (chunk_size, page), ignore_errors)
+
+        if buffer:
+            page += 1
+            yield buffer
+        else:
+            return
+
+
+def __fetch_announced_page(rest_url, ignore_errors):
+    """
+    Helper function - Fetch a page the pagination headers of the first page
+    announced, a failing one raises WebError instead of truncating the result
+    """
+    (buffer, response) = fetch_page(rest_url, ignore_errors)
+
+    if not ignore_errors and (response is None or response.status_code >= 400):
+        raise WebError(rest_url, {}, "GET", "Announced page %s failed with status %s" %
+                       (rest_url, response.status_code if response is not None else "none"))
+
+    return (buffer, response)
+
+
+def __fetch_pages_parallel(api_url, chunk_size, ignore_errors, prefetch):
+    """
+    Helper function - Fetch the first page, read the pagination headers and
+    fetch the remaining pages with at most prefetch requests in flight
+    Pages are yielded in order
+    """
+    (buffer, response) = fetch_page(api_url % (chunk_size, 1), ignore_errors)
+
+    if not buffer:
+        return
+
+    yield buffer
+
+    total_pages = __total_pages(response)
+
+    # no page count but a Link header: follow rel=next one by one
+    if total_pages is None and response.links:
+        next_url = response.links.get("next", {}).get("url")
+
+        while next_url:
+            (buffer, response) = __fetch_announced_page(next_url, ignore_errors)
+
+            if not buffer:
+                return
+
+            yield buffer
+            next_url = response.links.get("next", {}).get("url")
+
+    # no pagination headers at all: fall back to the old behaviour
+    elif total_pages is None:
+        yield from __fetch_pages_sequential(api_url, chunk_size, ignore_errors, page=2)
+
+    # a single request in flight gains nothing from a thread of its own
+    elif prefetch <= 1:
+        for page in range(2, total_pages + 1):
+            (buffer, response) = __fetch_announced_page(api_url % (chunk_size, page), ignore_errors)
+
+            if buffer:
+                yield buffer
+
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque()
+        next_page = 2
+
+        try:
+            while next_page <= total_pages or pending:
+                while next_page <= total_pages and len(pending) < prefetch:
+                    pending.append(executor.submit(__fetch_announced_page, api_url % (chunk_size, next_page), ignore_errors))
+                    next_page += 1
+
+                (buffer, response) = pending.popleft().result()
+
+                if buffer:
+                    yield buffer
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_per_page(api_url, chunk_size=100, filter_func=None, ignore_errors=False, prefetch=0, stream=False):
     """
     Fetch data from an api url until it returns empty list
     api_url must have placeholder per_page=%d&page=%d
     chunk_size defines number of per page
     filter_func can be used to filter the result
+    prefetch > 0 uses the X-Total-Pages / Link headers of the first page
+    to fetch the remaining pages concurrently with prefetch requests in flight
+    and to avoid requesting a trailing empty page. Entries are still yielded
+    in page order and a failing page raises WebError unless ignore_errors is set.
+    Keep prefetch below API_POOL_MAXSIZE.
+    stream=True decodes the entries while the page is downloaded so memory
+    is bound by the size of a single entry instead of a whole page.
+    It bypasses the response cache and cannot be combined with prefetch.
     """
-    page = 1
-
     if "?" in api_url:
         api_url += "&per_page=%d&page=%d"
     else:
         api_url += "?per_page=%d&page=%d"
 
-    while 1:
-        buffer = fetch(api_url % (chunk_size, page), ignore_errors)
+    if stream:
+        for chunk in __fetch_items_streaming(api_url, chunk_size, ignore_errors):
+            if not filter_func or filter_func(chunk):
+                yield chunk
 
-        if buffer:
-            if filter_func:
-                buffer = filter(filter_func, buffer)
+        return
 
-            page += 1
+    if prefetch > 0:
+        pages = __fetch_pages_parallel(api_url, chunk_size, ignore_errors, prefetch)
+    else:
+        pages = __fetch_pages_sequential(api_url, chunk_size, ignore_errors)
 
-            for chunk in buffer:
-                yield chunk
-        else:
+    for buffer in pages:
+        if filter_func:
+            buffer = filter(filter_func, buffer)
+
+        for chunk in buffer:
+            yield chunk
+
+
+def fetch_per_keyset(api_url, chunk_size=100, filter_func=None, ignore_errors=False, order_by="id", sort="asc"):
+    """
+    Fetch data from an api url with keyset pagination
+    Every page is requested relative to the last entry of the previous one
+    by following the Link rel=next header, so deep pages are as fast as the
+    first one and entries cannot move between pages while we scan.
+    If Gitlab never sends a Link header but a full page we continue with
+    id_after (id_before for descending order) of the last entry ourselves.
+    chunk_size defines number of per page
+    filter_func can be used to filter the result
+    """
+    if "?" in api_url:
+        api_url += "&"
+    else:
+        api_url += "?"
+
+    api_url += "pagination=keyset&per_page=%d&order_by=%s&sort=%s" % (chunk_size, order_by, sort)
+    next_url = api_url
+    linked = False
+
+    while next_url:
+        (buffer, response) = fetch_page(next_url, ignore_errors)
+
+        if not buffer:
             return
 
+        # the last page of a server sending Link headers has no rel=next
+        if response.links or linked:
+            linked = True
+            next_url = response.links.get("next", {}).get("url")
+        elif len(buffer) >= chunk_size and order_by == "id":
+            next_url = "%s&%s=%d" % (api_url, "id_before" if sort == "desc" else "id_after", buffer[-1]["id"])
+        else:
+            next_url = None
+
+        if filter_func:
+            buffer = filter(filter_func, buffer)
+
+        for chunk in buffer:
+            yield chunk
+
+
+def attachment_executor():
+    """
+    Returns the thread pool of the current process running the calls of
+    fetch_concurrently with ATTACHMENT_CONCURRENCY threads
+    All calls share it, so a process never has more than ATTACHMENT_CONCURRENCY
+    of them in flight however many threads call fetch_concurrently
+    A forked process (see create_process) gets a pool of its own
+    """
+    global __executor, __executor_pid, __executor_size
+
+    with __executor_lock:
+        if __executor is None or __executor_pid != os.getpid() or __executor_size != ATTACHMENT_CONCURRENCY:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # Never shut down a pool inherited by fork or still used by
+            # another generator. Its idle threads exit once it is forgotten.
+            __executor = ThreadPoolExecutor(max_workers=ATTACHMENT_CONCURRENCY,
+                                            thread_name_prefix="attachment",
+                                            initializer=__mark_attachment_thread)
+            __executor_pid = os.getpid()
+            __executor_size = ATTACHMENT_CONCURRENCY
+
+        return __executor
+
+
+def __mark_attachment_thread():
+    """
+    Helper function - Remember that the current thread belongs to the attachment pool
+    """
+    __executor_thread.active = True
+
+
+def fetch_concurrently(calls, concurrency=None):
+    """
+    Run calls, tuples of a function and its arguments, in the attachment
+    pool of the process with at most concurrency (default and upper bound
+    ATTACHMENT_CONCURRENCY) queued by this call
+    Yields the results in the order of calls, so output stays deterministic
+    Calls made from a thread of the pool run one after the other, waiting
+    for the pool from inside it could deadlock
+    Keep ATTACHMENT_CONCURRENCY below API_POOL_MAXSIZE
+    """
+    concurrency = min(concurrency or ATTACHMENT_CONCURRENCY, ATTACHMENT_CONCURRENCY)
+
+    if concurrency <= 1 or getattr(__executor_thread, "active", False):
+        for call in calls:
+            yield call[0](*call[1:])
+
+        return
+
+    executor = attachment_executor()
+    pending = deque()
+
+    # queue a few more calls than threads, so a slow one does not stall the others
+    try:
+        for call in calls:
+            pending.append(executor.submit(*call))
+
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the pool is shared, only drop the calls of this generator
+        for future in pending:
+            future.cancel()
+
 
 def post(rest_url, post_data={}, ignore_errors=False):
     """
@@ -271,6 +888,8 @@ def create_process(func, args):
     """
     Create and start a new subprocess
     """
+    from multiprocessing import Process
+
     p = Process(target=func, args=args)
     p.daemon = True
     p.start()
@@ -278,6 +897,90 @@ def create_process(func, args):
     return p
 
 
+def make_spool_dir(spool_dir=None, prefix="gitlab_"):
+    """
+    Create the directory all processes spool their data to
+    (default a new temp dir starting with prefix)
+    Call it before forking, so the children know it too
+    Returns its path
+    """
+    if not spool_dir:
+        import tempfile
+
+        spool_dir = tempfile.mkdtemp(prefix=prefix)
+
+    os.makedirs(spool_dir, exist_ok=True)
+
+    return spool_dir
+
+
+def spool_file(spool_dir, prefix, suffix):
+    """
+    Returns the spool file of the current process named prefix_<pid>suffix
+    """
+    return os.path.join(spool_dir, "%s_%d%s" % (prefix, os.getpid(), suffix))
+
+
+def spool_files(spool_dir, prefix, suffix):
+    """
+    Returns the spool files of all processes in pid order
+    """
+    pattern = re.compile(r"^%s_(\d+)%s$" % (re.escape(prefix), re.escape(suffix)))
+    files = []
+
+    for filename in os.listdir(spool_dir):
+        match = pattern.match(filename)
+
+        if match:
+            files.append((int(match.group(1)), os.path.join(spool_dir, filename)))
+
+    return [x[1] for x in sorted(files)]
+
+
+@contextmanager
+def file_lock(lock_file, blocking=True):
+    """
+    Exclusively lock lock_file across processes in the with block
+    Yields False if blocking is False and another process holds the lock
+    """
+    with open(lock_file, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def link_tree(src_dir, dest_dir):
+    """
+    Copy src_dir to dest_dir by hardlinking all files
+    Falls back to copying if src_dir and dest_dir are on different filesystems
+    """
+    try:
+        shutil.copytree(src_dir, dest_dir, copy_function=os.link)
+    except (OSError, shutil.Error) as e:
+        debug("Cannot hardlink %s: %s, copying it", src_dir, str(e))
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        shutil.copytree(src_dir, dest_dir)
+
+
+def break_link(filename):
+    """
+    Remove filename before it gets rewritten in place
+    A file hardlinked by link_tree would otherwise change in the backup
+    directory it was linked from too
+    """
+    try:
+        os.unlink(filename)
+    except FileNotFoundError:
+        pass
+
+
 def parse_json(json_file):
     """
     Parse a JSON file
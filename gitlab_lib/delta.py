@@ -0,0 +1,145 @@
+#
+# Central lib for Gitlab Tools - Delta sync of issues and merge requests
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# A changed project of an incremental run usually changed in a few issues
+# only. Instead of fetching all issues and all their notes again, sync()
+# fetches the entries updated after the previous run and merges them into
+# the issues or merge_requests dump of the previous backup directory
+# while streaming it into the new one (see ndjson.py).
+# Notes and closing merge requests are only fetched for updated issues,
+# carry_dumps() keeps the dumps of all other issues.
+#
+# Deleted entries are not part of an updated_after listing. If the
+# X-Total header of a one entry page does not match the merged list,
+# the ids of all entries are listed via GraphQL (PAGE_SIZE ids per query)
+# and the deleted ones are dropped.
+#
+# incremental.prepare_delta() tells backup_issues() and
+# backup_merge_requests() where the previous backup is.
+#
+
+#
+# Loading modules
+#
+
+import os
+import re
+import shutil
+from .core import *
+from . import graphql
+from . import ndjson
+
+
+#
+# Configuration
+#
+
+DUMP_PATTERN = r"^%s_(\d+)_"
+
+
+#
+# Subroutines
+#
+
+def merge(previous, updated, previous_ids, current_ids=None):
+    """
+    Generator for the entries of previous replaced by their updated version
+    Updated entries not in previous_ids come first, they are the newest
+    current_ids drops all entries whose id is not in it
+    """
+    updated_by_id = dict((x['id'], x) for x in updated)
+    new = sorted([x for x in updated if x['id'] not in previous_ids], key=lambda x: x['id'], reverse=True)
+
+    for entry in new:
+        if current_ids is None or entry['id'] in current_ids:
+            yield entry
+
+    for entry in previous:
+        entry = updated_by_id.get(entry['id'], entry)
+
+        if current_ids is None or entry['id'] in current_ids:
+            yield entry
+
+
+def count(api_url):
+    """
+    Returns the number of entries of api_url according to its X-Total header
+    or None if Gitlab didnt send it (it omits it for huge collections)
+    """
+    (result, response) = fetch_page(api_url + ("&" if "?" in api_url else "?") + "per_page=1")
+
+    try:
+        return int(response.headers.get("X-Total"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def sync(project, component, api_url, previous_dir, since):
+    """
+    Merge the issues or merge_requests updated after since into their
+    dump in previous_dir
+    Returns a tuple of a generator of all current entries and the list
+    of updated ones or None if there is no previous dump
+    """
+    if not ndjson.exists(previous_dir, component):
+        return None
+
+    updated = list(fetch_per_page(api_url + ("&" if "?" in api_url else "?") + "updated_after=" + since, prefetch=1))
+    previous_ids = set([x['id'] for x in ndjson.iter_dump(previous_dir, component)])
+    known_ids = previous_ids | set([x['id'] for x in updated])
+    current_ids = None
+    total = count(api_url)
+
+    if total != len(known_ids):
+        debug("%s of project %s: %s on server, %d known, listing ids", component, project['id'], total, len(known_ids))
+        current_ids = graphql.get_ids(project, component)
+
+    log(u"Delta sync of %s from project %s [ID %s]: %d updated, %d deleted since %s" %
+        (component, project['name'], project['id'], len(updated), len(known_ids - current_ids) if current_ids is not None else 0, since))
+
+    return (merge(ndjson.iter_dump(previous_dir, component), updated, previous_ids, current_ids), updated)
+
+
+def carry_dumps(previous_dir, output_basedir, prefix, keep_ids):
+    """
+    Make the dumps prefix_<id>_* of all ids in keep_ids part of output_basedir
+    Hardlinks them if output_basedir is a new directory, otherwise removes
+    the dumps of all other ids, they are outdated or deleted
+    """
+    same_dir = os.path.realpath(previous_dir) == os.path.realpath(output_basedir)
+    pattern = re.compile(DUMP_PATTERN % (prefix,))
+
+    for filename in os.listdir(previous_dir):
+        match = pattern.match(filename)
+
+        if not match:
+            continue
+
+        if same_dir:
+            if int(match.group(1)) not in keep_ids:
+                os.unlink(os.path.join(previous_dir, filename))
+        elif int(match.group(1)) in keep_ids:
+            try:
+                os.link(os.path.join(previous_dir, filename), os.path.join(output_basedir, filename))
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copy2(os.path.join(previous_dir, filename), os.path.join(output_basedir, filename))
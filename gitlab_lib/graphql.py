@@ -0,0 +1,453 @@
+#
+# Central lib for Gitlab Tools - GraphQL metadata backend
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Fetch issues with their notes, merge requests, milestones and labels
+# of a project with a few paginated GraphQL queries instead of one REST
+# call per issue and attachment
+#
+# All results are converted to the REST representation, so backup.py
+# writes the same files restore.py consumes no matter which backend was used
+#
+
+#
+# Loading modules
+#
+
+import re
+import json
+from .core import *
+from .api import *
+from .exception import APIError
+
+
+#
+# Configuration
+#
+
+# max page size of a GraphQL connection
+PAGE_SIZE = 100
+
+# page size of the notes nested in each issue of a page of issues, issues
+# with more notes get them from extra ISSUE_NOTES_QUERY queries
+NESTED_PAGE_SIZE = 20
+
+# Gitlab refuses queries above its max complexity (default 250) and nested
+# connections multiply it. fetch_connection() halves the page size until
+# the query is accepted and starts with that size for the next project
+COMPLEXITY_ERROR = re.compile(r"complexity of \d+, which exceeds max complexity", re.IGNORECASE)
+
+__page_sizes = {}
+
+# components fetched via GraphQL, all others are still fetched via REST
+COMPONENTS = ("issues", "merge_requests", "milestones", "labels")
+
+USER_FIELDS = "id username name state avatarUrl webUrl"
+
+PAGE_INFO = "pageInfo { hasNextPage endCursor }"
+
+NOTE_FIELDS = "id body system internal createdAt updatedAt author { %s }" % (USER_FIELDS,)
+
+ISSUES_QUERY = """
+query ProjectIssues($fullPath: ID!, $first: Int!, $after: String, $notesFirst: Int!) {
+  project(fullPath: $fullPath) {
+    issues(first: $first, after: $after, sort: CREATED_ASC) {
+      %s
+      nodes {
+        id iid title description state confidential discussionLocked
+        createdAt updatedAt closedAt dueDate webUrl weight
+        userNotesCount upvotes downvotes
+        author { %s }
+        assignees { nodes { %s } }
+        milestone { id iid title }
+        labels { nodes { title } }
+        notes(first: $notesFirst) { %s nodes { %s } }
+      }
+    }
+  }
+}
+""" % (PAGE_INFO, USER_FIELDS, USER_FIELDS, PAGE_INFO, NOTE_FIELDS)
+
+ISSUE_NOTES_QUERY = """
+query IssueNotes($fullPath: ID!, $iid: String!, $first: Int!, $after: String) {
+  project(fullPath: $fullPath) {
+    issue(iid: $iid) {
+      notes(first: $first, after: $after) { %s nodes { %s } }
+    }
+  }
+}
+""" % (PAGE_INFO, NOTE_FIELDS)
+
+MERGE_REQUESTS_QUERY = """
+query ProjectMergeRequests($fullPath: ID!, $first: Int!, $after: String) {
+  project(fullPath: $fullPath) {
+    mergeRequests(first: $first, after: $after, sort: CREATED_ASC) {
+      %s
+      nodes {
+        id iid title description state draft discussionLocked
+        createdAt updatedAt mergedAt closedAt webUrl
+        sourceBranch targetBranch sourceProjectId targetProjectId
+        shouldRemoveSourceBranch squash mergeWhenPipelineSucceeds
+        userNotesCount upvotes downvotes
+        author { %s }
+        assignees { nodes { %s } }
+        milestone { id iid title }
+        labels { nodes { title } }
+      }
+    }
+  }
+}
+""" % (PAGE_INFO, USER_FIELDS, USER_FIELDS)
+
+MILESTONES_QUERY = """
+query ProjectMilestones($fullPath: ID!, $first: Int!, $after: String) {
+  project(fullPath: $fullPath) {
+    milestones(first: $first, after: $after, includeAncestors: false) {
+      %s
+      nodes { id iid title description state dueDate startDate createdAt updatedAt webPath }
+    }
+  }
+}
+""" % (PAGE_INFO,)
+
+LABELS_QUERY = """
+query ProjectLabels($fullPath: ID!, $first: Int!, $after: String) {
+  project(fullPath: $fullPath) {
+    labels(first: $first, after: $after, includeAncestorGroups: false) {
+      %s
+      nodes { id title description color textColor }
+    }
+  }
+}
+""" % (PAGE_INFO,)
+
+# ids of all issues or merge requests to detect deleted ones
+ID_QUERIES = {"issues": ("ProjectIssueIds", "issues"),
+              "merge_requests": ("ProjectMergeRequestIds", "mergeRequests")}
+
+ID_QUERY = """
+query %s($fullPath: ID!, $first: Int!, $after: String) {
+  project(fullPath: $fullPath) {
+    %s(first: $first, after: $after) { %s nodes { id } }
+  }
+}
+"""
+
+
+#
+# Subroutines
+#
+
+def __format_error(graphql_error):
+    """
+    Helper function - Message of a GraphQL error with the path of the failing field
+    """
+    message = graphql_error.get("message", str(graphql_error))
+
+    if graphql_error.get("path"):
+        message += " at " + ".".join([str(x) for x in graphql_error["path"]])
+
+    return message
+
+
+def query(graphql_query, variables={}):
+    """
+    POST a GraphQL query with global private token
+    Queries do not change anything, so they are retried like a GET
+    Returns the data dictionary of the response
+    """
+    response = rest_api_call(GRAPHQL_URL,
+                             data=json.dumps({"query": graphql_query, "variables": variables}),
+                             method="POST",
+                             headers={"Content-Type": "application/json"},
+                             retries=RETRY_BUDGET["GET"])
+
+    if response is None:
+        raise WebError(GRAPHQL_URL, variables, "POST", "No response for GraphQL query")
+
+    try:
+        result = response.json()
+    except ValueError as e:
+        raise WebError(GRAPHQL_URL, variables, "POST", "Cannot parse GraphQL response: %s" % (str(e),))
+
+    if result.get("errors"):
+        raise APIError(GRAPHQL_URL, "; ".join([__format_error(x) for x in result["errors"]]))
+
+    return result.get("data") or {}
+
+
+def __get_path(data, path):
+    """
+    Helper function - Walk down the given list of keys
+    """
+    for key in path:
+        if not data:
+            return None
+
+        data = data.get(key)
+
+    return data
+
+
+def fetch_connection(graphql_query, variables, path):
+    """
+    Generator for the nodes of a paginated connection
+    path is the list of keys leading to the connection in the result
+    """
+    variables = dict(variables, first=__page_sizes.get(graphql_query, PAGE_SIZE), after=None)
+
+    while 1:
+        try:
+            connection = __get_path(query(graphql_query, variables), path)
+        except APIError as e:
+            if not COMPLEXITY_ERROR.search(e.message) or variables["first"] == 1:
+                raise
+
+            variables["first"] = __page_sizes[graphql_query] = variables["first"] // 2
+            debug("Query %s too complex, retrying with %d nodes per page: %s", ".".join(path), variables["first"], e.message)
+            continue
+
+        if not connection:
+            return
+
+        for node in connection.get("nodes") or []:
+            yield node
+
+        page_info = connection.get("pageInfo") or {}
+
+        if not page_info.get("hasNextPage"):
+            return
+
+        variables["after"] = page_info.get("endCursor")
+
+
+def global_id_to_id(global_id):
+    """
+    Convert a GraphQL global id like gid://gitlab/Issue/23 to the numeric REST id
+
+    >>> global_id_to_id("gid://gitlab/Issue/23")
+    23
+    """
+    if global_id is None:
+        return None
+
+    return int(str(global_id).rsplit("/", 1)[-1])
+
+
+def __to_int(value):
+    return int(value) if value is not None else None
+
+
+def __user(node):
+    """
+    Helper function - Convert a GraphQL user to its REST representation
+    """
+    if not node:
+        return None
+
+    return {"id": global_id_to_id(node["id"]),
+            "username": node.get("username"),
+            "name": node.get("name"),
+            "state": node.get("state"),
+            "avatar_url": node.get("avatarUrl"),
+            "web_url": node.get("webUrl")}
+
+
+def __milestone_ref(node):
+    """
+    Helper function - Milestone as referenced by issues and merge requests
+    """
+    if not node:
+        return None
+
+    return {"id": global_id_to_id(node["id"]),
+            "iid": __to_int(node.get("iid")),
+            "title": node.get("title")}
+
+
+def __nodes(connection):
+    return (connection or {}).get("nodes") or []
+
+
+def note_to_rest(node, noteable_type, noteable):
+    """
+    Convert a GraphQL note to its REST representation
+    """
+    return {"id": global_id_to_id(node["id"]),
+            "body": node.get("body"),
+            "author": __user(node.get("author")),
+            "created_at": node.get("createdAt"),
+            "updated_at": node.get("updatedAt"),
+            "system": node.get("system"),
+            "confidential": node.get("internal"),
+            "noteable_id": noteable["id"],
+            "noteable_iid": noteable["iid"],
+            "noteable_type": noteable_type}
+
+
+def issue_to_rest(node, project_id):
+    """
+    Convert a GraphQL issue to its REST representation
+    """
+    assignees = [__user(x) for x in __nodes(node.get("assignees"))]
+
+    return {"id": global_id_to_id(node["id"]),
+            "iid": __to_int(node.get("iid")),
+            "project_id": project_id,
+            "title": node.get("title"),
+            "description": node.get("description"),
+            "state": node.get("state"),
+            "created_at": node.get("createdAt"),
+            "updated_at": node.get("updatedAt"),
+            "closed_at": node.get("closedAt"),
+            "labels": [x["title"] for x in __nodes(node.get("labels"))],
+            "milestone": __milestone_ref(node.get("milestone")),
+            "assignees": assignees,
+            "assignee": assignees[0] if assignees else None,
+            "author": __user(node.get("author")),
+            "user_notes_count": node.get("userNotesCount"),
+            "upvotes": node.get("upvotes"),
+            "downvotes": node.get("downvotes"),
+            "due_date": node.get("dueDate"),
+            "confidential": node.get("confidential"),
+            "discussion_locked": node.get("discussionLocked"),
+            "web_url": node.get("webUrl"),
+            "weight": node.get("weight")}
+
+
+def merge_request_to_rest(node, project_id):
+    """
+    Convert a GraphQL merge request to its REST representation
+    """
+    assignees = [__user(x) for x in __nodes(node.get("assignees"))]
+
+    return {"id": global_id_to_id(node["id"]),
+            "iid": __to_int(node.get("iid")),
+            "project_id": project_id,
+            "title": node.get("title"),
+            "description": node.get("description"),
+            "state": node.get("state"),
+            "created_at": node.get("createdAt"),
+            "updated_at": node.get("updatedAt"),
+            "merged_at": node.get("mergedAt"),
+            "closed_at": node.get("closedAt"),
+            "target_branch": node.get("targetBranch"),
+            "source_branch": node.get("sourceBranch"),
+            "source_project_id": node.get("sourceProjectId"),
+            "target_project_id": node.get("targetProjectId"),
+            "labels": [x["title"] for x in __nodes(node.get("labels"))],
+            "milestone": __milestone_ref(node.get("milestone")),
+            "assignees": assignees,
+            "assignee": assignees[0] if assignees else None,
+            "author": __user(node.get("author")),
+            "user_notes_count": node.get("userNotesCount"),
+            "upvotes": node.get("upvotes"),
+            "downvotes": node.get("downvotes"),
+            "work_in_progress": node.get("draft"),
+            "draft": node.get("draft"),
+            "merge_when_pipeline_succeeds": node.get("mergeWhenPipelineSucceeds"),
+            "should_remove_source_branch": node.get("shouldRemoveSourceBranch"),
+            "squash": node.get("squash"),
+            "discussion_locked": node.get("discussionLocked"),
+            "web_url": node.get("webUrl")}
+
+
+def milestone_to_rest(node, project_id):
+    """
+    Convert a GraphQL milestone to its REST representation
+    """
+    return {"id": global_id_to_id(node["id"]),
+            "iid": __to_int(node.get("iid")),
+            "project_id": project_id,
+            "title": node.get("title"),
+            "description": node.get("description"),
+            "state": node.get("state"),
+            "due_date": node.get("dueDate"),
+            "start_date": node.get("startDate"),
+            "created_at": node.get("createdAt"),
+            "updated_at": node.get("updatedAt"),
+            "web_url": node.get("webPath")}
+
+
+def label_to_rest(node, project_id):
+    """
+    Convert a GraphQL label to its REST representation
+    """
+    return {"id": global_id_to_id(node["id"]),
+            "name": node.get("title"),
+            "description": node.get("description"),
+            "color": node.get("color"),
+            "text_color": node.get("textColor")}
+
+
+def get_issues(project):
+    """
+    Generator for tuples (issue, notes) of all issues of a project
+    Notes of issues with more than PAGE_SIZE notes are fetched by extra queries
+    """
+    variables = {"fullPath": project["path_with_namespace"]}
+
+    for node in fetch_connection(ISSUES_QUERY, dict(variables, notesFirst=NESTED_PAGE_SIZE), ["project", "issues"]):
+        issue = issue_to_rest(node, project["id"])
+        note_nodes = __nodes(node.get("notes"))
+
+        if ((node.get("notes") or {}).get("pageInfo") or {}).get("hasNextPage"):
+            note_nodes = list(fetch_connection(ISSUE_NOTES_QUERY,
+                                               dict(variables, iid=str(issue["iid"])),
+                                               ["project", "issue", "notes"]))
+
+        yield (issue, [note_to_rest(x, "Issue", issue) for x in note_nodes])
+
+
+def get_merge_requests(project):
+    """
+    Generator for all merge requests of a project
+    """
+    for node in fetch_connection(MERGE_REQUESTS_QUERY, {"fullPath": project["path_with_namespace"]}, ["project", "mergeRequests"]):
+        yield merge_request_to_rest(node, project["id"])
+
+
+def get_milestones(project):
+    """
+    Returns a list of all milestones of a project
+    """
+    return [milestone_to_rest(x, project["id"]) for x in fetch_connection(MILESTONES_QUERY,
+                                                                           {"fullPath": project["path_with_namespace"]},
+                                                                           ["project", "milestones"])]
+
+
+def get_labels(project):
+    """
+    Returns a list of all labels of a project
+    """
+    return [label_to_rest(x, project["id"]) for x in fetch_connection(LABELS_QUERY,
+                                                                       {"fullPath": project["path_with_namespace"]},
+                                                                       ["project", "labels"])]
+
+
+def get_ids(project, component):
+    """
+    Returns the set of REST ids of all issues or merge_requests of a project
+    """
+    (operation, connection) = ID_QUERIES[component]
+
+    return set([global_id_to_id(x["id"]) for x in fetch_connection(ID_QUERY % (operation, connection, PAGE_INFO),
+                                                                    {"fullPath": project["path_with_namespace"]},
+                                                                    ["project", connection])])
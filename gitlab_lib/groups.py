@@ -25,12 +25,23 @@
 from .core import *
 from .api import *
 from . import permissions
+from .memo import memoize
+from .namespaces import get_namespaces
 
 
 #
 # SUBROUTINES
 #
 
+def __invalidate_group_lookups():
+    """
+    Helper function - Forget memoized groups and namespaces (every group is one)
+    """
+    get_group.clear()
+    convert_group_to_id.clear()
+    get_namespaces.clear()
+
+
 def create_group(groupname=None, owner=None, comment=None, end_date=None, visibility_level="private"):
     """
     Create a new group with given owner
@@ -50,6 +61,7 @@ def create_group(groupname=None, owner=None, comment=None, end_date=None, visibi
                                              "description": description,
                                              "visibility_level": visibility_level,
                                              "lfs_enabled": 1})
+    __invalidate_group_lookups()
 
     if group and owner:
         user = fetch(USER_BY_USERNAME % (API_BASE_URL, owner))[0]
@@ -69,7 +81,10 @@ def delete_group(group):
         group = get_group(group)
 
     if group:
-        return delete(DELETE_GROUP % (API_BASE_URL, group["id"]))
+        result = delete(DELETE_GROUP % (API_BASE_URL, group["id"]))
+        __invalidate_group_lookups()
+
+        return result
 
 
 def add_group_member(group, user, access_level=permissions.ACCESS_LEVEL_GUEST):
@@ -99,10 +114,12 @@ def edit_group_member(group, user, access_level):
                                                                        "access_level": access_level})
 
 
+@memoize()
 def get_group(group=None):
     """
     Get metadata of a single group
     Parameter group can be name or id
+    Results are memoized (see memo.py)
     """
 
     try:
@@ -127,22 +144,25 @@ def get_group_projects(group):
         yield project
 
 
-def get_group_members(group):
+def get_group_members(group, prefetch=0):
     """
     Get members of group
     Group can be either name or id
+    prefetch > 0 fetches that many pages concurrently (see fetch_per_page)
     """
 
     api_url = GROUP_MEMBERS % (API_BASE_URL, convert_group_to_id(group))
 
-    for member in fetch_per_page(api_url):
+    for member in fetch_per_page(api_url, prefetch=prefetch):
         yield member
 
 
+@memoize()
 def convert_group_to_id(group):
     """
     Try to use group as id (int)
     Otherwise fetch group by name
+    Results are memoized (see memo.py)
     """
     try:
         group_id = int(group)
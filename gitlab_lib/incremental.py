@@ -0,0 +1,260 @@
+#
+# Central lib for Gitlab Tools - Incremental backups
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Every backup run writes a manifest.json into its backup directory
+# with the start time of the run and per project its last_activity_at,
+# a fingerprint of its refs, its backup directory and files.
+#
+# An incremental run reads the manifest of a previous run and only backs up
+#  - projects the server lists with last_activity_after the previous run
+#  - projects whose refs changed on disk (Gitlab updates last_activity_at
+#    at most once an hour, a push can hide behind that)
+#  - projects that failed or whose backup directory vanished
+# Backup directories of all other projects are kept (same backup directory)
+# or hardlinked from the previous run (new backup directory).
+#
+# Projects deleted in Gitlab are carried over by incremental runs until
+# the next full run, which always starts a fresh manifest.
+#
+# prepare_delta() lets a changed project fetch only the issues and merge
+# requests updated since the previous run (see delta.py).
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+import shutil
+import hashlib
+import datetime
+from .core import *
+from .projects import get_projects, get_project
+from .backup import find_repository, project_dir_name
+from .exception import WebError
+
+
+#
+# Configuration
+#
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Gitlab updates last_activity_at at most once per hour
+LAST_ACTIVITY_SLACK = 3600
+
+# updated_at of issues is exact, only the clocks may differ
+DELTA_SLACK = 300
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+#
+# Subroutines
+#
+
+def utc_timestamp(ts=None):
+    """
+    Returns the given datetime or now as ISO 8601 UTC timestamp
+    """
+    return (ts or datetime.datetime.utcnow()).strftime(TIMESTAMP_FORMAT)
+
+
+def new_manifest(full=True):
+    """
+    Returns an empty manifest for a run starting now
+    """
+    return {"version": MANIFEST_VERSION,
+            "started_at": utc_timestamp(),
+            "full": full,
+            "projects": {}}
+
+
+def load_manifest(backup_dir):
+    """
+    Returns the manifest of the run that wrote backup_dir or None
+    """
+    manifest_file = os.path.join(backup_dir, MANIFEST_FILE)
+
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        debug("Cannot read manifest %s: %s", manifest_file, str(e))
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        log("Ignoring manifest %s of version %s" % (manifest_file, manifest.get("version")))
+        return None
+
+    return manifest
+
+
+def write_manifest(backup_dir, manifest):
+    """
+    Atomically replace the manifest in backup_dir
+    """
+    manifest_file = os.path.join(backup_dir, MANIFEST_FILE)
+
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def ref_fingerprint(repo_dir):
+    """
+    Returns a hash over HEAD, packed-refs and all loose refs of a bare repository
+    or None if there is none. Reads only the ref files, no git process needed.
+    """
+    if not repo_dir:
+        return None
+
+    digest = hashlib.sha1()
+
+    for name in ("HEAD", "packed-refs"):
+        try:
+            with open(os.path.join(repo_dir, name), "rb") as f:
+                digest.update(name.encode("utf8") + b"\0" + f.read())
+        except IOError:
+            pass
+
+    for (directory, subdirs, files) in os.walk(os.path.join(repo_dir, "refs")):
+        subdirs.sort()
+
+        for filename in sorted(files):
+            ref_file = os.path.join(directory, filename)
+
+            try:
+                with open(ref_file, "rb") as f:
+                    digest.update(os.path.relpath(ref_file, repo_dir).encode("utf8") + b"\0" + f.read())
+            except IOError:
+                pass
+
+    return digest.hexdigest()
+
+
+def make_entry(project, backup_dir, repository_dir=REPOSITORY_DIR):
+    """
+    Returns the manifest entry of a backed up project
+    """
+    project_dir = project_dir_name(project)
+    files = []
+
+    for (directory, subdirs, filenames) in os.walk(os.path.join(backup_dir, project_dir)):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(directory, filename), os.path.join(backup_dir, project_dir)))
+
+    return {"id": project['id'],
+            "namespace": project['namespace']['name'],
+            "name": project['name'],
+            "last_activity_at": project.get('last_activity_at'),
+            "refs": ref_fingerprint(find_repository(project, repository_dir)),
+            "dir": project_dir,
+            "files": sorted(files),
+            "seconds": project.get("seconds"),
+            "failed": bool(project.get("failed"))}
+
+
+def __repository_changed(entry, project_stub, repository_dir):
+    """
+    Helper function - Check if the refs of a project changed since its entry was made
+    """
+    if entry.get("refs") is None:
+        return False
+
+    return ref_fingerprint(find_repository(project_stub, repository_dir)) != entry["refs"]
+
+
+def __project_stub(entry):
+    """
+    Helper function - Enough of a project to find its repository without asking the API
+    """
+    return {"id": entry["id"], "namespace": {"name": entry["namespace"]}, "name": entry["name"]}
+
+
+def changed_projects(manifest, previous_dir, repository_dir=REPOSITORY_DIR, prefetch=0, statistics=False):
+    """
+    Compare the server and the repositories with the manifest of a previous run
+    Returns a tuple of the list of projects that must be backed up
+    and the list of manifest entries of all unchanged projects
+    statistics lists the projects with their statistics (see get_projects)
+    """
+    since = datetime.datetime.strptime(manifest["started_at"], TIMESTAMP_FORMAT) - datetime.timedelta(seconds=LAST_ACTIVITY_SLACK)
+    changed = dict((x['id'], x) for x in get_projects(prefetch=prefetch, last_activity_after=utc_timestamp(since), statistics=statistics))
+    unchanged = []
+
+    debug("%d projects active since %s", len(changed), utc_timestamp(since))
+
+    for entry in manifest["projects"].values():
+        if entry["id"] in changed:
+            continue
+
+        if entry.get("failed") or \
+           not os.path.isdir(os.path.join(previous_dir, entry["dir"])) or \
+           __repository_changed(entry, __project_stub(entry), repository_dir):
+            try:
+                project = get_project(entry["id"])
+            except WebError:
+                project = None
+
+            if project:
+                changed[project['id']] = project
+            else:
+                log("Project %s vanished, dropping it from the manifest" % (entry["id"],))
+        else:
+            unchanged.append(entry)
+
+    return (list(changed.values()), unchanged)
+
+
+def carry_over(entry, previous_dir, backup_dir):
+    """
+    Make the backup of an unchanged project of the previous run part of this run
+    Hardlinks its files if backup_dir is a new directory
+    """
+    src_dir = os.path.join(previous_dir, entry["dir"])
+    dest_dir = os.path.join(backup_dir, entry["dir"])
+
+    if os.path.realpath(src_dir) == os.path.realpath(dest_dir):
+        return
+
+    if os.path.exists(dest_dir):
+        shutil.rmtree(dest_dir)
+
+    link_tree(src_dir, dest_dir)
+
+
+def prepare_delta(project, manifest, previous_dir):
+    """
+    Let a changed project sync its issues and merge requests with its
+    backup of the previous run instead of fetching all of them
+    Projects that failed or are new in this run are backed up in full
+    """
+    entry = manifest["projects"].get(str(project['id']))
+
+    if not entry or entry.get("failed") or not os.path.isdir(os.path.join(previous_dir, entry["dir"])):
+        return
+
+    since = datetime.datetime.strptime(manifest["started_at"], TIMESTAMP_FORMAT) - datetime.timedelta(seconds=DELTA_SLACK)
+    project["delta"] = {"dir": os.path.join(previous_dir, entry["dir"]), "since": utc_timestamp(since)}
@@ -30,11 +30,13 @@ from .projects import get_project
 # SUBROUTINES
 #
 
-def get_jobs(project, filter_func=None):
+def get_jobs(project, filter_func=None, prefetch=0, pagination="offset"):
     """
     Get all jobs for specified project.
     Project can be project id or dict
     filter_func can be used to filter the result
+    prefetch > 0 fetches that many pages concurrently (see fetch_per_page)
+    Set pagination to keyset for projects with lots of jobs (see fetch_per_keyset)
     """
     chunk_size=100
 
@@ -43,7 +45,13 @@ def get_jobs(project, filter_func=None):
 
     api_url = GET_PROJECT_JOBS % (API_BASE_URL, project["id"])
 
-    for job in fetch_per_page(api_url, chunk_size, filter_func):
+    # Gitlab supports keyset pagination of jobs only in descending id order
+    if pagination == "keyset":
+        jobs = fetch_per_keyset(api_url, chunk_size, filter_func, sort="desc")
+    else:
+        jobs = fetch_per_page(api_url, chunk_size, filter_func, prefetch=prefetch)
+
+    for job in jobs:
         yield job
 
 
@@ -0,0 +1,255 @@
+#
+# Central lib for Gitlab Tools - Multi-process logging
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Queue based backend of core.log, core.error and core.debug
+#
+# Without a queue every record is formatted and written by the calling
+# process. After start() all processes forked afterwards only put the raw
+# record (timestamp, pid, level, project, stage, message, args) on a queue
+# and a single writer thread in the parent formats them and writes them
+# in batches to STDOUT and the error log, so lines of different worker
+# processes never interleave and workers never block on the terminal.
+#
+# Records carry the project and stage set by context() of the logging thread.
+#
+
+#
+# Loading modules
+#
+
+import os
+import sys
+import time
+import queue
+import datetime
+import threading
+from contextlib import contextmanager
+from gitlab_config import ERROR_LOG, LOG_ERRORS, LOG_TIMESTAMP
+
+
+#
+# Configuration
+#
+
+# max number of records the writer thread formats and writes at once
+BATCH_SIZE = 500
+
+__queue = None
+__writer = None
+__writer_pid = None
+__local = threading.local()
+
+
+#
+# Subroutines
+#
+
+def is_enabled():
+    return __queue is not None
+
+
+def get_context():
+    """
+    Returns a tuple (project, stage) of the logging context of this thread
+    """
+    return (getattr(__local, "project", None), getattr(__local, "stage", None))
+
+
+@contextmanager
+def context(project=None, stage=None):
+    """
+    Tag all records logged in the with block with project and / or stage
+    Unset fields are inherited from the enclosing context
+    """
+    old_context = get_context()
+    __local.project = project if project is not None else old_context[0]
+    __local.stage = stage if stage is not None else old_context[1]
+
+    try:
+        yield
+    finally:
+        (__local.project, __local.stage) = old_context
+
+
+def make_record(level, message, args, prefix=False):
+    """
+    Returns a record tuple (timestamp, pid, level, project, stage, message, args, prefix)
+    message is not formatted with args yet
+    """
+    return (time.time(), os.getpid(), level) + get_context() + (message, args, prefix)
+
+
+def format_message(record):
+    """
+    Returns the message of a record formatted with its args
+    Only records that get written are ever formatted
+    """
+    message = record[5]
+    args = record[6]
+
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError) as e:
+            message = "%s %% %r (%s)" % (message, args, str(e))
+
+    return message
+
+
+def format_record(record):
+    """
+    Returns the STDOUT line of a record
+    """
+    (ts, pid, level, project, stage, message, args, prefix) = record
+    message = format_message(record)
+
+    if level == "ERROR":
+        message = ">>> ERROR: " + message
+    elif level == "DEBUG":
+        message = "DEBUG: " + message
+
+    if not prefix:
+        return message
+
+    fields = [str(pid), datetime.datetime.fromtimestamp(ts).strftime(LOG_TIMESTAMP)]
+
+    if project is not None:
+        fields.append(str(project))
+
+    if stage is not None:
+        fields.append(str(stage))
+
+    return "\n[%s]\n\t%s" % ("]-[".join(fields), message)
+
+
+def format_error_record(record):
+    """
+    Returns the error log line of a record
+    """
+    ts = datetime.datetime.fromtimestamp(record[0]).strftime(LOG_TIMESTAMP)
+
+    if record[3] is not None:
+        return "[%s] [%s] %s\n" % (ts, record[3], format_message(record))
+    else:
+        return "[%s] %s\n" % (ts, format_message(record))
+
+
+def __write_records(records, error_file=None):
+    """
+    Helper function - Write a batch of records with a single write to STDOUT
+    Errors are additionally written to error_file or appended to ERROR_LOG
+    """
+    lines = [format_record(x) for x in records]
+    error_lines = [format_error_record(x) for x in records if x[2] == "ERROR"] if LOG_ERRORS else []
+
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+    if error_lines:
+        try:
+            if error_file:
+                error_file.writelines(error_lines)
+                error_file.flush()
+            else:
+                with open(ERROR_LOG, "a") as err:
+                    err.writelines(error_lines)
+        except IOError as e:
+            sys.stderr.write("Cannot write error log %s: %s\n" % (ERROR_LOG, str(e)))
+
+
+def write(record):
+    """
+    Put a record on the queue or write it directly if there is no writer
+    """
+    if __queue is not None:
+        __queue.put(record)
+    else:
+        __write_records([record])
+
+
+def __drain():
+    """
+    Helper function - Writer thread main loop
+    Writes all records waiting in the queue as one batch
+    """
+    error_file = None
+    running = True
+
+    if LOG_ERRORS:
+        try:
+            error_file = open(ERROR_LOG, "a")
+        except IOError as e:
+            sys.stderr.write("Cannot open error log %s: %s\n" % (ERROR_LOG, str(e)))
+
+    while running:
+        batch = [__queue.get()]
+
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(__queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if None in batch:
+            running = False
+            batch = batch[:batch.index(None)]
+
+        __write_records(batch, error_file)
+
+    if error_file:
+        error_file.close()
+
+
+def start():
+    """
+    Start the writer thread
+    Call it before forking the worker processes
+    """
+    global __queue, __writer, __writer_pid
+    import multiprocessing
+
+    if __queue is not None:
+        return
+
+    __queue = multiprocessing.Queue()
+    __writer = threading.Thread(target=__drain, name="log-writer", daemon=True)
+    __writer_pid = os.getpid()
+    __writer.start()
+
+
+def stop():
+    """
+    Write all pending records and stop the writer thread
+    Worker processes only stop putting records on the queue
+    """
+    global __queue, __writer, __writer_pid
+
+    if __queue is None:
+        return
+
+    if __writer_pid == os.getpid():
+        __queue.put(None)
+        __writer.join()
+
+    __queue = None
+    __writer = None
+    __writer_pid = None
@@ -0,0 +1,195 @@
+#
+# Central lib for Gitlab Tools - Memoization of lookups
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Loading modules
+#
+
+import os
+import copy
+import time
+import threading
+import functools
+from collections import OrderedDict
+
+
+#
+# Configuration
+#
+
+MEMO_TTL = 300
+MEMO_MAXSIZE = 4096
+
+__memos = []
+
+
+#
+# Subroutines
+#
+
+class Memoized(object):
+    """
+    Cache the results of a lookup function per process for ttl seconds
+    keeping at most maxsize results (least recently used are dropped)
+    Concurrent calls with the same arguments wait for the first one
+    instead of sending the same request again
+    Empty results like unknown users are not cached
+    """
+    def __init__(self, func, ttl, maxsize):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.reset()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def reset(self):
+        """
+        Create new locks, e.g. after fork where another thread could hold them
+        """
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.generation = 0
+
+    def clear(self):
+        """
+        Invalidate all cached results
+        Calls already in flight may return what they got, but it is not
+        cached and later calls do not wait for them
+        """
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+            self.generation += 1
+
+    def stats(self):
+        calls = self.hits + self.misses + self.coalesced
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / calls if calls else 0.0,
+                "size": len(self.entries)}
+
+    def __call__(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+
+        try:
+            hash(key)
+        except TypeError:
+            return self.func(*args, **kwargs)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            call = self.pending.get(key)
+            owner = call is None
+
+            if owner:
+                call = self.pending[key] = {"event": threading.Event(), "result": None, "error": None, "generation": self.generation}
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        # someone else is already asking the server, wait for the answer
+        if not owner:
+            call["event"].wait()
+
+            if call["error"]:
+                raise call["error"]
+
+            return copy.deepcopy(call["result"])
+
+        try:
+            call["result"] = self.func(*args, **kwargs)
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                if self.pending.get(key) is call:
+                    del self.pending[key]
+
+                if call["error"] is None and call["result"] and call["generation"] == self.generation:
+                    self.entries[key] = (time.time() + self.ttl, call["result"])
+                    self.entries.move_to_end(key)
+
+                    while len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+
+            call["event"].set()
+
+        return copy.deepcopy(call["result"])
+
+
+def memoize(ttl=MEMO_TTL, maxsize=MEMO_MAXSIZE):
+    """
+    Decorator to memoize a lookup function (see Memoized)
+    """
+    def decorator(func):
+        memo = Memoized(func, ttl, maxsize)
+        __memos.append(memo)
+
+        return memo
+
+    return decorator
+
+
+def clear_memos():
+    """
+    Invalidate the cached results of all memoized functions
+    """
+    for memo in __memos:
+        memo.clear()
+
+
+def get_memo_stats():
+    """
+    Returns a dict function name -> hits, misses, coalesced calls, hit rate and size
+    """
+    return dict([(memo.__module__ + "." + memo.__name__, memo.stats()) for memo in __memos])
+
+
+def log_memo_stats():
+    """
+    Log hit rate of all memoized functions which have been called
+    """
+    from .core import info
+
+    for (name, stats) in get_memo_stats().items():
+        if stats["hits"] + stats["misses"] + stats["coalesced"] > 0:
+            info("Memo %s: %d hits, %d misses, %d coalesced, hit rate %.1f%%, %d cached" %
+                 (name, stats["hits"], stats["misses"], stats["coalesced"], stats["hit_rate"] * 100, stats["size"]))
+
+
+def __reset_after_fork():
+    for memo in __memos:
+        memo.reset()
+
+
+os.register_at_fork(after_in_child=__reset_after_fork)
@@ -0,0 +1,301 @@
+#
+# Central lib for Gitlab Tools - Prometheus metrics
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Collect metrics of the API client and the backup stages and write them
+# in the Prometheus text format for the node_exporter textfile collector
+#
+# Every process collects its own metrics and regularly dumps a snapshot
+# to a spool directory. write_textfile() adds up the snapshots of all
+# processes, so call enable() before forking the worker processes.
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+from .core import make_spool_dir, spool_file, spool_files
+
+
+#
+# Configuration
+#
+
+FLUSH_INTERVAL = 30
+
+API_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_DURATION_BUCKETS = (1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200)
+SIZE_BUCKETS = (1024, 65536, 1048576, 16777216, 268435456, 1073741824, 17179869184)
+
+METRICS = {
+    "gitlab_api_requests_total": ("counter", "API requests by method, endpoint template and status", None),
+    "gitlab_api_request_duration_seconds": ("histogram", "API request latency", API_LATENCY_BUCKETS),
+    "gitlab_api_response_bytes_total": ("counter", "Bytes received from the API", None),
+    "gitlab_api_retries_total": ("counter", "API requests retried because of throttling or errors", None),
+    "gitlab_backup_stage_duration_seconds": ("histogram", "Duration of backup stages", STAGE_DURATION_BUCKETS),
+    "gitlab_backup_stage_bytes": ("histogram", "Size of the output of backup stages", SIZE_BUCKETS),
+    "gitlab_backup_projects_total": ("counter", "Backed up projects by result", None),
+    "gitlab_backup_last_run_timestamp_seconds": ("gauge", "Time the last backup run finished", None),
+    "gitlab_backup_dedup_ratio": ("gauge", "Bytes backed up per byte written to the chunk store in the last run", None),
+    "gitlab_backup_dedup_throughput_bytes_per_second": ("gauge", "Bytes backed up per second of chunking and storing in the last run", None),
+    "gitlab_backup_dedup_run_bytes": ("gauge", "Bytes backed up through the chunk store in the last run", None),
+    "gitlab_backup_dedup_written_bytes": ("gauge", "Bytes of new chunks written to the chunk store in the last run", None),
+    "gitlab_backup_chunk_store_bytes": ("gauge", "Size of the chunk store after garbage collection", None),
+}
+
+SPOOL_DIR = None
+
+__counters = {}
+__histograms = {}
+__gauges = {}
+__lock = threading.Lock()
+__last_flush = 0
+
+
+#
+# Subroutines
+#
+
+def enable(spool_dir=None):
+    """
+    Start collecting metrics
+    Snapshots of all processes are spooled to spool_dir (default a new temp dir)
+    """
+    global SPOOL_DIR
+
+    SPOOL_DIR = make_spool_dir(spool_dir, "gitlab_metrics_")
+
+
+def is_enabled():
+    return SPOOL_DIR is not None
+
+
+def __key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, labels={}, value=1):
+    """
+    Increment a counter
+    """
+    if not SPOOL_DIR:
+        return
+
+    key = __key(name, labels)
+
+    with __lock:
+        __counters[key] = __counters.get(key, 0) + value
+
+    maybe_flush()
+
+
+def observe(name, value, labels={}):
+    """
+    Add a value to a histogram
+    """
+    if not SPOOL_DIR:
+        return
+
+    key = __key(name, labels)
+    buckets = METRICS[name][2]
+
+    with __lock:
+        histogram = __histograms.get(key)
+
+        if histogram is None:
+            histogram = __histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    maybe_flush()
+
+
+def set_gauge(name, value, labels={}):
+    """
+    Set a gauge
+    """
+    if not SPOOL_DIR:
+        return
+
+    with __lock:
+        __gauges[__key(name, labels)] = value
+
+
+def observe_stage(stage, duration, size=None):
+    """
+    Record duration and optionally output size of a backup stage
+    like clone, archive or dump
+    """
+    observe("gitlab_backup_stage_duration_seconds", duration, {"stage": stage})
+
+    if size is not None:
+        observe("gitlab_backup_stage_bytes", size, {"stage": stage})
+
+
+def __snapshot():
+    with __lock:
+        return {"counters": [[k[0], k[1], v] for (k, v) in __counters.items()],
+                "histograms": [[k[0], k[1]] + v for (k, v) in __histograms.items()],
+                "gauges": [[k[0], k[1], v] for (k, v) in __gauges.items()]}
+
+
+def flush():
+    """
+    Write the metrics of this process to the spool dir
+    """
+    global __last_flush
+
+    if not SPOOL_DIR:
+        return
+
+    __last_flush = time.time()
+    (fd, tmp_file) = tempfile.mkstemp(dir=SPOOL_DIR, suffix=".tmp")
+
+    with os.fdopen(fd, "w") as f:
+        json.dump(__snapshot(), f)
+
+    os.replace(tmp_file, spool_file(SPOOL_DIR, "metrics", ".json"))
+
+
+def maybe_flush():
+    """
+    Flush if the last flush is more than FLUSH_INTERVAL seconds ago
+    """
+    if time.time() - __last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def __collect():
+    """
+    Helper function - Add up the snapshots of all processes
+    """
+    counters = {}
+    histograms = {}
+    gauges = {}
+
+    for filename in spool_files(SPOOL_DIR, "metrics", ".json"):
+        try:
+            with open(filename) as f:
+                snapshot = json.load(f)
+        except (IOError, ValueError):
+            continue
+
+        for (name, labels, value) in snapshot["counters"]:
+            key = __key(name, dict(labels))
+            counters[key] = counters.get(key, 0) + value
+
+        for (name, labels, buckets, total, count) in snapshot["histograms"]:
+            key = __key(name, dict(labels))
+            histogram = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            histogram[0] = [x + y for (x, y) in zip(histogram[0], buckets)]
+            histogram[1] += total
+            histogram[2] += count
+
+        for (name, labels, value) in snapshot["gauges"]:
+            key = __key(name, dict(labels))
+            gauges[key] = max(gauges.get(key, value), value)
+
+    return (counters, histograms, gauges)
+
+
+def __format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+
+    if not labels:
+        return ""
+
+    escape = lambda x: str(x).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(['%s="%s"' % (k, escape(v)) for (k, v) in labels]) + "}"
+
+
+def render():
+    """
+    Returns the metrics of all processes in the Prometheus text format
+    """
+    flush()
+    (counters, histograms, gauges) = __collect()
+    lines = []
+
+    for (name, (metric_type, help_text, buckets)) in sorted(METRICS.items()):
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+
+        for (key, value) in sorted(list(counters.items()) + list(gauges.items())):
+            if key[0] == name:
+                lines.append("%s%s %s" % (name, __format_labels(key[1]), repr(value)))
+
+        for (key, (bucket_counts, total, count)) in sorted(histograms.items()):
+            if key[0] == name:
+                cumulative = 0
+
+                for (bound, bucket_count) in zip(list(buckets) + ["+Inf"], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append("%s_bucket%s %d" % (name, __format_labels(key[1], [("le", bound)]), cumulative))
+
+                lines.append("%s_sum%s %s" % (name, __format_labels(key[1]), repr(total)))
+                lines.append("%s_count%s %d" % (name, __format_labels(key[1]), count))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """
+    Atomically write the metrics of all processes to path
+    Point the node_exporter textfile collector to its directory
+    """
+    if not SPOOL_DIR:
+        return
+
+    (fd, tmp_file) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(render())
+
+        os.chmod(tmp_file, 0o644)
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+
+def __reset_after_fork():
+    """
+    A forked process starts with empty metrics, the parent reports its own
+    """
+    global __lock, __last_flush
+
+    __lock = threading.Lock()
+    __counters.clear()
+    __histograms.clear()
+    __gauges.clear()
+    __last_flush = 0
+
+
+os.register_at_fork(after_in_child=__reset_after_fork)
@@ -0,0 +1,214 @@
+#
+# Central lib for Gitlab Tools - Persistent repository mirrors
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Keep a bare mirror of every project in MIRROR_DIR/<project id>.git and
+# refresh it with git remote update --prune instead of cloning the whole
+# repository again on every backup run. Mirrors are named by project id
+# so renamed or moved projects keep their mirror.
+#
+# Every mirror has a lock file MIRROR_DIR/<project id>.lock. Hold lock()
+# while updating or reading a mirror, so two workers never touch the same
+# mirror and evict() never removes a mirror in use.
+#
+# The mirrors are disabled until enable() is called.
+#
+
+#
+# Loading modules
+#
+
+import os
+import shutil
+import subprocess
+from .core import *
+from .exception import CloneError
+
+
+#
+# Configuration
+#
+
+MIRROR_DIR = None
+MIRROR_MAX_SIZE = 100 * 1024 * 1024 * 1024
+
+
+#
+# Subroutines
+#
+
+def enable(mirror_dir, max_size=MIRROR_MAX_SIZE):
+    """
+    Keep mirrors in mirror_dir limited to max_size bytes
+    """
+    global MIRROR_DIR, MIRROR_MAX_SIZE
+
+    os.makedirs(mirror_dir, mode=0o700, exist_ok=True)
+
+    MIRROR_DIR = mirror_dir
+    MIRROR_MAX_SIZE = max_size
+
+
+def is_enabled():
+    return MIRROR_DIR is not None
+
+
+def mirror_path(project):
+    """
+    Returns the directory of the mirror of a project
+    """
+    return os.path.join(MIRROR_DIR, "%d.git" % (int(project['id']),))
+
+
+def __lock_file(project_id):
+    return os.path.join(MIRROR_DIR, "%d.lock" % (int(project_id),))
+
+
+def lock(project, blocking=True):
+    """
+    Exclusively lock the mirror of a project (see core.file_lock)
+    """
+    return file_lock(__lock_file(project['id']), blocking)
+
+
+def __git(git_cmd):
+    """
+    Helper function - Run a git command
+    Returns a tuple of the exit code and the lower case error output
+    """
+    debug("Running %s", " ".join(git_cmd))
+    git = subprocess.run(git_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=GIT_TIMEOUT)
+
+    return (git.returncode, git.stderr.decode("utf8", "replace").lower())
+
+
+def update(project, repository_url):
+    """
+    Clone or refresh the mirror of a project, hold lock() while calling it
+    Returns the mirror directory or None if the repository is empty
+    Raises CloneError if the repository cannot be fetched
+    """
+    mirror_dir = mirror_path(project)
+
+    if os.path.isdir(mirror_dir):
+        # the url carries the clone token, which may have changed
+        (returncode, git_error) = __git(["git", "-C", mirror_dir, "remote", "set-url", "origin", repository_url])
+
+        if returncode == 0:
+            (returncode, git_error) = __git(["git", "-C", mirror_dir, "remote", "update", "--prune"])
+
+        if returncode == 0:
+            os.utime(mirror_dir)
+            return mirror_dir
+
+        log("Refreshing mirror %s failed, cloning it again: %s" % (mirror_dir, git_error.strip()))
+        shutil.rmtree(mirror_dir)
+
+    # clone next to the mirror, a half finished clone never looks like a mirror
+    tmp_dir = mirror_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    log("Cloning " + repository_url + " into " + mirror_dir)
+    (returncode, git_error) = __git(["git", "clone", "--mirror", repository_url, tmp_dir])
+
+    # when cloning an empty repo via https git returns 403 :(
+    if returncode != 0 and ("empty repository" in git_error or "error: 403" in git_error):
+        log("Repository is empty")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+    elif returncode != 0:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise CloneError(repository_url, "Failed cloning: " + git_error)
+
+    os.rename(tmp_dir, mirror_dir)
+
+    return mirror_dir
+
+
+def __disk_usage(directory):
+    """
+    Helper function - Returns the bytes allocated by all files below directory
+    """
+    size = 0
+
+    for (path, subdirs, files) in os.walk(directory):
+        for filename in files:
+            try:
+                size += os.lstat(os.path.join(path, filename)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+
+    return size
+
+
+def __remove(project_id, mirror_dir, remove_lock=False):
+    """
+    Helper function - Remove a mirror unless another process has locked it
+    Returns True if it was removed
+    """
+    with lock({"id": project_id}, blocking=False) as locked:
+        if not locked:
+            debug("Mirror %s is in use, not removing it", mirror_dir)
+            return False
+
+        shutil.rmtree(mirror_dir, ignore_errors=True)
+        shutil.rmtree(mirror_dir[:-len(".git")] + ".git.tmp", ignore_errors=True)
+
+        # only projects that are gone for good may lose their lock file
+        if remove_lock:
+            os.unlink(__lock_file(project_id))
+
+    return True
+
+
+def evict(project_ids=None):
+    """
+    Remove the mirrors of all projects not in project_ids (deleted projects)
+    and the least recently used mirrors until all fit into MIRROR_MAX_SIZE
+    project_ids None keeps the mirrors of all projects
+    Returns a tuple of the number of removed mirrors and the bytes in use
+    """
+    mirrors = []
+    removed = 0
+
+    for entry in os.scandir(MIRROR_DIR):
+        if not entry.name.endswith(".git") or not entry.name[:-len(".git")].isdigit():
+            continue
+
+        project_id = int(entry.name[:-len(".git")])
+
+        if project_ids is not None and project_id not in project_ids:
+            log("Removing mirror of deleted project %d" % (project_id,))
+            removed += __remove(project_id, entry.path, remove_lock=True)
+        else:
+            mirrors.append((entry.stat().st_mtime, __disk_usage(entry.path), project_id, entry.path))
+
+    used = sum([x[1] for x in mirrors])
+
+    for (mtime, size, project_id, mirror_dir) in sorted(mirrors):
+        if used <= MIRROR_MAX_SIZE:
+            break
+
+        debug("Evicting mirror %s of %d bytes", mirror_dir, size)
+
+        if __remove(project_id, mirror_dir):
+            used -= size
+            removed += 1
+
+    return (removed, used)
@@ -25,15 +25,18 @@
 from .core import *
 from .api import *
 from . import permissions
+from .memo import memoize
 
 
 #
 # SUBROUTINES
 #
 
+@memoize()
 def get_namespaces(search=None):
     """
     Return a list of all namespaces
+    Results are memoized (see memo.py)
     """
     namespaces = []
 
@@ -0,0 +1,177 @@
+#
+# Central lib for Gitlab Tools - Streaming newline-delimited JSON dumps
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Paginated collections like issues and snippets are written one record
+# per line to <name>.ndjson while the pages arrive instead of collecting
+# them in a list for a single json.dump(), so memory does not grow with
+# the size of a project.
+#
+#   with ndjson.Writer(output_basedir, "issues") as out:
+#       for issue in fetch_per_page(api_url):
+#           out.write(issue)
+#
+# The Writer renames the file into place when the with block is left
+# without an exception and drops the partial file or the chunks written
+# so far otherwise. iter_dump() reads it back line by line and also
+# reads the json arrays <name>.json of older backups.
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+from .core import *
+from . import chunkstore
+
+
+#
+# Configuration
+#
+
+SUFFIX = ".ndjson"
+
+
+#
+# Subroutines
+#
+
+class Writer(object):
+    """
+    Write records to output_basedir/name.ndjson as they arrive
+    or to the chunk store if it is enabled
+    """
+    def __init__(self, output_basedir, name):
+        self.legacy_file = os.path.join(output_basedir, name + ".json")
+        self.filename = os.path.join(output_basedir, name + SUFFIX)
+        self.count = 0
+        self.chunked = chunkstore.is_enabled()
+
+        if self.chunked:
+            self.filename += chunkstore.RECIPE_SUFFIX
+            self.out = chunkstore.Writer(self.filename)
+        else:
+            self.out = open(self.filename + ".tmp", "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """
+        Drop everything written so far, an older dump stays in place
+        """
+        if self.chunked:
+            self.out.abort()
+        else:
+            self.out.close()
+            os.unlink(self.filename + ".tmp")
+
+    def write(self, record):
+        self.out.write(json.dumps(record).encode("utf8") + b"\n")
+        self.count += 1
+
+    def close(self):
+        """
+        Move the complete file into place and remove a legacy
+        json array of the same name
+        Returns the number of records
+        """
+        self.out.close()
+
+        if not self.chunked:
+            os.replace(self.filename + ".tmp", self.filename)
+
+        for legacy_file in (self.legacy_file, self.legacy_file + chunkstore.RECIPE_SUFFIX):
+            if os.path.exists(legacy_file):
+                os.unlink(legacy_file)
+
+        return self.count
+
+
+def iter_lines(blocks):
+    """
+    Generator for the records of newline-delimited JSON given as byte blocks
+    """
+    rest = b""
+
+    for block in blocks:
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode("utf8"))
+
+    if rest.strip():
+        yield json.loads(rest.decode("utf8"))
+
+
+def __candidates(backup_dir, name):
+    """
+    Helper function - Files the dump name may be stored in, newest format first
+    """
+    for suffix in (SUFFIX, ".json"):
+        yield os.path.join(backup_dir, name + suffix)
+        yield os.path.join(backup_dir, name + suffix + chunkstore.RECIPE_SUFFIX)
+
+
+def exists(backup_dir, name):
+    """
+    Returns True if backup_dir has a dump name in any format
+    """
+    return any([os.path.exists(x) for x in __candidates(backup_dir, name)])
+
+
+def __parse(blocks, dump_file):
+    """
+    Helper function - Iterator over the records of the newline-delimited or legacy array dump_file
+    """
+    if SUFFIX in os.path.basename(dump_file):
+        return iter_lines(blocks)
+
+    return iter(json.loads(b"".join(blocks).decode("utf8")) or [])
+
+
+def iter_dump(backup_dir, name):
+    """
+    Generator for the records of the dump name in backup_dir
+    name.ndjson is read line by line, a legacy name.json array at once
+    Recipes of both are read from the chunk store
+    Yields nothing if there is no dump
+    """
+    for dump_file in __candidates(backup_dir, name):
+        if not os.path.exists(dump_file):
+            continue
+
+        if dump_file.endswith(chunkstore.RECIPE_SUFFIX):
+            yield from __parse(chunkstore.iter_data(dump_file), dump_file)
+        else:
+            with open(dump_file, "rb") as f:
+                yield from __parse(f, dump_file)
+
+        return
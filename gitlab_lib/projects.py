@@ -60,12 +60,17 @@ def delete_project(project):
     return delete(DELETE_PROJECT % (API_BASE_URL, project_data[0]["id"]))
 
 
-def get_projects(username=None, personal=False, only_archived=False):
+def get_projects(username=None, personal=False, only_archived=False, prefetch=0, pagination="offset", last_activity_after=None, statistics=False):
     """
     Returns a list of all gitlab projects
     If username was specified returns list of projects user is involved in
     If personal is true only personal projects of the given user are returned
     Set only_archived to True if you only want to see archived projects
+    last_activity_after is an ISO 8601 timestamp, only projects with activity
+    after it are listed (filtered by the server)
+    statistics adds the sizes of repository, LFS objects etc. (needs an admin token)
+    prefetch > 0 fetches that many pages concurrently (see fetch_per_page)
+    Set pagination to keyset for very large instances (see fetch_per_keyset)
 
     >>> len(get_projects()) > 0
     True
@@ -83,7 +88,19 @@ def get_projects(username=None, personal=False, only_archived=False):
     if only_archived:
         api_url = GET_ARCHIVED_PROJECTS % (API_BASE_URL, )
 
-    for project in fetch_per_page(api_url, chunk_size, filter_func):
+    # the url is a format string of fetch_per_page so the timestamp is not percent-encoded
+    if last_activity_after:
+        api_url += ("&" if "?" in api_url else "?") + "last_activity_after=" + last_activity_after
+
+    if statistics:
+        api_url += ("&" if "?" in api_url else "?") + "statistics=true"
+
+    if pagination == "keyset":
+        projects = fetch_per_keyset(api_url, chunk_size, filter_func)
+    else:
+        projects = fetch_per_page(api_url, chunk_size, filter_func, prefetch=prefetch)
+
+    for project in projects:
         yield project
 
 
@@ -24,7 +24,6 @@
 
 import os
 import shutil
-import tarfile
 import tempfile
 import subprocess
 import gitlab_lib
@@ -33,6 +32,10 @@ from .core import *
 from .api import *
 from .projects import *
 from .namespaces import *
+from . import bundle
+from . import compression
+from . import ndjson
+from .exception import CloneError
 from gitlab_config import TMP_DIR, GITLAB_DIR
 
 
@@ -107,15 +110,27 @@ def restore_repository(backup_archive, repository_base_dir, project_name, suffix
     """
     Unpack archive to tmp dir, convert to bare repo, move it to repo dir
     and create link to global gitlab hooks dir
+    backup_archive can be a tar of any codec (see compression.py), a git bundle
+    or a directory with a bundle chain (see bundle.py)
     Clear Redis cache afterwards to refresh the dashboard
     """
-    tar = tarfile.open(backup_archive, "r:gz")
-
     tmp_dir = tempfile.TemporaryDirectory(dir=TMP_DIR)
     repository_dest = os.path.join(repository_base_dir, project_name + suffix)
 
-    # unpack repo
-    tar.extractall(tmp_dir.name)
+    # replay bundle chain, clone bundle or unpack repo
+    if os.path.isdir(backup_archive):
+        bundle.replay(backup_archive, tmp_dir.name)
+    elif backup_archive.endswith(".bundle"):
+        for git_cmd in (["git", "clone", "-q", "--mirror", backup_archive, tmp_dir.name],
+                        ["git", "-C", tmp_dir.name, "remote", "rm", "origin"]):
+            git = subprocess.run(git_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+            # a corrupt bundle must not replace the repository
+            if git.returncode != 0:
+                tmp_dir.cleanup()
+                raise CloneError(backup_archive, "Command %s failed: %s" % (" ".join(git_cmd), git.stderr.decode("utf8", "replace")))
+    else:
+        compression.extract(backup_archive, tmp_dir.name)
 
     if os.path.exists(repository_dest):
         shutil.rmtree(repository_dest)
@@ -208,6 +223,24 @@ def restore_project(backup_dir, project_name, namespace_name=None):
     return project
 
 
+def iter_component(backup_dir, project, component):
+    """
+    Generator for the entries of a component dump in backup_dir prepared for restore_entry
+    Reads component.ndjson line by line or the json array component.json of older backups
+    """
+    iid_counter = 1
+
+    for entry in ndjson.iter_dump(backup_dir, component):
+        entry['component'] = component
+        entry['project_id'] = project['id']
+
+        if entry.get('iid'):
+            entry['iid'] = iid_counter
+            iid_counter = iid_counter + 1
+
+        yield entry
+
+
 def restore_entry(backup_dir, project, entry):
     """
     Restore a single entry of a project component
@@ -251,10 +284,9 @@ def restore_entry(backup_dir, project, entry):
 
 def restore(backup_dir, project, work_queue):
     """
-    Restore a projects components
+    Restore the entries of work_queue until it yields None
     """
-    while work_queue.qsize() > 0:
-        entry = work_queue.get()
+    for entry in iter(work_queue.get, None):
         restore_entry(backup_dir, project, entry)
 
 
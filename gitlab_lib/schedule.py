@@ -0,0 +1,140 @@
+#
+# Central lib for Gitlab Tools - Cost-aware order of the backup work queue
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# The workers take projects from the work queue in the order they were
+# put in. One huge repository taken last keeps a single worker busy long
+# after all others are done, so largest_first() puts the most expensive
+# projects first (longest processing time first).
+#
+# The cost of a project is the duration measured by the previous run
+# (seconds in its manifest entry). Projects without one are estimated
+# from repository and LFS size of their statistics (the project list
+# must be requested with statistics=true, which needs an admin token)
+# and their number of open issues.
+#
+# predict() simulates the workers on the ordered queue, so a dry run can
+# print the schedule and the expected end of a run.
+#
+
+#
+# Loading modules
+#
+
+import time
+import heapq
+from .core import *
+
+
+#
+# Configuration
+#
+
+# API calls of all components of a project
+PROJECT_SECONDS = 2.0
+
+# clone, archive and tar of repository and LFS objects
+BYTES_PER_SECOND = 20 * 1024 * 1024
+
+# issue listing, notes and closed_by of an issue
+ISSUE_SECONDS = 0.1
+
+
+#
+# Subroutines
+#
+
+def estimate(project, entry=None):
+    """
+    Returns the expected seconds to backup a project
+    entry is its manifest entry of the previous run or None
+    """
+    if entry and entry.get("seconds") and not entry.get("failed"):
+        return entry["seconds"]
+
+    statistics = project.get("statistics") or {}
+    size = (statistics.get("repository_size") or 0) + (statistics.get("lfs_objects_size") or 0)
+
+    return PROJECT_SECONDS + size / BYTES_PER_SECOND + (project.get("open_issues_count") or 0) * ISSUE_SECONDS
+
+
+def estimate_all(projects, manifest=None):
+    """
+    Returns a list of tuples of project and its estimated seconds
+    manifest is the manifest of a previous run or None
+    """
+    entries = manifest["projects"] if manifest else {}
+
+    return [(x, estimate(x, entries.get(str(x['id'])))) for x in projects]
+
+
+def largest_first(costs):
+    """
+    Returns the list of tuples of project and seconds sorted most expensive first
+    """
+    # sorted is stable, so equal costs keep the order of the API
+    return sorted(costs, key=lambda x: x[1], reverse=True)
+
+
+def predict(costs, workers):
+    """
+    Simulate workers taking the projects of a list of tuples of project
+    and seconds in order
+    Returns a tuple of the list of tuples (project, worker, start, end)
+    and the seconds until the last project is done
+    """
+    idle = [(0.0, x) for x in range(max(workers, 1))]
+    schedule = []
+
+    for (project, seconds) in costs:
+        (start, worker) = heapq.heappop(idle)
+        schedule.append((project, worker, start, start + seconds))
+        heapq.heappush(idle, (start + seconds, worker))
+
+    return (schedule, max([x[3] for x in schedule] + [0.0]))
+
+
+def __duration(seconds):
+    """
+    Helper function - Format seconds as h:mm:ss
+    """
+    seconds = int(round(seconds))
+
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def report(costs, workers, started):
+    """
+    Returns lines describing the predicted schedule of the projects of costs
+    (in API order) with workers processes starting at the unix time started
+    """
+    (schedule, makespan) = predict(largest_first(costs), workers)
+    (api_schedule, api_makespan) = predict(costs, workers)
+    lines = ["%-8s %-9s %-9s %s" % ("Worker", "Start", "Duration", "Project")]
+
+    for (project, worker, start, end) in schedule:
+        lines.append("%-8d %-9s %-9s %s/%s [ID %s]" % (worker, __duration(start), __duration(end - start),
+                                                        project['namespace']['name'], project['name'], project['id']))
+
+    lines.append("%d projects with %d processes take %s (%s in API order), predicted end %s" %
+                 (len(costs), workers, __duration(makespan), __duration(api_makespan),
+                  time.strftime(LOG_TIMESTAMP, time.localtime(started + makespan))))
+
+    return lines
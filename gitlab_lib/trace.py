@@ -0,0 +1,213 @@
+#
+# Central lib for Gitlab Tools - Tracing of backup stages
+#
+# Copyright 2018 ETH Zurich, ISGINF, Bastian Ballmann
+# Email: bastian.ballmann@inf.ethz.ch
+# Web: http://www.isg.inf.ethz.ch
+#
+# This is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License.
+# If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Record how long every project and stage of a backup run takes
+# and write it as Chrome trace event file (open it in chrome://tracing
+# or https://ui.perfetto.dev) with one track per worker process
+#
+# with trace.span("clone", project="mygroup/myproject"):
+#     ...
+#
+# Spans inherit the project of their enclosing span. Every process spools
+# its events to a shared directory, so call enable() before forking.
+#
+
+#
+# Loading modules
+#
+
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from .core import make_spool_dir, spool_file, spool_files
+
+
+#
+# Configuration
+#
+
+# write spooled events to disk after this many spans
+FLUSH_EVENTS = 100
+
+SPOOL_DIR = None
+
+__events = []
+__local = threading.local()
+
+
+#
+# Subroutines
+#
+
+def enable(spool_dir=None):
+    """
+    Start recording spans
+    Events of all processes are spooled to spool_dir (default a new temp dir)
+    """
+    global SPOOL_DIR
+
+    SPOOL_DIR = make_spool_dir(spool_dir, "gitlab_trace_")
+
+
+def is_enabled():
+    return SPOOL_DIR is not None
+
+
+@contextmanager
+def span(name, **args):
+    """
+    Record the duration of the with block as span name
+    Keyword arguments are shown as args of the span
+    """
+    if not SPOOL_DIR:
+        yield
+        return
+
+    stack = getattr(__local, "stack", None)
+
+    if stack is None:
+        stack = __local.stack = []
+
+    if stack and "project" not in args and "project" in stack[-1]:
+        args["project"] = stack[-1]["project"]
+
+    stack.append(args)
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        stack.pop()
+
+        __events.append({"name": name,
+                         "ph": "X",
+                         "ts": int(start * 1000000),
+                         "dur": int(duration * 1000000),
+                         "pid": os.getpid(),
+                         "tid": threading.get_ident() % 1000000,
+                         "args": args})
+
+        if len(__events) >= FLUSH_EVENTS:
+            flush()
+
+
+def traced(name):
+    """
+    Decorator to record every call of a function as span name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush():
+    """
+    Append the recorded events of this process to its spool file
+    """
+    if not SPOOL_DIR or not __events:
+        return
+
+    events = list(__events)
+    del __events[:len(events)]
+
+    with open(spool_file(SPOOL_DIR, "trace", ".jsonl"), "a") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def collect():
+    """
+    Returns the spooled events of all processes
+    """
+    events = []
+    flush()
+
+    for filename in spool_files(SPOOL_DIR, "trace", ".jsonl"):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+
+    return events
+
+
+def write(path, events=None):
+    """
+    Write all events as Chrome trace file with one track per process
+    """
+    if events is None:
+        events = collect()
+
+    pids = sorted(set([x["pid"] for x in events]))
+    metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "worker %d" % (pid,)}} for pid in pids]
+
+    with open(path + ".tmp", "w") as f:
+        json.dump({"traceEvents": metadata + sorted(events, key=lambda x: x["ts"]),
+                   "displayTimeUnit": "ms"}, f)
+
+    os.replace(path + ".tmp", path)
+
+
+def summary(events=None, top=10):
+    """
+    Returns a list of lines with the top slowest projects and stages
+    """
+    if events is None:
+        events = collect()
+
+    lines = []
+    projects = sorted([x for x in events if x["name"] == "project"], key=lambda x: -x["dur"])
+    stages = sorted([x for x in events if x["name"] != "project"], key=lambda x: -x["dur"])
+
+    lines.append("Top %d slowest projects:" % (top,))
+
+    for event in projects[:top]:
+        lines.append("  %10.1fs  %s" % (event["dur"] / 1000000.0, event["args"].get("project")))
+
+    lines.append("Top %d slowest stages:" % (top,))
+
+    for event in stages[:top]:
+        lines.append("  %10.1fs  %-20s %s" % (event["dur"] / 1000000.0, event["name"], event["args"].get("project")))
+
+    return lines
+
+
+def __reset_after_fork():
+    """
+    A forked process starts without the events of its parent
+    """
+    del __events[:]
+    __local.stack = []
+
+
+os.register_at_fork(after_in_child=__reset_after_fork)
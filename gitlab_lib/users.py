@@ -21,6 +21,8 @@
 from .core import *
 from .api import *
 from .exception import APIError
+from .memo import memoize
+from .namespaces import get_namespaces
 
 
 #
@@ -64,6 +66,15 @@ def __user_provider_matches(user, provider):
     return result
 
 
+def __invalidate_user_lookups():
+    """
+    Helper function - Forget memoized users and namespaces (every user has one)
+    """
+    get_user.clear()
+    convert_user_to_id.clear()
+    get_namespaces.clear()
+
+
 def create_user(username=None, name=None, email=None, metadata={}):
     """
     Create a new user with the given data
@@ -75,8 +86,10 @@ def create_user(username=None, name=None, email=None, metadata={}):
     metadata["email"] = email
 
     api_url = CREATE_USER % (API_BASE_URL,)
+    result = post(api_url, metadata)
+    __invalidate_user_lookups()
 
-    return post(api_url, metadata)
+    return result
 
 
 def delete_user(user):
@@ -88,7 +101,10 @@ def delete_user(user):
         user = get_user(user)
 
     if user:
-        return delete(DELETE_USER % (API_BASE_URL, user["id"]))
+        result = delete(DELETE_USER % (API_BASE_URL, user["id"]))
+        __invalidate_user_lookups()
+
+        return result
 
 
 def update_user(user, metadata):
@@ -102,46 +118,40 @@ def update_user(user, metadata):
             raise ValueError("Unknown user " + str(user))
 
     metadata['id'] = user['id']
+    result = put(USER_METADATA % (API_BASE_URL, user.get('id')), metadata)
+    __invalidate_user_lookups()
 
-    return put(USER_METADATA % (API_BASE_URL, user.get('id')), metadata)
+    return result
 
 
-def get_users(chunk_size=100, provider=None, state=None, usernames_only=False):
+def get_users(chunk_size=100, provider=None, state=None, usernames_only=False, prefetch=0):
     """
     Returns a generator for all gitlab users
     Parameter provider (e.g. ldap or google_oauth2) can be string or list
     state like active or blocked can also be string or list
     If you don't need user objects but only usernames set usernames_only to True
+    prefetch > 0 fetches that many pages concurrently (see fetch_per_page)
 
     >>> len(list(get_users())) > 0
     True
     """
-    page = 1
-
     if not type(state) == list:
         state = [state]
 
     if not type(provider) == list:
         provider = [provider]
 
-    while 1:
-        buff = fetch(GET_NO_OF_USERS % (API_BASE_URL, chunk_size, page))
-
-        if buff:
-            for user in buff:
-                if (not provider[0] or __user_provider_matches(user, provider)) and \
-                   (not state[0] or user.get("state") in state):
-                    yield __username_filter(user, usernames_only)
-
-            page += 1
-
-        else:
-            break
+    for user in fetch_per_page(GET_USERS % (API_BASE_URL,), chunk_size, prefetch=prefetch):
+        if (not provider[0] or __user_provider_matches(user, provider)) and \
+           (not state[0] or user.get("state") in state):
+            yield __username_filter(user, usernames_only)
 
 
+@memoize()
 def get_user(username=None):
     """
     Get metadata of a single user
+    Results are memoized (see memo.py)
     """
     result = fetch(USER_BY_USERNAME % (API_BASE_URL, username))
 
@@ -168,6 +178,8 @@ def __block_or_unblock(url, user):
         if user_dict:
             result = rest_api_call(url % (API_BASE_URL, user_dict["id"]), {"id": user_dict["id"]}, method="POST")
 
+    get_user.clear()
+
     return result
 
 
@@ -187,10 +199,12 @@ def unblock_user(user):
     return __block_or_unblock(UNBLOCK_USER, user)
 
 
+@memoize()
 def convert_user_to_id(user):
     """
     Try to use user as id (int)
     Otherwise fetch user by name
+    Results are memoized (see memo.py)
     """
     try:
         user_id = int(user)
@@ -35,6 +35,8 @@ from multiprocessing import Queue
 import gitlab_lib
 import gitlab_config
 
+gitlab_lib.drop_privileges()
+
 
 #
 # PARAMETERS
@@ -54,6 +56,11 @@ if not args.server or not args.token:
     print("Need a server and token either through parameter or gitlab_config.py!")
     sys.exit(1)
 
+gitlab_lib.set_server(args.server)
+gitlab_lib.core.TOKEN = args.token
+gitlab_lib.core.DEBUG = args.debug
+gitlab_lib.core.QUIET = args.quiet
+
 for project in gitlab_lib.get_group_projects(args.group_name):
     for user in gitlab_lib.get_project_members(project.get("id")):
         gitlab_lib.info("Member %s -> Reporter" %(user.get("name"),))
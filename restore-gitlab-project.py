@@ -27,12 +27,16 @@
 
 import os
 import sys
+import queue
 import argparse
+import tempfile
 from signal import signal, SIGINT
 from multiprocessing import Queue
 import gitlab_config
 import gitlab_lib
 
+gitlab_lib.drop_privileges()
+
 
 #
 # PARAMETERS
@@ -57,11 +61,12 @@ if not args.server or not args.token or not args.project or not args.backup_dir:
     print("You must at least specify --server, --token, --project and --backup_dir")
     sys.exit(1)
 
-work_queue = Queue()
+# the entries are read while the processes restore them, keep a few per process
+work_queue = Queue(maxsize=int(args.number) * 10)
 processes = []
 gitlab_lib.core.DEBUG = args.debug
-gitlab_lib.TOKEN = args.token
-gitlab_lib.SERVER = args.server
+gitlab_lib.core.TOKEN = args.token
+gitlab_lib.set_server(args.server)
 
 
 #
@@ -74,24 +79,29 @@ def fill_restore_queue(project, component):
     project is project metadata dictionary
     component is the name of the component like the keys in PROJECT_COMPONENTS
     """
-    restore_file = os.path.join(args.backup_dir, component + ".json")
-    iid_counter = 1
+    if gitlab_lib.ndjson.exists(args.backup_dir, component):
+        entries = 0
 
-    if os.path.isfile(restore_file):
-        backup = gitlab_lib.parse_json(restore_file)
+        for entry in gitlab_lib.iter_component(args.backup_dir, project, component):
+            queue_entry(entry)
+            entries = entries + 1
 
-        if backup:
-            for entry in backup:
-                entry['component'] = component
-                entry['project_id'] = project['id']
+        if not entries:
+            gitlab_lib.log("Nothing to do for " + component)
 
-                if entry.get('iid'):
-                    entry['iid'] = iid_counter
-                    iid_counter = iid_counter + 1
 
-                work_queue.put(entry)
-        else:
-            gitlab_lib.log("Nothing to do for " + component)
+def queue_entry(entry):
+    """
+    Put entry in the bounded work queue, wait while the processes are busy
+    """
+    while 1:
+        try:
+            work_queue.put(entry, timeout=1)
+            return
+        except queue.Full:
+            if not any([x.is_alive() for x in processes]):
+                gitlab_lib.error("All restore processes died")
+                sys.exit(1)
 
 #
 # SIGNAL HANDLERS
@@ -115,6 +125,14 @@ if not os.path.exists(args.backup_dir):
     gitlab_lib.log(args.backup_dir + " is not a readable.")
     sys.exit(1)
 
+# Backups in a chunk store hold recipes instead of files, check them out
+if os.path.isdir(args.backup_dir) and gitlab_lib.chunkstore.has_recipes(args.backup_dir):
+    checkout_dir = tempfile.TemporaryDirectory(dir=gitlab_lib.core.TMP_DIR)
+    backup_dir = os.path.join(checkout_dir.name, os.path.basename(args.backup_dir.rstrip("/")))
+    gitlab_lib.log("Checking out %s from the chunk store to %s" % (args.backup_dir, backup_dir))
+    gitlab_lib.chunkstore.checkout(args.backup_dir, backup_dir)
+    args.backup_dir = backup_dir
+
 if not os.path.exists(os.path.join(args.backup_dir, "project.json")):
     gitlab_lib.log(args.backup_dir + " does not look like a projects backup dir. No project.json file found!")
     sys.exit(1)
@@ -149,17 +167,20 @@ if not project_data:
 # Restore repository and wiki
 if args.repository and not args.component:
     old_project_name = os.path.basename(args.backup_dir.rstrip("/")).split("_")[2]
-    backup_archive = os.path.join(args.backup_dir, old_project_name + ".git.tgz")
 
-    if os.path.exists(backup_archive):
-        gitlab_lib.log("Restoring repository " + backup_archive)
-        gitlab_lib.restore_repository(backup_archive, args.repository, args.project, ".git", args.archive)
+    # archives of any codec, bundle chain backups have a directory of bundles
+    for (suffix, archive) in ((".git", args.archive), (".wiki.git", False)):
+        for extension in (".tgz", ".tar.zst", ".tar", ".bundle", ".bundles"):
+            backup_archive = os.path.join(args.backup_dir, old_project_name + suffix + extension)
 
-    backup_archive = os.path.join(args.backup_dir, old_project_name + ".wiki.git.tgz")
+            if os.path.exists(backup_archive):
+                gitlab_lib.log("Restoring repository " + backup_archive)
+                gitlab_lib.restore_repository(backup_archive, args.repository, args.project, suffix, archive)
+                break
 
-    if os.path.exists(backup_archive):
-        gitlab_lib.log("Restoring repository " + backup_archive)
-        gitlab_lib.restore_repository(backup_archive, args.repository, args.project, ".wiki.git")
+# spawn some processes to do the actual restore while the dumps are read
+for process in range(int(args.number)):
+    processes.append( gitlab_lib.create_process(gitlab_lib.restore, (args.backup_dir, project_data, work_queue)) )
 
 # Restore only one component?
 if args.component:
@@ -172,13 +193,12 @@ else:
 
     fill_restore_queue(project_data, "issues")
 
-# spawn some processes to do the actual restore
-nr_of_processes = int(args.number)
+# tell every process there is nothing left
+for process in processes:
+    queue_entry(None)
 
-if work_queue.qsize() < nr_of_processes:
-    nr_of_processes = work_queue.qsize()
-
-for process in range(nr_of_processes):
-    processes.append( gitlab_lib.create_process(gitlab_lib.restore, (args.backup_dir, project_data, work_queue)) )
+# restore processes are daemons and would be killed on exit
+for process in processes:
+    process.join()
 
 sys.exit(0)
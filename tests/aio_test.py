@@ -0,0 +1,34 @@
+import asyncio
+import unittest
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+class AioTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base_url) = mockgitlab.start_mock(latency=0.1, projects=2, users=1, groups=1)
+        self.api_timeout = gitlab_lib.core.API_TIMEOUT
+
+    def tearDown(self):
+        gitlab_lib.core.API_TIMEOUT = self.api_timeout
+        self.server.shutdown()
+
+    def test_more_requests_than_connections(self):
+        # 80 requests over 4 connections take about 2s, each one 0.1s
+        gitlab_lib.core.API_TIMEOUT = 1
+
+        async def main():
+            try:
+                return await gitlab_lib.aio.fetch_all(["%s/projects/1" % (self.base_url,)] * 80, limit_per_host=4)
+            finally:
+                await gitlab_lib.aio.close_session()
+
+        results = asyncio.run(main())
+        self.assertEqual([x["id"] for x in results], [1] * 80)
+        self.assertEqual(self.server.request_counts["GET"], 80)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+class AttachmentTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, base_url) = mockgitlab.start_mock(projects=1, issues=8, notes=150, latency=0.02)
+        self.backup_module = importlib.import_module("gitlab_lib.backup")
+        self.api_base_url = self.backup_module.API_BASE_URL
+        self.core_module = importlib.import_module("gitlab_lib.core")
+        self.concurrency = self.core_module.ATTACHMENT_CONCURRENCY
+        self.backup_module.API_BASE_URL = base_url
+        self.project = {"id": 1, "name": "project1"}
+        self.output_dirs = []
+
+    def tearDown(self):
+        self.backup_module.API_BASE_URL = self.api_base_url
+        self.core_module.ATTACHMENT_CONCURRENCY = self.concurrency
+        gitlab_lib.close_session()
+        self.server.shutdown()
+
+        for output_dir in self.output_dirs:
+            shutil.rmtree(output_dir)
+
+    def _backup(self, concurrency):
+        self.core_module.ATTACHMENT_CONCURRENCY = concurrency
+        output_dir = tempfile.mkdtemp()
+        self.output_dirs.append(output_dir)
+        start = time.time()
+        gitlab_lib.backup_issues(self.project, output_dir)
+        gitlab_lib.backup_snippets(self.project, output_dir)
+        return (output_dir, time.time() - start)
+
+    def _files(self, output_dir):
+        files = {}
+
+        for filename in os.listdir(output_dir):
+            if filename.endswith(gitlab_lib.ndjson.SUFFIX):
+                files[filename] = list(gitlab_lib.ndjson.iter_dump(output_dir, filename[:-len(gitlab_lib.ndjson.SUFFIX)]))
+                continue
+
+            with open(os.path.join(output_dir, filename)) as f:
+                files[filename] = json.load(f)
+
+        return files
+
+    def test_paginated_notes(self):
+        (output_dir, duration) = self._backup(1)
+        issue = self._files(output_dir)["issues.ndjson"][0]
+
+        with open(os.path.join(output_dir, "issues_%d_notes.dump" % (issue["id"],))) as f:
+            self.assertEqual(len(json.load(f)), 150)
+
+    def test_concurrent_same_files(self):
+        (serial_dir, serial_duration) = self._backup(1)
+        (concurrent_dir, concurrent_duration) = self._backup(4)
+        self.assertEqual(self._files(serial_dir), self._files(concurrent_dir))
+        self.assertLess(concurrent_duration, serial_duration)
+
+    def test_shared_bound(self):
+        # three callers (e.g. backup threads) share the pool of the process
+        self.core_module.ATTACHMENT_CONCURRENCY = 3
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        results = {}
+
+        def call(x):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+
+            time.sleep(0.02)
+
+            with lock:
+                in_flight[0] -= 1
+
+            return x
+
+        def caller(name):
+            results[name] = list(gitlab_lib.fetch_concurrently([(call, x) for x in range(12)]))
+
+        threads = [threading.Thread(target=caller, args=(x,)) for x in range(3)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(in_flight[1], 3)
+        self.assertEqual(results, dict((x, list(range(12))) for x in range(3)))
+
+    def test_nested_calls(self):
+        # a call running in the pool must not wait for a free thread of it
+        self.core_module.ATTACHMENT_CONCURRENCY = 2
+
+        def inner(x):
+            return sum(gitlab_lib.fetch_concurrently([(abs, -y) for y in range(x)]))
+
+        self.assertEqual(list(gitlab_lib.fetch_concurrently([(inner, x) for x in range(6)])),
+                         [sum(range(x)) for x in range(6)])
+
+if __name__ == "__main__":
+    unittest.main()
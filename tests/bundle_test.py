@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import importlib
+import subprocess
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class BundleTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, "source.git")
+        self.work = os.path.join(self.tmp_dir, "work")
+        self.bundle_dir = gitlab_lib.bundle.BUNDLE_DIR
+        self.max_length = gitlab_lib.bundle.CHAIN_MAX_LENGTH
+        gitlab_lib.bundle.enable(os.path.join(self.tmp_dir, "bundles"))
+        self.project = {"id": 1}
+        self._git("init", "-q", "--bare", self.source)
+        self._git("clone", "-q", self.source, self.work)
+        self._commit("first")
+
+    def tearDown(self):
+        gitlab_lib.bundle.BUNDLE_DIR = self.bundle_dir
+        gitlab_lib.bundle.CHAIN_MAX_LENGTH = self.max_length
+        shutil.rmtree(self.tmp_dir)
+
+    def _git(self, *args):
+        return subprocess.check_output(["git", "-c", "user.name=test", "-c", "user.email=test@localhost"] + list(args),
+                                       stderr=subprocess.DEVNULL).decode("utf8")
+
+    def _commit(self, message, branch="master"):
+        with open(os.path.join(self.work, message), "w") as f:
+            f.write(message * 1000)
+
+        self._git("-C", self.work, "add", message)
+        self._git("-C", self.work, "commit", "-q", "-m", message)
+        self._git("-C", self.work, "push", "-q", "origin", "HEAD:" + branch)
+
+    def _append(self):
+        with gitlab_lib.bundle.lock(self.project):
+            return gitlab_lib.bundle.append(self.project, self.source)
+
+    def _replay(self):
+        restored = os.path.join(self.tmp_dir, "restored.git")
+        shutil.rmtree(restored, ignore_errors=True)
+        gitlab_lib.bundle.replay(gitlab_lib.bundle.chain_path(self.project), restored)
+        return restored
+
+    def test_chain(self):
+        chain_dir = self._append()
+        self._commit("second")
+        self._commit("feature", "feature")
+        self._git("-C", self.source, "tag", "-a", "-m", "tag", "v1", "feature")
+        self._append()
+
+        chain = gitlab_lib.bundle.load_chain(chain_dir)
+        self.assertEqual(len(chain), 2)
+
+        # the second bundle only holds the new objects and needs the first one
+        single = os.path.join(self.tmp_dir, "single.git")
+        self._git("init", "-q", "--bare", single)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._git("-C", single, "fetch", "-q", os.path.join(chain_dir, chain[1]["bundle"]), "+refs/*:refs/*")
+
+        # refs changed without new objects
+        self._git("-C", self.source, "branch", "-D", "feature")
+        self._append()
+        chain = gitlab_lib.bundle.load_chain(chain_dir)
+        self.assertEqual(len(chain), 3)
+        self.assertIsNone(chain[2]["bundle"])
+
+        # nothing changed at all
+        self._append()
+        self.assertEqual(len(gitlab_lib.bundle.load_chain(chain_dir)), 3)
+
+        restored = self._replay()
+        self.assertEqual(gitlab_lib.bundle.get_refs(restored), gitlab_lib.bundle.get_refs(self.source))
+        self._git("-C", restored, "fsck", "--no-dangling")
+
+    def test_new_chain_after_max_length(self):
+        gitlab_lib.bundle.CHAIN_MAX_LENGTH = 2
+        chain_dir = self._append()
+        self._commit("second")
+        self._append()
+        self._commit("third")
+        self._append()
+
+        chain = gitlab_lib.bundle.load_chain(chain_dir)
+        self.assertEqual([x["bundle"] for x in chain], ["0000.bundle"])
+        self.assertEqual(gitlab_lib.bundle.get_refs(self._replay()), gitlab_lib.bundle.get_refs(self.source))
+
+    def test_link_chain(self):
+        chain_dir = self._append()
+        dest_dir = os.path.join(self.tmp_dir, "backup", "project.git.bundles")
+        gitlab_lib.bundle.link_chain(chain_dir, dest_dir)
+        self.assertEqual(os.stat(os.path.join(chain_dir, "0000.bundle")).st_ino,
+                         os.stat(os.path.join(dest_dir, "0000.bundle")).st_ino)
+
+    def test_restore_bundle(self):
+        restore_module = importlib.import_module("gitlab_lib.restore")
+        repository_dir = os.path.join(self.tmp_dir, "repositories")
+        bundle_file = os.path.join(self.tmp_dir, "project.git.bundle")
+        os.mkdir(repository_dir)
+        self._git("-C", self.source, "bundle", "create", "-q", bundle_file, "--all")
+
+        with unittest.mock.patch.object(restore_module, "TMP_DIR", self.tmp_dir), \
+             unittest.mock.patch("subprocess.call") as call:
+            gitlab_lib.restore_repository(bundle_file, repository_dir, "project")
+
+            self.assertEqual(self._git("-C", os.path.join(repository_dir, "project.git"), "rev-parse", "refs/heads/master"),
+                             self._git("-C", self.source, "rev-parse", "refs/heads/master"))
+            self.assertEqual(self._git("-C", os.path.join(repository_dir, "project.git"), "remote"), "")
+
+            # a corrupt bundle raises and keeps the restored repository
+            with open(bundle_file, "r+b") as f:
+                f.truncate(os.path.getsize(bundle_file) // 2)
+
+            self.assertRaises(gitlab_lib.exception.CloneError, gitlab_lib.restore_repository, bundle_file, repository_dir, "project")
+            self.assertTrue(os.path.isdir(os.path.join(repository_dir, "project.git", "objects")))
+            self.assertEqual([x for x in os.listdir(self.tmp_dir) if x.startswith("tmp")], [])
+            self.assertEqual(call.call_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
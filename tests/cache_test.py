@@ -0,0 +1,84 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+def fetch_issues(base_url, issues):
+    for iid in issues:
+        gitlab_lib.fetch("%s/projects/1/issues/%d/notes" % (base_url, iid))
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base_url) = mockgitlab.start_mock(projects=1, issues=8, notes=2)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = gitlab_lib.cache.CACHE_DIR
+        gitlab_lib.cache.enable(self.tmp_dir)
+        self.url = "%s/projects/1/issues" % (self.base_url,)
+
+    def tearDown(self):
+        gitlab_lib.cache.CACHE_DIR = self.cache_dir
+        gitlab_lib.close_session()
+        self.server.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _cache_file(self):
+        files = [os.path.join(path, x) for (path, dirs, files) in os.walk(self.tmp_dir) for x in files]
+        self.assertEqual(len(files), 1)
+        return files[0]
+
+    def test_not_modified(self):
+        issues = gitlab_lib.fetch(self.url)
+        self.assertEqual(gitlab_lib.cache.get_stats()["misses"], 1)
+
+        # mark the cached body, a 304 must return it instead of a new download
+        cache_file = self._cache_file()
+
+        with open(cache_file, "rb") as f:
+            entry = pickle.load(f)
+
+        entry["data"] = entry["data"][:1]
+
+        with open(cache_file, "wb") as f:
+            pickle.dump(entry, f)
+
+        self.assertEqual(gitlab_lib.fetch(self.url), issues[:1])
+        self.assertEqual(gitlab_lib.cache.get_stats()["hits"], 1)
+
+    def test_changed_etag(self):
+        gitlab_lib.fetch(self.url)
+        etag = gitlab_lib.cache.lookup(self.url, gitlab_lib.core.TOKEN)["etag"]
+        gitlab_lib.put(self.url + "/2", {"title": "Changed"})
+
+        issues = gitlab_lib.fetch(self.url)
+        entry = gitlab_lib.cache.lookup(self.url, gitlab_lib.core.TOKEN)
+        self.assertNotEqual(entry["etag"], etag)
+        self.assertEqual(entry["data"], issues)
+        self.assertIn("Changed", [x["title"] for x in issues])
+        self.assertEqual((gitlab_lib.cache.get_stats()["hits"], gitlab_lib.cache.get_stats()["misses"]), (0, 2))
+        self._cache_file()
+
+    def test_shared_counters(self):
+        # every process fetches the notes of all issues twice
+        processes = [multiprocessing.Process(target=fetch_issues, args=(self.base_url, list(range(1, 9)) * 2)) for x in range(4)]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        stats = gitlab_lib.cache.get_stats()
+        self.assertEqual(stats["hits"] + stats["misses"], 4 * 16)
+        self.assertGreaterEqual(stats["hits"], 4 * 8)
+        self.assertEqual(stats["size"], sum([os.path.getsize(os.path.join(path, x)) for (path, dirs, files) in os.walk(self.tmp_dir) for x in files]))
+
+if __name__ == "__main__":
+    unittest.main()
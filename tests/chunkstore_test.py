@@ -0,0 +1,91 @@
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class ChunkstoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = gitlab_lib.chunkstore.STORE_DIR
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+        self.data = random.Random(1).getrandbits(8 * 2 * 1024 * 1024).to_bytes(2 * 1024 * 1024, "little")
+
+    def tearDown(self):
+        gitlab_lib.chunkstore.STORE_DIR = self.store_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def _store(self, data, name):
+        os.makedirs(os.path.join(self.tmp_dir, "backup"), exist_ok=True)
+        return gitlab_lib.chunkstore.store_data(data, os.path.join(self.tmp_dir, "backup", name + ".chunks"))
+
+    def test_content_defined_chunks(self):
+        recipe = self._store(self.data, "first")
+        self.assertEqual(recipe["size"], len(self.data))
+        self.assertEqual(recipe["new_chunks"], len(recipe["chunks"]))
+        self.assertTrue(all([x[1] <= gitlab_lib.chunkstore.CHUNK_MAX_SIZE for x in recipe["chunks"]]))
+
+        # inserting data only changes the chunk around it
+        shifted = self._store(self.data[:100000] + b"inserted" + self.data[100000:], "shifted")
+        self.assertEqual(shifted["new_chunks"], 1)
+        self.assertEqual(b"".join(gitlab_lib.chunkstore.iter_data(os.path.join(self.tmp_dir, "backup", "shifted.chunks"))),
+                         self.data[:100000] + b"inserted" + self.data[100000:])
+
+    def test_store_directory(self):
+        src_dir = os.path.join(self.tmp_dir, "src")
+        os.mkdir(src_dir)
+
+        with open(os.path.join(src_dir, "data"), "wb") as f:
+            f.write(self.data)
+
+        gitlab_lib.chunkstore.store_directory(src_dir, os.path.join(self.tmp_dir, "src.tar.chunks"))
+        gitlab_lib.chunkstore.extract(os.path.join(self.tmp_dir, "src.tar.chunks"), os.path.join(self.tmp_dir, "src.tar"))
+
+        with tarfile.open(os.path.join(self.tmp_dir, "src.tar")) as tar:
+            self.assertEqual(tar.extractfile("./data").read(), self.data)
+
+    def _chunk_files(self):
+        return sorted([x for (path, dirs, files) in os.walk(os.path.join(self.tmp_dir, "store", "chunks")) for x in files])
+
+    def test_abort(self):
+        kept = self._store(self.data[:1024 * 1024], "kept")
+        writer = gitlab_lib.chunkstore.Writer(os.path.join(self.tmp_dir, "backup", "aborted.chunks"))
+        writer.write(self.data)
+        writer.abort()
+
+        # only the chunks of the complete recipe are left
+        self.assertEqual(self._chunk_files(), sorted(set([x[0] for x in kept["chunks"]])))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "backup", "aborted.chunks")))
+
+    def test_commit_and_collect_garbage(self):
+        first = self._store(self.data, "project.json")
+        stats = gitlab_lib.chunkstore.commit(os.path.join(self.tmp_dir, "backup"))
+        self.assertEqual(stats["snapshots"], 1)
+        self.assertEqual(stats["run_size"], len(self.data))
+        self.assertEqual(stats["chunks"], first["new_chunks"])
+
+        # same data again is stored once
+        second = self._store(self.data, "project.json")
+        self.assertEqual(second["new_chunks"], 0)
+        gitlab_lib.chunkstore.commit(os.path.join(self.tmp_dir, "backup"))
+
+        # the third run has other data, only its chunks survive
+        self._store(b"{}" * 100, "project.json")
+        stats = gitlab_lib.chunkstore.commit(os.path.join(self.tmp_dir, "backup"))
+        self.assertEqual(stats["snapshots"], 3)
+        self.assertEqual(gitlab_lib.chunkstore.collect_garbage(keep=1, grace_period=0)[:2], (2, len(second["chunks"])))
+        self.assertEqual(gitlab_lib.chunkstore.store_stats()["chunks"], 1)
+
+        dest_dir = os.path.join(self.tmp_dir, "checkout")
+        gitlab_lib.chunkstore.checkout(os.path.join(self.tmp_dir, "backup"), dest_dir)
+
+        with open(os.path.join(dest_dir, "project.json"), "rb") as f:
+            self.assertEqual(f.read(), b"{}" * 100)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import tarfile
+import unittest
+import unittest.mock
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, "project.git")
+        os.mkdir(self.src_dir)
+
+        with open(os.path.join(self.src_dir, "HEAD"), "w") as f:
+            f.write("ref: refs/heads/master\n" * 100)
+
+    def tearDown(self):
+        gitlab_lib.compression.CODECS.pop("test", None)
+        gitlab_lib.compression.select("gzip")
+        shutil.rmtree(self.tmp_dir)
+
+    def _roundtrip(self, console=False):
+        filename = gitlab_lib.archivate(self.src_dir, self.tmp_dir, console=console)
+        dest_dir = os.path.join(self.tmp_dir, "restored")
+        gitlab_lib.compression.extract(filename, dest_dir)
+
+        with open(os.path.join(dest_dir, "HEAD")) as f:
+            self.assertEqual(f.read(), "ref: refs/heads/master\n" * 100)
+
+        shutil.rmtree(dest_dir)
+        return filename
+
+    def test_codecs(self):
+        for codec in sorted(gitlab_lib.compression.CODECS):
+            try:
+                gitlab_lib.compression.select(codec, 1)
+            except ValueError:
+                continue
+
+            filename = self._roundtrip()
+            self.assertTrue(filename.endswith(gitlab_lib.compression.extension(codec)))
+
+    def test_console_tar(self):
+        self.assertTrue(self._roundtrip(console=True).endswith(".tgz"))
+
+    def _codec(self, compress_cmd):
+        gitlab_lib.compression.CODECS["test"] = (".tar.test", 1, compress_cmd)
+        gitlab_lib.compression.CODEC = "test"
+
+    def _no_children(self):
+        self.assertRaises(ChildProcessError, os.waitpid, -1, os.WNOHANG)
+
+    def test_missing_compressor(self):
+        self._codec(["gitlab-backup-no-such-compressor"])
+        self.assertTrue(self._roundtrip().endswith(".tgz"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "project.git.tar.test")))
+
+    def test_failing_compressor(self):
+        self._codec(["false"])
+        self.assertRaises(gitlab_lib.exception.ArchiveError, gitlab_lib.archivate, self.src_dir, self.tmp_dir)
+        self.assertEqual(os.listdir(self.tmp_dir), ["project.git"])
+        self._no_children()
+
+    def test_failing_tar(self):
+        self._codec(["cat"])
+
+        # the Python tar fails midway, console tar succeeds
+        with unittest.mock.patch.object(tarfile.TarFile, "add", side_effect=tarfile.TarError("disk full")):
+            self.assertTrue(self._roundtrip().endswith(".tar.test"))
+
+        self._no_children()
+
+    def test_select(self):
+        self.assertEqual(gitlab_lib.compression.parse("zstd:19"), ("zstd", 19))
+        self.assertRaises(ValueError, gitlab_lib.compression.select, "lzma")
+        self.assertRaises(ValueError, gitlab_lib.compression.select, "gzip", 10)
+        self.assertRaises(ValueError, gitlab_lib.compression.select, "zstd", 23)
+
+    @unittest.skipUnless(gitlab_lib.compression.is_available("zstd"), "zstd is not installed")
+    def test_zstd_ultra(self):
+        gitlab_lib.compression.select("zstd", 19)
+        self.assertNotIn("--ultra", gitlab_lib.compression.command())
+
+        gitlab_lib.compression.select("zstd", 20)
+        self.assertIn("--ultra", gitlab_lib.compression.command())
+        self.assertIn("--ultra", " ".join(gitlab_lib.compression.tar_command("test.tar.zst", ".")))
+        self._roundtrip()
+
+if __name__ == "__main__":
+    unittest.main()
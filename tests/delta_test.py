@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import importlib
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base_url) = mockgitlab.start_mock(projects=1, issues=30, notes=5)
+        self.backup_module = importlib.import_module("gitlab_lib.backup")
+        self.api_base_url = self.backup_module.API_BASE_URL
+        self.graphql_url = gitlab_lib.graphql.GRAPHQL_URL
+        self.backup_module.API_BASE_URL = self.base_url
+        gitlab_lib.graphql.GRAPHQL_URL = self.base_url.replace("/api/v4", "/api/graphql")
+        self.project = dict(self.server.store.projects[1])
+        self.output_dirs = []
+
+    def tearDown(self):
+        self.backup_module.API_BASE_URL = self.api_base_url
+        gitlab_lib.graphql.GRAPHQL_URL = self.graphql_url
+        gitlab_lib.close_session()
+        self.server.shutdown()
+
+        for output_dir in self.output_dirs:
+            shutil.rmtree(output_dir)
+
+    def _backup(self, previous_dir=None, since=None, output_dir=None):
+        project = dict(self.project)
+
+        if previous_dir:
+            project["delta"] = {"dir": previous_dir, "since": since}
+
+        if not output_dir:
+            output_dir = tempfile.mkdtemp()
+            self.output_dirs.append(output_dir)
+
+        requests = self.server.request_counts["GET"] + self.server.request_counts["POST"]
+        gitlab_lib.backup_issues(project, output_dir)
+        gitlab_lib.backup_merge_requests(project, output_dir)
+
+        return (output_dir, self.server.request_counts["GET"] + self.server.request_counts["POST"] - requests)
+
+    def _files(self, output_dir):
+        files = {}
+
+        for filename in os.listdir(output_dir):
+            # the mock lists oldest first, delta sync newest first
+            if filename.endswith(gitlab_lib.ndjson.SUFFIX):
+                files[filename] = sorted(gitlab_lib.ndjson.iter_dump(output_dir, filename[:-len(gitlab_lib.ndjson.SUFFIX)]), key=lambda x: x["id"])
+                continue
+
+            with open(os.path.join(output_dir, filename)) as f:
+                files[filename] = json.load(f)
+
+        return files
+
+    def _change_issues(self):
+        since = gitlab_lib.incremental.utc_timestamp()
+        time.sleep(1)
+        api_url = "%s/projects/1/issues" % (self.base_url,)
+        gitlab_lib.post(api_url + "/3/notes", {"body": "New note"})
+        gitlab_lib.put(api_url + "/4", {"title": "New title"})
+        gitlab_lib.delete(api_url + "/5")
+        gitlab_lib.post(api_url, {"title": "New issue"})
+        return since
+
+    def test_same_as_full_backup(self):
+        (previous_dir, full_requests) = self._backup()
+        since = self._change_issues()
+        (delta_dir, delta_requests) = self._backup(previous_dir, since)
+        (full_dir, full_requests) = self._backup()
+        self.assertEqual(self._files(delta_dir), self._files(full_dir))
+        self.assertLess(delta_requests * 4, full_requests)
+
+    def test_same_directory(self):
+        (output_dir, full_requests) = self._backup()
+        issue_id = [x for x in self._files(output_dir)["issues.ndjson"] if x["iid"] == 5][0]["id"]
+        since = self._change_issues()
+        self._backup(output_dir, since, output_dir)
+        (full_dir, full_requests) = self._backup()
+        self.assertEqual(self._files(output_dir), self._files(full_dir))
+        self.assertFalse(os.path.exists(os.path.join(output_dir, "issues_%d_notes.dump" % (issue_id,))))
+
+    def test_no_previous_dump(self):
+        empty_dir = tempfile.mkdtemp()
+        self.output_dirs.append(empty_dir)
+        (delta_dir, delta_requests) = self._backup(empty_dir, gitlab_lib.incremental.utc_timestamp())
+        (full_dir, full_requests) = self._backup()
+        self.assertEqual(self._files(delta_dir), self._files(full_dir))
+
+if __name__ == "__main__":
+    unittest.main()
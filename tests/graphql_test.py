@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import importlib
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import standin
+
+class GraphQLTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, base_url) = standin.start_server(project_size={"issues": 12, "notes_per_issue": 3})
+        self.backup_module = importlib.import_module("gitlab_lib.backup")
+        self.api_base_url = self.backup_module.API_BASE_URL
+        self.graphql_url = gitlab_lib.graphql.GRAPHQL_URL
+        self.backup_module.API_BASE_URL = base_url
+        gitlab_lib.graphql.GRAPHQL_URL = base_url.replace("/api/v4", "/api/graphql")
+        self.project = {"id": 1,
+                        "name": "project1",
+                        "path_with_namespace": standin.PROJECT_PATH % (1,),
+                        "issues_enabled": True,
+                        "merge_requests_enabled": True}
+        self.output_dirs = []
+
+    def tearDown(self):
+        self.backup_module.API_BASE_URL = self.api_base_url
+        gitlab_lib.graphql.GRAPHQL_URL = self.graphql_url
+        gitlab_lib.close_session()
+        self.server.shutdown()
+
+        for output_dir in self.output_dirs:
+            shutil.rmtree(output_dir)
+
+    def _backup(self, use_graphql):
+        output_dir = tempfile.mkdtemp()
+        self.output_dirs.append(output_dir)
+        gitlab_lib.backup_metadata(self.project, output_dir, use_graphql)
+        return output_dir
+
+    def test_global_id_to_id(self):
+        self.assertEqual(gitlab_lib.graphql.global_id_to_id("gid://gitlab/Issue/23"), 23)
+
+    def test_same_files_as_rest(self):
+        rest_dir = self._backup(False)
+        graphql_dir = self._backup(True)
+        self.assertEqual(sorted(os.listdir(rest_dir)), sorted(os.listdir(graphql_dir)))
+
+        for component in gitlab_lib.graphql.COMPONENTS:
+            rest_data = list(gitlab_lib.ndjson.iter_dump(rest_dir, component))
+            graphql_data = list(gitlab_lib.ndjson.iter_dump(graphql_dir, component))
+
+            self.assertEqual(rest_data, graphql_data, "Component " + component)
+
+        with open(os.path.join(rest_dir, "issues_100001_notes.dump")) as f:
+            rest_notes = json.load(f)
+
+        with open(os.path.join(graphql_dir, "issues_100001_notes.dump")) as f:
+            self.assertEqual(rest_notes, json.load(f))
+
+    def test_fewer_requests(self):
+        self._backup(False)
+        rest_requests = sum(self.server.request_counts.values())
+        self.server.request_counts.clear()
+        self._backup(True)
+        self.assertLess(sum(self.server.request_counts.values()), rest_requests)
+
+    def test_complexity_limit(self):
+        self.server.shutdown()
+        (self.server, base_url) = standin.start_server(project_size={"issues": 30, "notes_per_issue": 25}, max_complexity=5000)
+        self.backup_module.API_BASE_URL = base_url
+        gitlab_lib.graphql.GRAPHQL_URL = base_url.replace("/api/v4", "/api/graphql")
+        page_sizes = gitlab_lib.graphql.__dict__["__page_sizes"]
+        page_sizes.clear()
+
+        try:
+            rest_dir = self._backup(False)
+            graphql_dir = self._backup(True)
+            self.assertEqual(page_sizes, {gitlab_lib.graphql.ISSUES_QUERY: 12})
+
+            for filename in os.listdir(rest_dir):
+                if filename.endswith(".dump"):
+                    with open(os.path.join(rest_dir, filename)) as rest, open(os.path.join(graphql_dir, filename)) as graphql:
+                        self.assertEqual(json.load(rest), json.load(graphql), filename)
+
+            self.assertEqual(list(gitlab_lib.ndjson.iter_dump(rest_dir, "issues")), list(gitlab_lib.ndjson.iter_dump(graphql_dir, "issues")))
+
+            # too complex even for one issue per page
+            self.server.max_complexity = 300
+            page_sizes.clear()
+
+            with self.assertRaises(gitlab_lib.exception.APIError) as context:
+                list(gitlab_lib.graphql.get_issues(self.project))
+
+            self.assertIn("exceeds max complexity of 300", str(context.exception))
+        finally:
+            page_sizes.clear()
+
+    def test_error_path(self):
+        format_error = gitlab_lib.graphql.__dict__["__format_error"]
+        self.assertEqual(format_error({"message": "Timeout", "path": ["project", "issues", "nodes", 3, "notes"]}),
+                         "Timeout at project.issues.nodes.3.notes")
+
+if __name__ == "__main__":
+    unittest.main()
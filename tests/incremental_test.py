@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        (self.server, base_url) = mockgitlab.start_mock(projects=6, users=3, groups=2)
+        self.projects_module = importlib.import_module("gitlab_lib.projects")
+        self.api_base_url = self.projects_module.API_BASE_URL
+        self.projects_module.API_BASE_URL = base_url
+        self.previous_dir = tempfile.mkdtemp()
+        self.backup_dir = tempfile.mkdtemp()
+        self.repository_dir = tempfile.mkdtemp()
+        self.manifest = gitlab_lib.incremental.new_manifest()
+
+        for project in self.server.store.projects.values():
+            os.mkdir(os.path.join(self.previous_dir, gitlab_lib.project_dir_name(project)))
+            gitlab_lib.dump(project, os.path.join(self.previous_dir, gitlab_lib.project_dir_name(project)), "project.json")
+            self.manifest["projects"][str(project["id"])] = gitlab_lib.incremental.make_entry(project, self.previous_dir, self.repository_dir)
+
+    def tearDown(self):
+        self.projects_module.API_BASE_URL = self.api_base_url
+        gitlab_lib.close_session()
+        self.server.shutdown()
+
+        for directory in (self.previous_dir, self.backup_dir, self.repository_dir):
+            shutil.rmtree(directory)
+
+    def _changed_ids(self):
+        (changed, unchanged) = gitlab_lib.incremental.changed_projects(self.manifest, self.previous_dir, self.repository_dir)
+        self.assertEqual(len(changed) + len(unchanged), len(self.manifest["projects"]))
+        return sorted([x["id"] for x in changed])
+
+    def test_nothing_changed(self):
+        self.assertEqual(self._changed_ids(), [])
+
+    def test_last_activity(self):
+        self.server.store.projects[2]["last_activity_at"] = self.manifest["started_at"]
+        self.assertEqual(self._changed_ids(), [2])
+
+    def test_failed_and_missing(self):
+        self.manifest["projects"]["3"]["failed"] = True
+        shutil.rmtree(os.path.join(self.previous_dir, self.manifest["projects"]["4"]["dir"]))
+        self.assertEqual(self._changed_ids(), [3, 4])
+
+    def test_refs_changed(self):
+        project = self.server.store.projects[5]
+        repo_dir = os.path.join(self.repository_dir, project["namespace"]["name"], project["name"] + ".git")
+        os.makedirs(os.path.join(repo_dir, "refs", "heads"))
+
+        with open(os.path.join(repo_dir, "refs", "heads", "master"), "w") as f:
+            f.write("1" * 40 + "\n")
+
+        self.manifest["projects"]["5"] = gitlab_lib.incremental.make_entry(project, self.previous_dir, self.repository_dir)
+        self.assertEqual(self._changed_ids(), [])
+
+        with open(os.path.join(repo_dir, "refs", "heads", "master"), "w") as f:
+            f.write("2" * 40 + "\n")
+
+        self.assertEqual(self._changed_ids(), [5])
+
+    def test_carry_over_hardlinks(self):
+        entry = self.manifest["projects"]["1"]
+        gitlab_lib.incremental.carry_over(entry, self.previous_dir, self.backup_dir)
+        src = os.path.join(self.previous_dir, entry["dir"], "project.json")
+        dest = os.path.join(self.backup_dir, entry["dir"], "project.json")
+        self.assertEqual(os.stat(src).st_ino, os.stat(dest).st_ino)
+
+    def test_rewrite_after_carry_over(self):
+        # a later in-place run must not change the files of the run they were linked from
+        entry = self.manifest["projects"]["1"]
+        previous_project_dir = os.path.join(self.previous_dir, entry["dir"])
+        project_dir = os.path.join(self.backup_dir, entry["dir"])
+        upload_dir = os.path.join(self.repository_dir, "uploads")
+        os.mkdir(upload_dir)
+
+        with open(os.path.join(upload_dir, "file.txt"), "w") as f:
+            f.write("old")
+
+        archive = gitlab_lib.archivate(upload_dir, previous_project_dir, codec="gzip")
+        gitlab_lib.incremental.carry_over(entry, self.previous_dir, self.backup_dir)
+        src_files = dict((x, os.stat(os.path.join(previous_project_dir, x))) for x in ("project.json", os.path.basename(archive)))
+
+        with open(os.path.join(upload_dir, "file.txt"), "w") as f:
+            f.write("new")
+
+        gitlab_lib.dump({"id": 1, "changed": True}, project_dir, "project.json")
+        gitlab_lib.archivate(upload_dir, project_dir, codec="gzip")
+
+        for (name, stat) in src_files.items():
+            self.assertEqual(os.stat(os.path.join(previous_project_dir, name)).st_ino, stat.st_ino)
+            self.assertEqual(os.stat(os.path.join(previous_project_dir, name)).st_mtime_ns, stat.st_mtime_ns)
+            self.assertNotEqual(os.stat(os.path.join(project_dir, name)).st_ino, stat.st_ino)
+
+        self.assertNotIn("changed", gitlab_lib.parse_json(os.path.join(previous_project_dir, "project.json")))
+
+    def test_prepare_delta(self):
+        self.manifest["projects"]["3"]["failed"] = True
+        projects = [dict(self.server.store.projects[x]) for x in (1, 3)]
+
+        for project in projects:
+            gitlab_lib.incremental.prepare_delta(project, self.manifest, self.previous_dir)
+
+        self.assertEqual(projects[0]["delta"]["dir"], os.path.join(self.previous_dir, self.manifest["projects"]["1"]["dir"]))
+        self.assertLess(projects[0]["delta"]["since"], self.manifest["started_at"])
+        self.assertNotIn("delta", projects[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+import importlib
+import subprocess
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class LocalCloneTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repository_dir = os.path.join(self.tmp_dir, "repositories")
+        self.output_dir = os.path.join(self.tmp_dir, "output")
+        os.makedirs(os.path.join(self.repository_dir, "group"))
+        os.mkdir(self.output_dir)
+        repo_dir = os.path.join(self.repository_dir, "group", "project.git")
+        subprocess.check_call(["git", "init", "-q", "--bare", repo_dir])
+        commit = subprocess.check_output(["git", "-c", "user.name=test", "-c", "user.email=test@localhost", "-C", repo_dir,
+                                          "commit-tree", "-m", "first", "4b825dc642cb6eb9a060e54bf8d69288fbee4904"])
+        subprocess.check_call(["git", "-C", repo_dir, "update-ref", "refs/heads/master", commit.decode("utf8").strip()])
+
+        # nothing listens there, only the local clone can succeed
+        self.project = {"id": 1,
+                        "name": "project",
+                        "namespace": {"name": "group"},
+                        "http_url_to_repo": "https://localhost:1/group/project.git"}
+        self.backup_module = importlib.import_module("gitlab_lib.backup")
+        self.clone_from_disk = self.backup_module.CLONE_FROM_DISK
+        self.stream_repositories = self.backup_module.STREAM_REPOSITORIES
+        self.mirror_dir = gitlab_lib.mirror.MIRROR_DIR
+        self.bundle_dir = gitlab_lib.bundle.BUNDLE_DIR
+        self.store_dir = gitlab_lib.chunkstore.STORE_DIR
+        self.git_timeout = self.backup_module.GIT_TIMEOUT
+        self.backup_module.CLONE_FROM_DISK = True
+
+    def tearDown(self):
+        self.backup_module.CLONE_FROM_DISK = self.clone_from_disk
+        self.backup_module.STREAM_REPOSITORIES = self.stream_repositories
+        gitlab_lib.mirror.MIRROR_DIR = self.mirror_dir
+        gitlab_lib.bundle.BUNDLE_DIR = self.bundle_dir
+        gitlab_lib.chunkstore.STORE_DIR = self.store_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def _archived_refs(self):
+        with tarfile.open(os.path.join(self.output_dir, "project.git.tgz")) as tar:
+            return [x for x in tar.getnames() if x.startswith("./refs/heads/") or x == "./packed-refs"]
+
+    def test_clone_from_disk(self):
+        gitlab_lib.backup_repository(self.project, self.output_dir, self.repository_dir, self.tmp_dir)
+        self.assertTrue(self._archived_refs())
+
+    def test_mirror_from_disk(self):
+        gitlab_lib.mirror.enable(os.path.join(self.tmp_dir, "mirrors"))
+        gitlab_lib.backup_repository(self.project, self.output_dir, self.repository_dir, self.tmp_dir)
+        self.assertTrue(self._archived_refs())
+
+    def test_bundle_from_disk(self):
+        gitlab_lib.bundle.enable(os.path.join(self.tmp_dir, "bundles"))
+        gitlab_lib.backup_repository(self.project, self.output_dir, self.repository_dir, self.tmp_dir)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output_dir, "project.git.bundles"))), ["0000.bundle", "chain.json"])
+
+    def test_stream_repository(self):
+        self.backup_module.STREAM_REPOSITORIES = True
+        gitlab_lib.backup_repository(self.project, self.output_dir, self.repository_dir, self.tmp_dir)
+        self.assertEqual(os.listdir(self.output_dir), ["project.git.bundle"])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "backup")))
+
+        clone_dir = os.path.join(self.tmp_dir, "clone.git")
+        subprocess.check_call(["git", "clone", "-q", "--mirror", os.path.join(self.output_dir, "project.git.bundle"), clone_dir])
+        self.assertEqual(subprocess.check_output(["git", "-C", clone_dir, "rev-parse", "master"]),
+                         subprocess.check_output(["git", "-C", os.path.join(self.repository_dir, "group", "project.git"), "rev-parse", "master"]))
+
+    def test_stream_empty_repository(self):
+        self.backup_module.STREAM_REPOSITORIES = True
+        subprocess.check_call(["git", "-C", os.path.join(self.repository_dir, "group", "project.git"), "update-ref", "-d", "refs/heads/master"])
+        self.assertIsNone(gitlab_lib.stream_repository(self.project, os.path.join(self.repository_dir, "group", "project.git"), self.output_dir))
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_stream_to_chunk_store(self):
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+        repo_dir = os.path.join(self.repository_dir, "group", "project.git")
+        self.assertTrue(gitlab_lib.stream_repository(self.project, repo_dir, self.output_dir))
+
+        # a failing git and an empty repository leave no recipe and no chunks
+        shutil.rmtree(os.path.join(self.tmp_dir, "store"))
+        os.unlink(os.path.join(self.output_dir, "project.git.bundle.chunks"))
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+        popen = subprocess.Popen
+        failing_git = lambda cmd, **kwargs: popen(["sh", "-c", "head -c 1000000 /dev/urandom; echo fatal: pack-objects died >&2; exit 1"], **kwargs)
+
+        with unittest.mock.patch("subprocess.Popen", side_effect=failing_git):
+            self.assertRaises(gitlab_lib.exception.CloneError, gitlab_lib.stream_repository, self.project, repo_dir, self.output_dir)
+
+        self.assertEqual([x for (path, dirs, files) in os.walk(os.path.join(self.tmp_dir, "store", "chunks")) for x in files], [])
+
+        subprocess.check_call(["git", "-C", repo_dir, "update-ref", "-d", "refs/heads/master"])
+        self.assertIsNone(gitlab_lib.stream_repository(self.project, repo_dir, self.output_dir))
+        self.assertEqual(os.listdir(self.output_dir), [])
+        self.assertEqual([x for (path, dirs, files) in os.walk(os.path.join(self.tmp_dir, "store", "chunks")) for x in files], [])
+
+    def test_stream_timeout(self):
+        self.backup_module.GIT_TIMEOUT = 0
+
+        try:
+            self.assertRaises(gitlab_lib.exception.CloneError, gitlab_lib.stream_repository,
+                              self.project, os.path.join(self.repository_dir, "group", "project.git"), self.output_dir)
+        finally:
+            self.backup_module.GIT_TIMEOUT = self.git_timeout
+
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_stream_stalled_git(self):
+        # git stops writing into the chunk store: the read must not block forever
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+        self.backup_module.GIT_TIMEOUT = 1
+        popen = subprocess.Popen
+        stalled_git = lambda cmd, **kwargs: popen(["sh", "-c", "head -c 100000 /dev/urandom; exec sleep 60"], **kwargs)
+        start = time.time()
+
+        try:
+            with unittest.mock.patch("subprocess.Popen", side_effect=stalled_git):
+                self.assertRaisesRegex(gitlab_lib.exception.CloneError, "timed out", gitlab_lib.stream_repository,
+                                       self.project, os.path.join(self.repository_dir, "group", "project.git"), self.output_dir)
+        finally:
+            self.backup_module.GIT_TIMEOUT = self.git_timeout
+
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(os.listdir(self.output_dir), [])
+        self.assertEqual([x for (path, dirs, files) in os.walk(os.path.join(self.tmp_dir, "store", "chunks")) for x in files], [])
+
+    def test_https_fallback(self):
+        shutil.rmtree(os.path.join(self.repository_dir, "group", "project.git", "objects"))
+
+        with self.assertRaises(gitlab_lib.exception.CloneError):
+            gitlab_lib.backup_repository(self.project, self.output_dir, self.repository_dir, self.tmp_dir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import multiprocessing
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+def log_records(worker, count):
+    with gitlab_lib.logqueue.context(project=worker):
+        for i in range(count):
+            gitlab_lib.log("worker %d record %d", worker, i)
+
+        gitlab_lib.error("worker %d failed", worker)
+
+class LogqueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.error_log = os.path.join(self.tmp_dir, "error.log")
+        self.stdout = io.StringIO()
+        patches = [unittest.mock.patch.object(gitlab_lib.logqueue, "ERROR_LOG", self.error_log),
+                   unittest.mock.patch.object(gitlab_lib.logqueue, "LOG_ERRORS", True),
+                   unittest.mock.patch("sys.stdout", self.stdout)]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        gitlab_lib.logqueue.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_child_processes(self):
+        gitlab_lib.logqueue.start()
+        writer = gitlab_lib.logqueue.__dict__["__writer"]
+        processes = [multiprocessing.Process(target=log_records, args=(x, 2000)) for x in range(4)]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        # records logged right before stop are written, too
+        for i in range(1000):
+            gitlab_lib.log("parent record %d", i)
+
+        gitlab_lib.logqueue.stop()
+        self.assertFalse(writer.is_alive())
+        self.assertFalse(gitlab_lib.logqueue.is_enabled())
+
+        lines = self.stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 4 * 2001 + 1000)
+
+        for worker in range(4):
+            self.assertEqual([x for x in lines if ("worker %d " % (worker,)) in x],
+                             ["worker %d record %d" % (worker, x) for x in range(2000)] + [">>> ERROR: worker %d failed" % (worker,)])
+
+        self.assertEqual(lines[-1000:], ["parent record %d" % (x,) for x in range(1000)])
+
+        with open(self.error_log) as f:
+            self.assertEqual(sorted([x.split("] ", 1)[1] for x in f.read().splitlines()]),
+                             ["[%d] worker %d failed" % (x, x) for x in range(4)])
+
+    def test_without_queue(self):
+        gitlab_lib.log("direct %s", "record")
+        self.assertEqual(self.stdout.getvalue(), "direct record\n")
+
+if __name__ == "__main__":
+    unittest.main()
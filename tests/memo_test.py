@@ -0,0 +1,150 @@
+import time
+import threading
+import unittest
+import unittest.mock
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class MemoTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.now = 1000.0
+
+    def _lookup(self, name):
+        self.calls.append(name)
+        return {"name": name}
+
+    def _memo(self, ttl=60, maxsize=10):
+        return gitlab_lib.memo.Memoized(self._lookup, ttl, maxsize)
+
+    def test_ttl(self):
+        lookup = self._memo(ttl=60)
+
+        with unittest.mock.patch("gitlab_lib.memo.time.time", side_effect=lambda: self.now):
+            self.assertEqual(lookup("a"), {"name": "a"})
+            self.now += 59
+            lookup("a")
+            self.now += 2
+            lookup("a")
+
+        self.assertEqual(self.calls, ["a", "a"])
+        self.assertEqual((lookup.hits, lookup.misses), (1, 2))
+
+    def test_lru(self):
+        lookup = self._memo(maxsize=2)
+
+        for name in ("a", "b", "a", "c", "a", "b"):
+            lookup(name)
+
+        # a was used after b, so c dropped b
+        self.assertEqual(self.calls, ["a", "b", "c", "b"])
+        self.assertEqual(list(lookup.entries), [(("a",), ()), (("b",), ())])
+
+    def test_copies(self):
+        lookup = self._memo()
+        lookup("a")["name"] = "changed"
+        self.assertEqual(lookup("a"), {"name": "a"})
+
+    def test_empty_results(self):
+        lookup = gitlab_lib.memo.Memoized(lambda name: self.calls.append(name) or [], 60, 10)
+        lookup("unknown")
+        lookup("unknown")
+        self.assertEqual(self.calls, ["unknown", "unknown"])
+
+    def _blocking_memo(self, error=None):
+        self.release = threading.Event()
+
+        def lookup(name):
+            self.calls.append(name)
+            self.release.wait(5)
+
+            if error:
+                raise error
+
+            return {"name": name, "call": len(self.calls)}
+
+        return gitlab_lib.memo.Memoized(lookup, 60, 10)
+
+    def _call_concurrently(self, memo, threads, waiting):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(memo("a"))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for x in range(threads)]
+
+        for thread in threads:
+            thread.start()
+
+        # let all threads reach the memo before the lookup returns
+        deadline = time.time() + 5
+
+        while memo.coalesced < waiting and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.release.set()
+
+        for thread in threads:
+            thread.join()
+
+        return (results, errors)
+
+    def test_coalesced(self):
+        memo = self._blocking_memo()
+        (results, errors) = self._call_concurrently(memo, 10, 9)
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual(results, [{"name": "a", "call": 1}] * 10)
+        self.assertEqual((memo.misses, memo.coalesced), (1, 9))
+
+        # the coalesced result is cached too
+        self.assertEqual(memo("a"), {"name": "a", "call": 1})
+        self.assertEqual(self.calls, ["a"])
+
+    def test_coalesced_error(self):
+        memo = self._blocking_memo(error=ValueError("server down"))
+        (results, errors) = self._call_concurrently(memo, 5, 4)
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all([isinstance(x, ValueError) for x in errors]))
+
+        # errors are not cached
+        self.release.set()
+        self.assertRaises(ValueError, memo, "a")
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_clear(self):
+        lookup = self._memo()
+        lookup("a")
+        lookup.clear()
+        lookup("a")
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_clear_during_call(self):
+        memo = self._blocking_memo()
+        thread = threading.Thread(target=memo, args=("a",))
+        thread.start()
+
+        while not self.calls:
+            time.sleep(0.01)
+
+        # the result of the call started before is outdated
+        memo.clear()
+        self.release.set()
+        thread.join()
+        self.assertEqual(memo("a"), {"name": "a", "call": 2})
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_clear_memos(self):
+        self.assertTrue(gitlab_lib.get_user.__module__.endswith("users"))
+        gitlab_lib.get_user.entries[(("test",), ())] = (time.time() + 60, {"id": 1})
+        gitlab_lib.memo.clear_memos()
+        self.assertEqual(len(gitlab_lib.get_user.entries), 0)
+
+if __name__ == "__main__":
+    unittest.main()
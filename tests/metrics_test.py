@@ -0,0 +1,95 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+def child_metrics():
+    gitlab_lib.metrics.inc("gitlab_api_requests_total", {"method": "GET", "endpoint": "/projects", "status": "200"}, 2)
+    gitlab_lib.metrics.observe("gitlab_api_request_duration_seconds", 0.2, {"method": "GET", "endpoint": "/projects"})
+    gitlab_lib.metrics.set_gauge("gitlab_backup_last_run_timestamp_seconds", 20.0)
+    gitlab_lib.metrics.flush()
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = gitlab_lib.metrics.SPOOL_DIR
+        self.tmp_dir = tempfile.mkdtemp()
+        gitlab_lib.metrics.enable(self.tmp_dir)
+
+    def tearDown(self):
+        gitlab_lib.metrics.SPOOL_DIR = self.spool_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dedup_gauges(self):
+        names = ["gitlab_backup_dedup_ratio",
+                 "gitlab_backup_dedup_throughput_bytes_per_second",
+                 "gitlab_backup_dedup_run_bytes",
+                 "gitlab_backup_dedup_written_bytes",
+                 "gitlab_backup_chunk_store_bytes"]
+
+        for (value, name) in enumerate(names):
+            gitlab_lib.metrics.set_gauge(name, value + 1.5)
+
+        lines = gitlab_lib.metrics.render().splitlines()
+
+        for (value, name) in enumerate(names):
+            self.assertIn("# TYPE %s gauge" % (name,), lines)
+            self.assertIn("%s %s" % (name, repr(value + 1.5)), lines)
+
+    def test_merge_processes(self):
+        gitlab_lib.metrics.inc("gitlab_api_requests_total", {"method": "GET", "endpoint": "/projects", "status": "200"})
+        gitlab_lib.metrics.observe("gitlab_api_request_duration_seconds", 0.02, {"method": "GET", "endpoint": "/projects"})
+        gitlab_lib.metrics.set_gauge("gitlab_backup_last_run_timestamp_seconds", 10.0)
+        gitlab_lib.metrics.flush()
+
+        # the child starts with empty metrics and spools its own snapshot
+        for _ in range(2):
+            gitlab_lib.create_process(child_metrics, ()).join()
+
+        self.assertEqual(len(gitlab_lib.core.spool_files(self.tmp_dir, "metrics", ".json")), 3)
+
+        path = os.path.join(self.tmp_dir, "backup.prom")
+        gitlab_lib.metrics.write_textfile(path)
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('gitlab_api_requests_total{endpoint="/projects",method="GET",status="200"} 5', lines)
+        self.assertIn('gitlab_api_request_duration_seconds_count{endpoint="/projects",method="GET"} 3', lines)
+        self.assertIn('gitlab_api_request_duration_seconds_bucket{endpoint="/projects",method="GET",le="0.025"} 1', lines)
+        self.assertIn('gitlab_api_request_duration_seconds_bucket{endpoint="/projects",method="GET",le="0.25"} 3', lines)
+        self.assertIn('gitlab_backup_last_run_timestamp_seconds 20.0', lines)
+
+    def test_atomic_textfile(self):
+        output_dir = os.path.join(self.tmp_dir, "textfile")
+        os.mkdir(output_dir)
+        path = os.path.join(output_dir, "backup.prom")
+
+        with open(path, "w") as f:
+            f.write("old\n")
+
+        inode = os.stat(path).st_ino
+        gitlab_lib.metrics.inc("gitlab_backup_projects_total", {"result": "ok"})
+        gitlab_lib.metrics.write_textfile(path)
+
+        # replaced by rename, never truncated while the exporter reads it
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+        self.assertEqual(os.listdir(output_dir), ["backup.prom"])
+
+        with unittest.mock.patch("gitlab_lib.metrics.render", side_effect=ValueError("broken")):
+            with self.assertRaises(ValueError):
+                gitlab_lib.metrics.write_textfile(path)
+
+        self.assertEqual(os.listdir(output_dir), ["backup.prom"])
+
+        with open(path) as f:
+            self.assertIn('gitlab_backup_projects_total{result="ok"} 1', f.read().splitlines())
+
+if __name__ == "__main__":
+    unittest.main()
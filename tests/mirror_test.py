@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class MirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, "source")
+        self.mirror_dir = gitlab_lib.mirror.MIRROR_DIR
+        self.max_size = gitlab_lib.mirror.MIRROR_MAX_SIZE
+        gitlab_lib.mirror.enable(os.path.join(self.tmp_dir, "mirrors"))
+        self._git("init", "-q", self.source)
+        self._commit("first")
+
+    def tearDown(self):
+        gitlab_lib.mirror.MIRROR_DIR = self.mirror_dir
+        gitlab_lib.mirror.MIRROR_MAX_SIZE = self.max_size
+        shutil.rmtree(self.tmp_dir)
+
+    def _git(self, *args):
+        return subprocess.check_output(["git", "-c", "user.name=test", "-c", "user.email=test@localhost"] + list(args),
+                                       stderr=subprocess.DEVNULL).decode("utf8")
+
+    def _commit(self, message):
+        self._git("-C", self.source, "commit", "-q", "--allow-empty", "-m", message)
+
+    def _refs(self, repo_dir):
+        return self._git("-C", repo_dir, "for-each-ref", "--format=%(refname)").split()
+
+    def test_update_fetches_and_prunes(self):
+        project = {"id": 1}
+
+        with gitlab_lib.mirror.lock(project):
+            mirror_dir = gitlab_lib.mirror.update(project, self.source)
+
+        self._git("-C", self.source, "branch", "feature")
+        self._commit("second")
+
+        with gitlab_lib.mirror.lock(project):
+            self.assertEqual(gitlab_lib.mirror.update(project, self.source), mirror_dir)
+
+        self.assertIn("refs/heads/feature", self._refs(mirror_dir))
+        self.assertEqual(self._git("-C", mirror_dir, "rev-parse", "HEAD"), self._git("-C", self.source, "rev-parse", "HEAD"))
+
+        self._git("-C", self.source, "branch", "-D", "feature")
+
+        with gitlab_lib.mirror.lock(project):
+            gitlab_lib.mirror.update(project, self.source)
+
+        self.assertNotIn("refs/heads/feature", self._refs(mirror_dir))
+
+    def test_lock_is_exclusive(self):
+        with gitlab_lib.mirror.lock({"id": 1}):
+            with gitlab_lib.mirror.lock({"id": 1}, blocking=False) as locked:
+                self.assertFalse(locked)
+
+            with gitlab_lib.mirror.lock({"id": 2}, blocking=False) as locked:
+                self.assertTrue(locked)
+
+    def test_evict(self):
+        for project_id in (1, 2, 3):
+            with gitlab_lib.mirror.lock({"id": project_id}):
+                gitlab_lib.mirror.update({"id": project_id}, self.source)
+
+        os.utime(gitlab_lib.mirror.mirror_path({"id": 2}), (0, 0))
+
+        # project 1 was deleted
+        (removed, used) = gitlab_lib.mirror.evict(set([2, 3]))
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(gitlab_lib.mirror.mirror_path({"id": 1})))
+
+        # over budget the least recently used mirror goes first
+        gitlab_lib.mirror.MIRROR_MAX_SIZE = used - 1
+        (removed, used) = gitlab_lib.mirror.evict()
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(gitlab_lib.mirror.mirror_path({"id": 2})))
+        self.assertTrue(os.path.exists(gitlab_lib.mirror.mirror_path({"id": 3})))
+
+        # a locked mirror is never removed
+        gitlab_lib.mirror.MIRROR_MAX_SIZE = 0
+
+        with gitlab_lib.mirror.lock({"id": 3}):
+            self.assertEqual(gitlab_lib.mirror.evict()[0], 0)
+
+if __name__ == "__main__":
+    unittest.main()
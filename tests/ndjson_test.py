@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class NdjsonTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = gitlab_lib.chunkstore.STORE_DIR
+        self.records = [{"id": x, "title": "Issue %d\nwith a newline" % (x,)} for x in range(1000)]
+
+    def tearDown(self):
+        gitlab_lib.chunkstore.STORE_DIR = self.store_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, records):
+        with gitlab_lib.ndjson.Writer(self.tmp_dir, "issues") as out:
+            for record in records:
+                out.write(record)
+
+        return out.count
+
+    def test_roundtrip(self):
+        self.assertEqual(self._write(iter(self.records)), len(self.records))
+        self.assertEqual(os.listdir(self.tmp_dir), ["issues.ndjson"])
+        self.assertEqual(list(gitlab_lib.ndjson.iter_dump(self.tmp_dir, "issues")), self.records)
+
+    def test_legacy_json(self):
+        with open(os.path.join(self.tmp_dir, "issues.json"), "w") as f:
+            json.dump(self.records, f)
+
+        self.assertTrue(gitlab_lib.ndjson.exists(self.tmp_dir, "issues"))
+        self.assertEqual(list(gitlab_lib.ndjson.iter_dump(self.tmp_dir, "issues")), self.records)
+
+        # the new dump replaces the legacy one
+        self._write(self.records[:10])
+        self.assertEqual(os.listdir(self.tmp_dir), ["issues.ndjson"])
+        self.assertEqual(list(gitlab_lib.ndjson.iter_dump(self.tmp_dir, "issues")), self.records[:10])
+
+    def test_failed_write(self):
+        def records():
+            yield self.records[0]
+            raise ValueError("page 2 failed")
+
+        self.assertRaises(ValueError, self._write, records())
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        self.assertFalse(gitlab_lib.ndjson.exists(self.tmp_dir, "issues"))
+        self.assertEqual(list(gitlab_lib.ndjson.iter_dump(self.tmp_dir, "issues")), [])
+
+    def test_chunkstore(self):
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+        self._write(self.records)
+
+        # the recipe knows its store
+        gitlab_lib.chunkstore.STORE_DIR = None
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "issues.ndjson.chunks")))
+        self.assertEqual(list(gitlab_lib.ndjson.iter_dump(self.tmp_dir, "issues")), self.records)
+
+    def test_failed_chunkstore_write(self):
+        gitlab_lib.chunkstore.enable(os.path.join(self.tmp_dir, "store"))
+
+        # enough records for some chunks before the error
+        def records():
+            for x in range(10):
+                yield from self.records
+
+            raise ValueError("page 101 failed")
+
+        self.assertRaises(ValueError, self._write, records())
+        self.assertFalse(gitlab_lib.ndjson.exists(self.tmp_dir, "issues"))
+        self.assertEqual([x for (path, dirs, files) in os.walk(os.path.join(self.tmp_dir, "store", "chunks")) for x in files], [])
+
+    def test_iter_lines(self):
+        data = b"".join([json.dumps(x).encode("utf8") + b"\n" for x in self.records])
+        blocks = [data[i:i + 100] for i in range(0, len(data), 100)]
+        self.assertEqual(list(gitlab_lib.ndjson.iter_lines(blocks)), self.records)
+
+if __name__ == "__main__":
+    unittest.main()
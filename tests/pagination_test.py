@@ -0,0 +1,88 @@
+import unittest
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import standin
+
+class PaginationTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        gitlab_lib.close_session()
+
+        for server in self.servers:
+            server.shutdown()
+
+    def _start(self, **kwargs):
+        (server, base_url) = standin.start_server(**kwargs)
+        self.servers.append(server)
+        return (server, base_url)
+
+    def _fetch_ids(self, server, base_url, prefetch, **kwargs):
+        server.request_counts.clear()
+        ids = [x["id"] for x in gitlab_lib.fetch_per_page(base_url + "/projects", 20, prefetch=prefetch, **kwargs)]
+        return (ids, server.request_counts["GET"])
+
+    def test_prefetch_same_result(self):
+        for total_items in (95, 100):
+            (server, base_url) = self._start(total_items=total_items)
+
+            for prefetch in (0, 1, 4):
+                self.assertEqual(self._fetch_ids(server, base_url, prefetch)[0], list(range(1, total_items + 1)))
+
+    def test_no_trailing_page(self):
+        (server, base_url) = self._start(total_items=100, latency=0.01)
+        self.assertEqual(self._fetch_ids(server, base_url, 0)[1], 6)
+        self.assertEqual(self._fetch_ids(server, base_url, 1)[1], 5)
+        self.assertEqual(self._fetch_ids(server, base_url, 4)[1], 5)
+
+    def test_link_header_only(self):
+        # Gitlab omits the totals of huge collections
+        (server, base_url) = self._start(total_items=100, omit_headers=("X-Total", "X-Total-Pages"))
+        self.assertEqual(self._fetch_ids(server, base_url, 4), (list(range(1, 101)), 5))
+
+    def test_no_pagination_headers(self):
+        (server, base_url) = self._start(total_items=100, omit_headers=("X-Total", "X-Total-Pages", "Link"))
+        self.assertEqual(self._fetch_ids(server, base_url, 4), (list(range(1, 101)), 6))
+
+    def test_failing_page(self):
+        for omit_headers in ((), ("X-Total", "X-Total-Pages")):
+            (server, base_url) = self._start(total_items=100, fail_pages=(3,), omit_headers=omit_headers)
+
+            for prefetch in (1, 4):
+                with self.assertRaises(gitlab_lib.exception.WebError):
+                    self._fetch_ids(server, base_url, prefetch)
+
+        (ids, requests) = self._fetch_ids(server, base_url, 4, ignore_errors=True)
+        self.assertEqual(ids, list(range(1, 41)))
+
+    def _keyset_ids(self, server, base_url, sort="asc"):
+        server.request_counts.clear()
+        ids = [x["id"] for x in gitlab_lib.fetch_per_keyset(base_url + "/projects", 20, sort=sort)]
+        return (ids, server.request_counts["GET"])
+
+    def test_keyset_link(self):
+        (server, base_url) = self._start(total_items=100)
+        self.assertEqual(self._keyset_ids(server, base_url), (list(range(1, 101)), 5))
+        self.assertEqual(self._keyset_ids(server, base_url, "desc"), (list(range(100, 0, -1)), 5))
+
+    def test_keyset_ignored(self):
+        # offset Link headers of a server that does not know keyset pagination
+        (server, base_url) = self._start(total_items=100, keyset=False)
+        self.assertEqual(self._keyset_ids(server, base_url), (list(range(1, 101)), 5))
+
+    def test_keyset_id_fallback(self):
+        # no Link header at all: continue after / before the last id ourselves
+        # until an empty or partial page, never repeating the last id
+        (server, base_url) = self._start(total_items=100, keyset=False, omit_headers=("Link",))
+        self.assertEqual(self._keyset_ids(server, base_url), (list(range(1, 101)), 6))
+        self.assertEqual(self._keyset_ids(server, base_url, "desc"), (list(range(100, 0, -1)), 6))
+
+        (server, base_url) = self._start(total_items=95, keyset=False, omit_headers=("Link",))
+        self.assertEqual(self._keyset_ids(server, base_url), (list(range(1, 96)), 5))
+
+if __name__ == "__main__":
+    unittest.main()
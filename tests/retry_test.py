@@ -0,0 +1,106 @@
+import time
+import unittest
+import unittest.mock
+import importlib
+import email.utils
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers={}):
+        self.status_code = status_code
+        self.headers = headers
+        self.closed = False
+        self.text = ""
+        self.content = b""
+
+    def close(self):
+        self.closed = True
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.core_module = importlib.import_module("gitlab_lib.core")
+        self.delays = []
+        self.responses = []
+
+    def _call(self, statuses, method="GET", **kwargs):
+        self.responses = [FakeResponse(x[0], x[1]) if type(x) == tuple else FakeResponse(x) for x in statuses]
+        sent = iter(self.responses)
+
+        with unittest.mock.patch("gitlab_lib.core.__send_request", side_effect=lambda *args: next(sent)) as send, \
+             unittest.mock.patch("gitlab_lib.core.time.sleep", side_effect=self.delays.append):
+            response = self.core_module.rest_api_call("https://localhost/api/v4/projects", method=method, **kwargs)
+
+        return (response, send.call_count)
+
+    def test_retry_after(self):
+        (response, calls) = self._call([(429, {"Retry-After": "7"}), 200])
+        self.assertEqual((response.status_code, calls), (200, 2))
+        self.assertEqual(self.delays, [7.0])
+
+        # Retry-After can be a HTTP date
+        self.delays = []
+        self._call([(503, {"Retry-After": email.utils.formatdate(time.time() + 30, usegmt=True)}), 200])
+        self.assertTrue(25 < self.delays[0] <= 30)
+
+    def test_ratelimit_reset(self):
+        self._call([(429, {"RateLimit-Reset": str(int(time.time()) + 20)}), 200])
+        self.assertTrue(15 < self.delays[0] <= 20)
+
+        # a reset in the past does not wait
+        self.delays = []
+        self._call([(429, {"RateLimit-Reset": str(int(time.time()) - 20)}), 200])
+        self.assertEqual(self.delays, [0])
+
+    def test_clamp_server_delay(self):
+        limit = self.core_module.RETRY_BACKOFF_MAX
+        headers = [{"Retry-After": "86400"},
+                   {"Retry-After": email.utils.formatdate(time.time() + 30 * 86400, usegmt=True)},
+                   {"RateLimit-Reset": str(int(time.time()) + 86400)}]
+
+        for header in headers:
+            self.assertEqual(self.core_module.retry_delay(header, 0), limit)
+
+        self._call([(429, {"Retry-After": "86400"}), 200])
+        self.assertEqual(self.delays, [limit])
+
+    def test_jitter(self):
+        for attempt in range(12):
+            limit = min(self.core_module.RETRY_BACKOFF_MAX, self.core_module.RETRY_BACKOFF * 2 ** attempt)
+            delays = [self.core_module.retry_delay({}, attempt) for x in range(200)]
+            self.assertTrue(all([0 <= x <= limit for x in delays]))
+
+            # full jitter spreads the clients over the whole interval
+            self.assertLess(min(delays), limit / 4)
+            self.assertGreater(max(delays), limit * 3 / 4)
+
+    def test_budget(self):
+        (response, calls) = self._call([502] * 10)
+        self.assertEqual(calls, self.core_module.RETRY_BUDGET["GET"] + 1)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.delays), self.core_module.RETRY_BUDGET["GET"])
+
+        # POST is not idempotent
+        (response, calls) = self._call([429, 200], method="POST")
+        self.assertEqual((response.status_code, calls), (429, 1))
+
+        # unless the caller knows better, like graphql.query
+        (response, calls) = self._call([429, 200], method="POST", retries=3)
+        self.assertEqual((response.status_code, calls), (200, 2))
+
+    def test_not_retryable(self):
+        for status in (400, 403, 404, 500):
+            (response, calls) = self._call([status, 200])
+            self.assertEqual((response.status_code, calls), (status, 1))
+
+        self.assertEqual(self.delays, [])
+
+    def test_close_before_retry(self):
+        self._call([(429, {"Retry-After": "0"}), (503, {"Retry-After": "0"}), 200], stream=True)
+        self.assertEqual([x.closed for x in self.responses], [True, True, False])
+
+if __name__ == "__main__":
+    unittest.main()
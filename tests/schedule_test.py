@@ -0,0 +1,58 @@
+import unittest
+import importlib
+import sys
+sys.path.append('..')
+sys.path.append('../benchmarks')
+
+import gitlab_lib
+import mockgitlab
+
+class ScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.projects = [{"id": x, "name": "project%d" % (x,), "namespace": {"name": "group"}} for x in range(1, 7)]
+
+    def test_estimate(self):
+        project = {"id": 1, "statistics": {"repository_size": 200 * 1024 * 1024, "lfs_objects_size": 100 * 1024 * 1024}, "open_issues_count": 100}
+        self.assertAlmostEqual(gitlab_lib.schedule.estimate(project), gitlab_lib.schedule.PROJECT_SECONDS + 15 + 10)
+        self.assertEqual(gitlab_lib.schedule.estimate(project, {"seconds": 42.0}), 42.0)
+
+        # a failed run did not measure the whole backup
+        self.assertNotEqual(gitlab_lib.schedule.estimate(project, {"seconds": 1.0, "failed": True}), 1.0)
+
+    def test_largest_first(self):
+        manifest = {"projects": dict((str(x["id"]), {"seconds": x["id"] * 10.0}) for x in self.projects[:5])}
+        costs = gitlab_lib.schedule.estimate_all(self.projects, manifest)
+        self.assertEqual([x[0]["id"] for x in gitlab_lib.schedule.largest_first(costs)], [5, 4, 3, 2, 1, 6])
+
+    def test_predict(self):
+        # the big project taken last keeps one worker busy
+        costs = [(x, 10.0) for x in self.projects[:4]] + [(self.projects[4], 40.0)]
+        (schedule, api_makespan) = gitlab_lib.schedule.predict(costs, 2)
+        (schedule, makespan) = gitlab_lib.schedule.predict(gitlab_lib.schedule.largest_first(costs), 2)
+        self.assertEqual(api_makespan, 60.0)
+        self.assertEqual(makespan, 40.0)
+        self.assertEqual([(x[0]["id"], x[1], x[2]) for x in schedule[:3]], [(5, 0, 0.0), (1, 1, 0.0), (2, 1, 10.0)])
+
+    def test_report(self):
+        lines = gitlab_lib.schedule.report([(x, 3600.0) for x in self.projects], 4, 0)
+        self.assertEqual(len(lines), len(self.projects) + 2)
+        self.assertTrue(lines[-1].startswith("6 projects with 4 processes take 2:00:00 (2:00:00 in API order)"))
+
+    def test_statistics(self):
+        (server, base_url) = mockgitlab.start_mock(projects=3, users=2, groups=1)
+        projects_module = importlib.import_module("gitlab_lib.projects")
+        api_base_url = projects_module.API_BASE_URL
+        projects_module.API_BASE_URL = base_url
+
+        try:
+            projects = list(gitlab_lib.get_projects(statistics=True))
+        finally:
+            projects_module.API_BASE_URL = api_base_url
+            gitlab_lib.close_session()
+            server.shutdown()
+
+        self.assertTrue(all([x["statistics"]["repository_size"] > 0 for x in projects]))
+        self.assertTrue(all([gitlab_lib.schedule.estimate(x) > gitlab_lib.schedule.PROJECT_SECONDS for x in projects]))
+
+if __name__ == "__main__":
+    unittest.main()
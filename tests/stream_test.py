@@ -0,0 +1,56 @@
+import json
+import unittest
+import unittest.mock
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+class FakeResponse:
+    def __init__(self, body, chunk_size):
+        self.body = body.encode("utf-8")
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size):
+        for x in range(0, len(self.body), self.chunk_size):
+            yield self.body[x:x + self.chunk_size]
+
+class CountingDecoder(json.JSONDecoder):
+    calls = 0
+
+    def raw_decode(self, s, idx=0):
+        CountingDecoder.calls += 1
+        return super().raw_decode(s, idx)
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        CountingDecoder.calls = 0
+
+    def _parse(self, elements, chunk_size):
+        response = FakeResponse(json.dumps(elements), chunk_size)
+        return list(gitlab_lib.iter_json_array(response))
+
+    def test_elements(self):
+        elements = [{"id": x, "title": "Issue ä %d" % (x,)} for x in range(50)] + [1, 2.5, "x", None]
+
+        for chunk_size in (1, 7, 65536):
+            self.assertEqual(self._parse(elements, chunk_size), elements)
+
+        self.assertEqual(self._parse([], 1), [])
+        self.assertEqual(list(gitlab_lib.iter_json_array(FakeResponse('{"message": "404"}', 1))), [])
+
+    def test_broken(self):
+        with self.assertRaises(ValueError):
+            list(gitlab_lib.iter_json_array(FakeResponse('[{"id": 1}, {"id"', 1)))
+
+    def test_large_element(self):
+        # a big issue description arriving byte by byte must not be decoded once per byte
+        elements = [{"id": 1, "description": "ü" * 200000}, {"id": 2}]
+
+        with unittest.mock.patch("gitlab_lib.core.json.JSONDecoder", CountingDecoder):
+            self.assertEqual(self._parse(elements, 1), elements)
+
+        self.assertLess(CountingDecoder.calls, 100)
+
+if __name__ == "__main__":
+    unittest.main()
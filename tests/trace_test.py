@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+
+import gitlab_lib
+
+def traced_child():
+    with gitlab_lib.trace.span("project", project="group/child"):
+        pass
+
+    gitlab_lib.trace.flush()
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = gitlab_lib.trace.SPOOL_DIR
+        self.tmp_dir = tempfile.mkdtemp()
+        gitlab_lib.trace.enable(os.path.join(self.tmp_dir, "spool"))
+
+    def tearDown(self):
+        gitlab_lib.trace.flush()
+        gitlab_lib.trace.SPOOL_DIR = self.spool_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def _events(self):
+        return dict((x["name"], x) for x in gitlab_lib.trace.collect())
+
+    def test_nesting(self):
+        with gitlab_lib.trace.span("project", project="group/project"):
+            with gitlab_lib.trace.span("clone"):
+                with gitlab_lib.trace.span("fetch", project="group/other"):
+                    pass
+
+        events = self._events()
+        self.assertEqual(events["clone"]["args"]["project"], "group/project")
+        self.assertEqual(events["fetch"]["args"]["project"], "group/other")
+
+        for (parent, child) in (("project", "clone"), ("clone", "fetch")):
+            self.assertGreaterEqual(events[child]["ts"], events[parent]["ts"])
+            self.assertLessEqual(events[child]["ts"] + events[child]["dur"], events[parent]["ts"] + events[parent]["dur"])
+
+    def test_fork(self):
+        # a forked process spools its own events but not the unflushed ones of its parent
+        with gitlab_lib.trace.span("project", project="group/parent"):
+            pass
+
+        process = gitlab_lib.create_process(traced_child, ())
+        process.join()
+        events = gitlab_lib.trace.collect()
+
+        self.assertEqual(len(gitlab_lib.core.spool_files(gitlab_lib.trace.SPOOL_DIR, "trace", ".jsonl")), 2)
+        self.assertEqual(sorted([(x["pid"], x["args"]["project"]) for x in events]),
+                         sorted([(os.getpid(), "group/parent"), (process.pid, "group/child")]))
+
+    def test_write(self):
+        with gitlab_lib.trace.span("project", project="group/project"):
+            with gitlab_lib.trace.span("clone"):
+                pass
+
+        path = os.path.join(self.tmp_dir, "trace.json")
+        gitlab_lib.trace.write(path)
+
+        with open(path) as f:
+            trace = json.load(f)
+
+        self.assertEqual(trace["displayTimeUnit"], "ms")
+        metadata = [x for x in trace["traceEvents"] if x["ph"] == "M"]
+        spans = [x for x in trace["traceEvents"] if x["ph"] == "X"]
+        self.assertEqual(metadata, [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "worker %d" % (os.getpid(),)}}])
+        self.assertEqual([x["name"] for x in spans], ["project", "clone"])
+
+        for event in spans:
+            self.assertEqual(event["pid"], os.getpid())
+
+            for key in ("ts", "dur", "pid", "tid"):
+                self.assertIsInstance(event[key], int)
+
+    def test_summary(self):
+        events = [{"name": "project", "dur": x * 1000000, "args": {"project": "group/p%d" % (x,)}} for x in (3, 1, 4, 2)]
+        events += [{"name": "clone", "dur": x * 1000000, "args": {"project": "group/p%d" % (x,)}} for x in (1, 5)]
+        lines = gitlab_lib.trace.summary(events, top=2)
+
+        self.assertEqual(lines[0], "Top 2 slowest projects:")
+        self.assertTrue(lines[1].endswith("group/p4") and lines[2].endswith("group/p3"))
+        self.assertEqual(lines[3], "Top 2 slowest stages:")
+        self.assertEqual([x.split()[0] for x in lines[4:]], ["5.0s", "1.0s"])
+        self.assertEqual(len(lines), 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,6 +31,8 @@ import argparse
 import gitlab_lib
 import gitlab_config
 
+gitlab_lib.drop_privileges()
+
 permission = {
     "guest": gitlab_lib.ACCESS_LEVEL_GUEST,
     "reporter": gitlab_lib.ACCESS_LEVEL_REPORTER,
@@ -59,7 +61,7 @@ args = parser.parse_args()
 members = []
 project = None
 
-gitlab_lib.core.SERVER = args.server
+gitlab_lib.set_server(args.server)
 gitlab_lib.core.TOKEN = args.token
 gitlab_lib.core.DEBUG = args.debug
 gitlab_lib.core.QUIET = args.quiet
@@ -122,4 +124,7 @@ for member in members:
         else:
             gitlab_lib.edit_project_member(project[0]["id"], user['id'], permission[args.permission])
 
+if args.debug:
+    gitlab_lib.log_memo_stats()
+
 gitlab_lib.info("Finished.")